@@ -12,6 +12,7 @@ import os
 
 from app.database import get_db, SpottedMessage, MessageStatus, SessionLocal
 from app.admin.security import authenticate_user, create_access_token, get_current_user
+from app.tasks import check_duplicate, invalidate_card, moderate_message_task, prerender_card_task, record_posted, request_card, story_frames
 from config import settings # Import settings
 
 # --- Configurazione ---
@@ -23,6 +24,9 @@ router = APIRouter(
 
 templates = Jinja2Templates(directory="app/admin/templates")
 
+# Stati da cui l'admin può chiedere una nuova moderazione AI
+REMODERATABLE_STATUSES = (MessageStatus.PENDING, MessageStatus.REVIEW, MessageStatus.FAILED)
+
 # --- Rotte di Login / Logout ---
 
 @router.get("/login", response_class=HTMLResponse, name="login_page")
@@ -183,7 +187,6 @@ def schedule_daily_post(background_tasks: BackgroundTasks, db: Session = Depends
 
 async def post_daily_messages(messages, db: Session):
     """Post all approved messages from today at 8 PM"""
-    from app.image.generator import ImageGenerator
     from app.bot.poster import InstagramBot
     
     print(f"Starting daily posting of {len(messages)} messages...")
@@ -192,17 +195,14 @@ async def post_daily_messages(messages, db: Session):
         try:
             print(f"Posting message ID {message.id}...")
             
-            # Generate image
-            image_generator = ImageGenerator()
-            output_filename = f"spotted_{message.id}_{int(datetime.now().timestamp())}.png"
-            image_path = image_generator.from_text(message.text, output_filename, message.id)
-            
-            if not image_path:
-                raise Exception("Image generation failed")
+            # Use the card pre-rendered at approval time (rendered by the render service if missing)
+            image_path = request_card(message, db)
+            if check_duplicate(message, image_path):
+                continue
             
             # Post to Instagram
             insta_bot = InstagramBot()
-            result = insta_bot.post_story(image_path)
+            result = insta_bot.post_story_sequence(story_frames(message))
             
             if not result:
                 raise Exception("Instagram posting failed")
@@ -220,6 +220,7 @@ async def post_daily_messages(messages, db: Session):
             message.posted_at = datetime.utcnow()
             message.error_message = None
             message.media_pk = str(media_pk)
+            record_posted(message)
             
             print(f"Message ID {message.id} posted successfully")
             
@@ -237,7 +238,7 @@ async def post_daily_messages(messages, db: Session):
         db.rollback()
 
 @router.post("/messages/{message_id}/edit")
-async def edit_message(message_id: int, request: Request, db: Session = Depends(get_db), user: str = Depends(get_authenticated_user)):
+async def edit_message(message_id: int, request: Request, background_tasks: BackgroundTasks, db: Session = Depends(get_db), user: str = Depends(get_authenticated_user)):
     if isinstance(user, RedirectResponse): return user
     
     try:
@@ -253,10 +254,16 @@ async def edit_message(message_id: int, request: Request, db: Session = Depends(
             return {"status": "error", "message": "Message not found"}
         
         # Update the message
+        text_changed = message.text != new_text
         message.text = new_text
         message.gemini_analysis = None  # Reset AI analysis since content changed
+        if text_changed:
+            invalidate_card(message)  # The pre-rendered card shows the old text
         db.commit()
         
+        if text_changed and message.status == MessageStatus.APPROVED:
+            background_tasks.add_task(prerender_card_task, message_id)
+        
         return {"status": "success", "message": "Message updated successfully"}
         
     except Exception as e:
@@ -296,20 +303,24 @@ def save_admin_note(message_id: int, note: str = Form(...), db: Session = Depend
     return {"status": "success", "note": note}
 
 @router.post("/messages/{message_id}/edit")
-def edit_message_text(message_id: int, text: str = Form(...), db: Session = Depends(get_db), user: str = Depends(get_authenticated_user)):
+def edit_message_text(message_id: int, background_tasks: BackgroundTasks, text: str = Form(...), db: Session = Depends(get_db), user: str = Depends(get_authenticated_user)):
     if isinstance(user, RedirectResponse): return user
 
     message = db.query(SpottedMessage).filter(SpottedMessage.id == message_id).first()
     if not message:
         raise HTTPException(status_code=404, detail="Messaggio non trovato")
     
+    if message.text != text:
+        invalidate_card(message)  # La card pre-renderizzata mostra il vecchio testo
+        if message.status == MessageStatus.APPROVED:
+            background_tasks.add_task(prerender_card_task, message_id)
     message.text = text
     db.commit()
     return {"status": "success", "new_text": text}
 
 
 @router.post("/messages/bulk-update")
-def bulk_update_messages(request: BulkUpdateRequest, db: Session = Depends(get_db), user: str = Depends(get_authenticated_user)):
+def bulk_update_messages(request: BulkUpdateRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db), user: str = Depends(get_authenticated_user)):
     if isinstance(user, RedirectResponse): return user
 
     if request.action not in ["approve", "reject"]:
@@ -326,6 +337,10 @@ def bulk_update_messages(request: BulkUpdateRequest, db: Session = Depends(get_d
     
     db.commit()
     
+    if new_status == MessageStatus.APPROVED:
+        for message_id in request.message_ids:
+            background_tasks.add_task(prerender_card_task, message_id)
+    
     return {"status": "success", "updated_count": len(request.message_ids)}
 
 @router.get("/dashboard", response_class=HTMLResponse, name="show_dashboard")
@@ -402,7 +417,7 @@ def approve_message(
     db.commit()
     print(f"--- DEBUG: Commit eseguito. Stato per ID {message_id} è ora APPROVED. ---")
     
-    # Posta automaticamente il messaggio approvato
+    # Posting automatico: la card la genera request_card, un pre-render separato la renderizzerebbe due volte
     print(f"--- DEBUG: Avvio posting automatico per messaggio ID: {message_id} ---")
     background_tasks.add_task(post_single_message, message_id)
     
@@ -423,9 +438,47 @@ def reject_message(message_id: int, db: Session = Depends(get_db), user: str = D
     
     return {"status": "success", "message": "Messaggio rifiutato", "message_id": message_id}
 
+@router.post("/messages/{message_id}/remoderate")
+def remoderate_message(
+    message_id: int,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    user: str = Depends(get_authenticated_user)
+):
+    """Rimette il messaggio in attesa della moderazione AI, prima dei nuovi invii."""
+    if isinstance(user, RedirectResponse): 
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    
+    message = db.query(SpottedMessage).filter(SpottedMessage.id == message_id).first()
+    if not message:
+        raise HTTPException(status_code=404, detail="Messaggio non trovato")
+    # Un messaggio pubblicato, rifiutato o segnalato come duplicato non deve poter tornare APPROVED
+    if message.status not in REMODERATABLE_STATUSES or message.duplicate_of_id:
+        raise HTTPException(status_code=409, detail=f"Un messaggio in stato {message.status.value} non può essere rimoderato")
+    
+    from app.ai.service import PRIORITY_ADMIN, QUEUED_ANALYSIS, get_moderation_service
+    message.status = MessageStatus.PENDING
+    message.gemini_analysis = QUEUED_ANALYSIS
+    db.commit()
+    
+    if not settings.moderation.service_enabled:
+        # Nessun servizio di moderazione che svuoti la coda: analisi diretta in background
+        background_tasks.add_task(moderate_message_task, message_id)
+        return {"status": "success", "message": "Moderazione AI avviata", "message_id": message_id}
+    
+    service = get_moderation_service()
+    job_id = service.submit(message_id, priority=PRIORITY_ADMIN)
+    
+    return {
+        "status": "success",
+        "message": "Messaggio in coda per la moderazione AI",
+        "message_id": message_id,
+        "job_id": job_id,
+        "expected_drain_seconds": service.stats()["expected_drain_seconds"]
+    }
+
 def post_single_message(message_id: int):
     """Posta un singolo messaggio approvato su Instagram."""
-    from app.image.generator import ImageGenerator
     from app.bot.poster import InstagramBot
     
     db = SessionLocal()
@@ -437,17 +490,15 @@ def post_single_message(message_id: int):
         
         print(f"--- DEBUG [POST]: Inizio pubblicazione messaggio ID {message_id} ---")
         
-        # Genera immagine
-        image_generator = ImageGenerator()
-        output_filename = f"spotted_{message.id}_{int(datetime.now().timestamp())}.png"
-        image_path = image_generator.from_text(message.text, output_filename, message.id)
-        
-        if not image_path:
-            raise Exception("Image generation failed")
+        # Card pre-renderizzata all'approvazione (se manca la genera il servizio di rendering)
+        image_path = request_card(message, db)
+        if check_duplicate(message, image_path):
+            db.commit()
+            return
         
         # Posta su Instagram
         insta_bot = InstagramBot()
-        result = insta_bot.post_story(image_path)
+        result = insta_bot.post_story_sequence(story_frames(message))
         
         if not result:
             raise Exception("Instagram posting failed")
@@ -465,6 +516,7 @@ def post_single_message(message_id: int):
         message.posted_at = datetime.utcnow()
         message.error_message = None
         message.media_pk = str(media_pk)
+        record_posted(message)
         
         db.commit()
         print(f"--- DEBUG [POST]: Messaggio ID {message_id} pubblicato con successo. Media PK: {media_pk} ---")
@@ -620,13 +672,98 @@ def get_instagram_settings(user: str = Depends(get_current_user)):
 
 @router.get("/api/settings/gemini")
 def get_gemini_settings(user: str = Depends(get_current_user)):
-    """Ottieni stato Gemini API."""
+    """Ottieni stato Gemini API e statistiche di batch, filtro locale, cache e coda della moderazione."""
     import os
+    from app.ai.batching import get_moderation_batcher
+    from app.ai.cache import get_moderation_cache
+    from app.ai.prefilter import get_prefilter
+    from app.ai.service import get_moderation_service
     return {
         "status": "Configured" if os.getenv("GEMINI_API_KEY") else "Not configured",
-        "configured": bool(os.getenv("GEMINI_API_KEY"))
+        "configured": bool(os.getenv("GEMINI_API_KEY")),
+        "batching": get_moderation_batcher().stats(),
+        "prefilter": get_prefilter().stats(),
+        "cache": get_moderation_cache().stats(),
+        "service": get_moderation_service().stats()
     }
 
+@router.get("/api/render/stats")
+def get_render_stats(user: str = Depends(get_current_user)):
+    """Stato dei backend di rendering: latenze, circuit breaker, routing e cache."""
+    from app.image.backends import get_backend_registry
+    from app.image.cache import get_render_cache
+    from app.image.wkhtml_daemon import get_wkhtml_daemon
+
+    stats = get_backend_registry().stats()
+    stats["wkhtmltoimage_daemon"] = get_wkhtml_daemon().stats()
+    stats["render_cache"] = get_render_cache().stats()
+    from app.image.encoder import get_target_encoder
+    stats["encoder"] = get_target_encoder().stats()
+    from app.image.renderer import get_template_renderer
+    stats["templates"] = get_template_renderer().stats()
+    from app.image.preview import get_preview_service
+    stats["previews"] = get_preview_service().stats()
+    from app.image.jobs import get_render_queue
+    stats["render_queue"] = get_render_queue().stats()
+    from app.image.dedup import get_duplicate_index
+    stats["duplicates"] = get_duplicate_index().stats()
+    try:
+        from app.image.browser_pool import get_browser_pool
+        stats["browser_pool"] = get_browser_pool().stats()
+    except RuntimeError:
+        stats["browser_pool"] = None
+    return stats
+
+@router.get("/api/templates")
+def list_card_templates(user: str = Depends(get_current_user)):
+    """Template delle card disponibili, con versione e template attivo."""
+    from app.image.backends import get_backend_registry
+    from app.image.renderer import get_template_renderer
+
+    renderer = get_template_renderer()
+    registry = get_backend_registry()
+    templates_list = renderer.templates()
+    for template in templates_list:
+        template["requires_browser"] = registry.requires_browser(template["name"])
+    return {"active": renderer.active_template, "templates": templates_list, "stats": renderer.stats()}
+
+@router.post("/api/templates/active")
+def set_card_template(background_tasks: BackgroundTasks, name: str = Form(...), user: str = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    Cambia a runtime il template delle card spotted. I render in corso finiscono
+    con il template precedente; le card già pre-renderizzate dei messaggi
+    approvati vengono rigenerate in background.
+    """
+    from app.image.renderer import get_template_renderer
+
+    try:
+        get_template_renderer().set_active_template(name)
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+    approved_ids = [row.id for row in db.query(SpottedMessage.id).filter(
+        SpottedMessage.status == MessageStatus.APPROVED,
+        SpottedMessage.card_path.isnot(None)
+    )]
+    for message_id in approved_ids:
+        background_tasks.add_task(prerender_card_task, message_id)
+    return {"status": "success", "active": name, "rerendering": len(approved_ids)}
+
+@router.get("/api/assets/stats")
+def get_asset_stats(scan: bool = False, user: str = Depends(get_current_user)):
+    """Spazio occupato dalle immagini generate; scan=true ricalcola spazio su disco e byte recuperabili dal GC."""
+    from app.image.store import get_asset_store
+    return get_asset_store().stats(scan=scan)
+
+@router.post("/api/assets/gc")
+def run_asset_gc(dry_run: bool = False, user: str = Depends(get_current_user)):
+    """Applica subito le politiche di retention (dry_run=true per la sola simulazione)."""
+    from app.image.store import get_asset_store
+    try:
+        return {"status": "success", "report": get_asset_store().gc(dry_run=dry_run)}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
 # --- Info Cards Management ---
 
 @router.get("/info-cards", response_class=HTMLResponse, name="info_cards_page")
@@ -727,29 +864,36 @@ def publish_info_card(card_id: int, user: str = Depends(get_current_user), db: S
 
 @router.post("/api/info-cards/preview")
 def preview_info_card(
+    request: Request,
     title: str = Form(""),
     text: str = Form(""),
     user: str = Depends(get_current_user)
 ):
-    """API per ottenere una preview dell'info card come immagine."""
+    """
+    API per l'anteprima dell'info card: JPEG a bassa risoluzione servito dalla
+    memoria. Le richieste ravvicinate dello stesso admin vengono raggruppate;
+    la card a piena risoluzione si genera solo alla pubblicazione.
+    """
     try:
         if not title or not text:
             title = "Titolo Card"
             text = "Il contenuto apparirà qui..."
 
-        # Usa il generatore di immagini per creare una preview
-        from app.image.generator import ImageGenerator
-        generator = ImageGenerator()
+        from app.image.preview import get_preview_service
 
-        # Genera l'immagine con message_type="INFO"
-        image_path = generator.from_text(text, f"preview_{hash(title+text)}", message_type="INFO", title=title)
+        # Una sessione per cookie di login (mai il token in chiaro come chiave)
+        session_key = hashlib.sha256((request.cookies.get("access_token") or user or "").encode()).hexdigest()
+        preview = get_preview_service().request(session_key, title, text)
 
-        if image_path:
-            # Restituisci l'URL relativa dell'immagine
-            image_url = f"/generated_images/{image_path.split('/')[-1]}"
-            return {"status": "success", "image_url": image_url}
-        else:
-            return {"status": "error", "message": "Failed to generate preview image"}
+        return Response(
+            content=preview.data,
+            media_type="image/jpeg",
+            headers={
+                "Cache-Control": "no-store",
+                "X-Preview-Backend": preview.backend,
+                "X-Preview-Ms": f"{preview.ms:.0f}",
+            },
+        )
 
     except Exception as e:
         return {"status": "error", "message": str(e)}
@@ -775,6 +919,10 @@ def delete_info_card(card_id: int, user: str = Depends(get_current_user), db: Se
         db.delete(info_card)
         db.commit()
 
+        # La card non è più referenziata: il prossimo GC la elimina
+        from app.image.store import get_asset_store
+        get_asset_store().release(card_id)
+
         return {"status": "success", "message": "Info card eliminata con successo"}
     except Exception as e:
         db.rollback()
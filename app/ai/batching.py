@@ -0,0 +1,148 @@
+"""
+Micro-batching delle richieste di moderazione.
+
+I task di moderazione non chiamano Gemini direttamente: accodano il messaggio
+e attendono l'esito. Un thread raccoglie i messaggi arrivati entro
+`batch_max_wait_ms` dal primo (o fino a `batch_max_items`) e li analizza con
+una sola richiesta, che restituisce un array JSON di esiti indicizzati per id.
+Durante un picco di invii, venti messaggi costano una richiesta invece di
+venti. I messaggi a cui il modello non ha risposto in modo valido vengono
+analizzati singolarmente; un errore di quota o di API arriva a tutti i task
+del batch, che lo gestiscono come prima.
+"""
+
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.ai.gemini_moderator import ModerationResult, get_moderator
+from config import settings
+
+
+class _PendingItem:
+    __slots__ = ("message_id", "text", "done", "result", "error")
+
+    def __init__(self, message_id: int, text: str):
+        self.message_id = message_id
+        self.text = text
+        self.done = threading.Event()
+        self.result: Optional[ModerationResult] = None
+        self.error: Optional[Exception] = None
+
+
+def moderate_items(moderator, items: List[Tuple[int, str]]) -> Tuple[Dict[int, ModerationResult], int]:
+    """
+    Esiti per una lista di (id, testo): una sola richiesta per il gruppo, poi
+    singolarmente i messaggi senza un esito valido. Restituisce gli esiti
+    per id e il numero di richieste fatte a Gemini.
+    """
+    results = {}
+    requests = 0
+    if len(items) > 1:
+        requests += 1
+        results = moderator.moderate_batch(items)
+        print(f"--- [Moderator] Batch di {len(items)} messaggi analizzato con una richiesta ({len(results)} esiti) ---")
+    for message_id, text in items:
+        if message_id not in results:
+            # Messaggio singolo, o assente/malformato nella risposta del batch
+            requests += 1
+            results[message_id] = moderator.moderate_message(text)
+    return results, requests
+
+
+class ModerationBatcher:
+    """Raccoglie le richieste di moderazione e le invia a Gemini a gruppi."""
+
+    def __init__(self, moderator_factory: Callable = get_moderator, max_items: int = None, max_wait_ms: int = None):
+        self.moderator_factory = moderator_factory
+        self.max_items = max(1, max_items or settings.moderation.batch_max_items)
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else settings.moderation.batch_max_wait_ms) / 1000
+        self._pending: List[_PendingItem] = []
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self.requests = 0
+        self.batches = 0
+        self.items = 0
+        self.fallbacks = 0
+        self.errors = 0
+
+    def moderate(self, message_id: int, text: str, timeout: float = None) -> ModerationResult:
+        """
+        Accoda il messaggio e attende il suo esito. Gli errori di configurazione
+        (pacchetto o chiave mancanti) vengono sollevati subito, senza accodare.
+        """
+        self.moderator_factory()
+        item = _PendingItem(message_id, text)
+        with self._cond:
+            self._pending.append(item)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="moderation-batcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        if not item.done.wait(timeout or settings.moderation.batch_timeout_seconds):
+            raise TimeoutError(f"Moderazione del messaggio ID {message_id} non completata in tempo")
+        if item.error is not None:
+            raise item.error
+        return item.result
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._process(batch)
+            except Exception as e:
+                # Errore di quota o API: lo ricevono tutti i task del batch
+                self.errors += 1
+                for item in batch:
+                    if not item.done.is_set():
+                        item.error = e
+                        item.done.set()
+
+    def _next_batch(self) -> List[_PendingItem]:
+        """Attende il primo messaggio, poi al massimo max_wait (o max_items messaggi)."""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._pending) < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch, self._pending = self._pending[:self.max_items], self._pending[self.max_items:]
+            return batch
+
+    def _process(self, batch: List[_PendingItem]):
+        self.batches += 1
+        self.items += len(batch)
+        results, requests = moderate_items(self.moderator_factory(), [(item.message_id, item.text) for item in batch])
+        self.requests += requests
+        if len(batch) > 1:
+            self.fallbacks += requests - 1
+        for item in batch:
+            item.result = results[item.message_id]
+            item.done.set()
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "items": self.items,
+            "requests": self.requests,
+            "avg_batch_size": round(self.items / self.batches, 2) if self.batches else None,
+            "fallbacks": self.fallbacks,
+            "errors": self.errors,
+        }
+
+
+_batcher: Optional[ModerationBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_moderation_batcher() -> ModerationBatcher:
+    """Restituisce il batcher di moderazione condiviso dal processo."""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = ModerationBatcher()
+        return _batcher
@@ -0,0 +1,206 @@
+"""
+Cache degli esiti della moderazione AI.
+
+La chiave è lo sha256 del testo normalizzato (minuscole, senza accenti,
+punteggiatura, emoji e spazi doppi), così lo stesso messaggio reinviato con
+piccole varianti di forma non costa una nuova chiamata a Gemini. Per i testi
+abbastanza lunghi vale anche il SimHash a 64 bit: un testo entro
+`cache_max_distance` bit da uno già rifiutato (o messo in attesa) ne riusa
+l'esito, così lo spam reinviato con qualche ritocco non torna all'AI. Una
+approvazione vale solo per lo stesso testo: anche una parola cambiata può
+trasformare un messaggio innocuo in un insulto. Il SimHash è salvato in otto
+blocchi da 8 bit indicizzati, quindi la ricerca dei quasi duplicati è una
+query sugli indici e non richiede stato in memoria.
+
+Gli esiti stanno nel database: sopravvivono ai riavvii e sono condivisi tra
+l'app web e worker.py. Scadono dopo `cache_ttl_hours` e oltre
+`cache_max_entries` voci vengono eliminate quelle usate meno di recente.
+"""
+
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple, Optional
+
+from sqlalchemy import or_
+
+from app.ai.gemini_moderator import ModerationResult
+from app.database import ModerationCacheEntry
+from app.text_fingerprint import TEXT_BITS, from_hex, hamming, normalize_text, text_fingerprint, to_hex
+from config import settings
+
+BANDS = 8
+BAND_BITS = TEXT_BITS // BANDS
+# Esiti riusabili per un testo solo simile
+NEAR_DECISIONS = ("REJECT", "PENDING")
+PRUNE_EVERY = 50  # Scritture tra una pulizia e l'altra
+
+# Prefisso di gemini_analysis per gli esiti presi dalla cache
+CACHE_MARKER = "[Cache]"
+
+
+class CachedModeration(NamedTuple):
+    result: ModerationResult
+    match: str  # exact | near
+    distance: int
+
+
+def _bands(fingerprint: int) -> list:
+    return [fingerprint >> (i * BAND_BITS) & ((1 << BAND_BITS) - 1) for i in range(BANDS)]
+
+
+class ModerationCache:
+    """Esiti della moderazione nel database, con TTL ed eviction LRU."""
+
+    def __init__(self, session_factory: Callable = None, ttl_hours: int = None, max_entries: int = None,
+                 max_distance: int = None, min_near_chars: int = None):
+        if session_factory is None:
+            from app.database import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+        moderation = settings.moderation
+        self.ttl = timedelta(hours=ttl_hours if ttl_hours is not None else moderation.cache_ttl_hours)
+        self.max_entries = max_entries if max_entries is not None else moderation.cache_max_entries
+        # I blocchi garantiscono i quasi duplicati solo fino a BANDS - 1 bit
+        self.max_distance = min(max_distance if max_distance is not None else moderation.cache_max_distance, BANDS - 1)
+        self.min_near_chars = min_near_chars if min_near_chars is not None else moderation.cache_min_near_chars
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = {"exact": 0, "near": 0}
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def _keys(self, text: str):
+        normalized = normalize_text(text)
+        if not normalized:
+            return None, None
+        text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        fingerprint = text_fingerprint(normalized) if len(normalized) >= self.min_near_chars else None
+        return text_hash, fingerprint
+
+    def get(self, text: str) -> Optional[CachedModeration]:
+        """Esito registrato per lo stesso testo o, in mancanza, per il più vicino entro la soglia."""
+        text_hash, fingerprint = self._keys(text)
+        if text_hash is None:
+            return None
+        now = datetime.utcnow()
+        db = self.session_factory()
+        try:
+            entry = db.get(ModerationCacheEntry, text_hash)
+            match, distance = "exact", 0
+            if entry is not None and entry.expires_at <= now:
+                entry = None
+            if entry is None and fingerprint is not None:
+                candidates = db.query(ModerationCacheEntry).filter(
+                    ModerationCacheEntry.expires_at > now,
+                    ModerationCacheEntry.decision.in_(NEAR_DECISIONS),
+                    or_(*[getattr(ModerationCacheEntry, f"band{i}") == band for i, band in enumerate(_bands(fingerprint))]),
+                ).all()
+                scored = sorted(
+                    (hamming(fingerprint, from_hex(candidate.simhash)), candidate.text_hash, candidate)
+                    for candidate in candidates if candidate.simhash
+                )
+                if scored and scored[0][0] <= self.max_distance:
+                    distance, _, entry = scored[0]
+                    match = "near"
+            if entry is None:
+                with self._lock:
+                    self.misses += 1
+                return None
+            entry.hits = (entry.hits or 0) + 1
+            entry.last_used_at = now
+            result = ModerationResult(entry.decision, entry.reason, entry.category)
+            db.commit()
+        finally:
+            db.close()
+        with self._lock:
+            self.hits[match] += 1
+        return CachedModeration(result, match, distance)
+
+    def put(self, text: str, result: ModerationResult):
+        """Registra l'esito di Gemini per il testo (sovrascrive quello scaduto o precedente)."""
+        text_hash, fingerprint = self._keys(text)
+        if text_hash is None:
+            return
+        now = datetime.utcnow()
+        bands = _bands(fingerprint) if fingerprint is not None else [None] * BANDS
+        db = self.session_factory()
+        try:
+            entry = db.get(ModerationCacheEntry, text_hash) or ModerationCacheEntry(text_hash=text_hash)
+            entry.simhash = to_hex(fingerprint, TEXT_BITS)
+            for i, band in enumerate(bands):
+                setattr(entry, f"band{i}", band)
+            entry.decision, entry.reason, entry.category = result.decision, result.reason, result.category
+            entry.created_at = entry.last_used_at = now
+            entry.expires_at = now + self.ttl
+            db.add(entry)
+            db.commit()
+        except Exception as e:
+            # Lo stesso testo registrato in contemporanea da un altro processo
+            db.rollback()
+            print(f"--- [ModerationCache] Esito non salvato: {e} ---")
+            return
+        finally:
+            db.close()
+        with self._lock:
+            self.stores += 1
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 1
+        if prune:
+            self.prune()
+
+    def prune(self, now: datetime = None) -> int:
+        """Elimina le voci scadute e, oltre il limite, quelle usate meno di recente."""
+        now = now or datetime.utcnow()
+        db = self.session_factory()
+        try:
+            removed = db.query(ModerationCacheEntry).filter(
+                ModerationCacheEntry.expires_at <= now
+            ).delete(synchronize_session=False)
+            excess = db.query(ModerationCacheEntry).count() - self.max_entries
+            if excess > 0:
+                oldest = db.query(ModerationCacheEntry.text_hash).order_by(
+                    ModerationCacheEntry.last_used_at
+                ).limit(excess).subquery()
+                removed += db.query(ModerationCacheEntry).filter(
+                    ModerationCacheEntry.text_hash.in_(oldest.select())
+                ).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+        with self._lock:
+            self.evictions += removed
+        return removed
+
+    def stats(self) -> dict:
+        db = self.session_factory()
+        try:
+            entries = db.query(ModerationCacheEntry).count()
+        finally:
+            db.close()
+        lookups = sum(self.hits.values()) + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": dict(self.hits),
+            "misses": self.misses,
+            "hit_rate": round(sum(self.hits.values()) / lookups, 3) if lookups else None,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+
+_cache: Optional[ModerationCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_moderation_cache() -> ModerationCache:
+    """Restituisce la cache della moderazione condivisa dal processo."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            from app.database import Base, engine
+            Base.metadata.create_all(bind=engine, tables=[ModerationCacheEntry.__table__])
+            _cache = ModerationCache()
+        return _cache
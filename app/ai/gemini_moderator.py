@@ -13,8 +13,9 @@ except ImportError:
     genai = None
 
 import json
+import threading
 from config import settings
-from typing import NamedTuple
+from typing import NamedTuple, Optional
 
 # --- Struttura per la Risposta di Moderazione ---
 class ModerationResult(NamedTuple):
@@ -25,19 +26,8 @@ class ModerationResult(NamedTuple):
     reason: str    # Spiegazione della decisione
     category: str  # Categoria del contenuto (es. "Safe", "Insult", "Link")
 
-class GeminiModerator:
-    """
-    Modera i messaggi utilizzando il modello Gemini con regole specifiche.
-    """
-    def __init__(self):
-        if genai is None:
-            raise ImportError("google-generativeai package not installed. Install it with: pip install google-generativeai")
-        if not settings.gemini_api_key:
-            raise ValueError("GEMINI_API_KEY not found in environment variables.")
-        genai.configure(api_key=settings.gemini_api_key)
-        
-        # Istruzioni dettagliate per il modello IA
-        system_prompt = """
+# Istruzioni dettagliate per il modello IA
+SYSTEM_PROMPT = """
 Sei un moderatore di contenuti per una pagina Instagram anonima chiamata "InstaSpotter".
 Il tuo compito è analizzare i messaggi inviati dagli utenti e decidere se approvarli, rifiutarli o metterli in attesa per una revisione umana.
 
@@ -109,36 +99,103 @@ Tua Risposta:
   "category": "Uncertain"
 }
 """
-        
-        # Prova diversi modelli Gemini disponibili
-        # Lista dei modelli da provare in ordine di preferenza (modelli più recenti prima)
-        models_to_try = [
-            'gemini-2.0-flash-exp',  # Modello più recente
-            'gemini-1.5-flash-latest',  # Versione latest
-            'gemini-1.5-flash',  # Flash standard
-            'gemini-1.5-pro',  # Pro version
-            'gemini-pro'  # Fallback
-        ]
-        last_error = None
-        
-        for model_name in models_to_try:
+
+VALID_DECISIONS = ("APPROVE", "REJECT", "PENDING")
+
+# Richiesta per più messaggi insieme: le regole restano quelle del prompt di sistema
+BATCH_PROMPT = """Analizza i seguenti {count} messaggi, forniti come array JSON di oggetti con "id" e "text".
+Applica a ciascuno le stesse regole, in modo indipendente dagli altri.
+Rispondi SOLO con un array JSON con un oggetto per messaggio, nella forma:
+[{{"id": <id del messaggio>, "decision": "...", "reason": "...", "category": "..."}}]
+
+Messaggi:
+"""
+
+# Lista dei modelli da provare in ordine di preferenza (modelli più recenti prima)
+MODELS_TO_TRY = [
+    'gemini-2.0-flash-exp',  # Modello più recente
+    'gemini-1.5-flash-latest',  # Versione latest
+    'gemini-1.5-flash',  # Flash standard
+    'gemini-1.5-pro',  # Pro version
+    'gemini-pro'  # Fallback
+]
+
+
+def _is_model_not_found(error: Exception) -> bool:
+    error_msg = str(error)
+    return "404" in error_msg and ("models" in error_msg.lower() or "not found" in error_msg.lower())
+
+
+class GeminiModerator:
+    """
+    Modera i messaggi utilizzando il modello Gemini con regole specifiche.
+
+    Il modello che ha risposto resta in memoria con il suo client (e il pool
+    di connessioni): il modello successivo della lista viene provato solo se
+    quello corrente risponde 404. Usare get_moderator() per l'istanza condivisa.
+    """
+    def __init__(self, models: list = None):
+        if genai is None:
+            raise ImportError("google-generativeai package not installed. Install it with: pip install google-generativeai")
+        if not settings.gemini_api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables.")
+        genai.configure(api_key=settings.gemini_api_key)
+
+        self.models_to_try = list(models or MODELS_TO_TRY)
+        self._model_index = 0
+        self._model = None
+        self._lock = threading.Lock()
+        self.model_probes = 0
+
+    @property
+    def model_name(self) -> str:
+        return self.models_to_try[self._model_index]
+
+    @property
+    def model(self):
+        """Modello corrente, creato alla prima richiesta e poi riusato."""
+        model = self._model
+        if model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = self._build_model(self.model_name)
+                model = self._model
+        return model
+
+    def _build_model(self, model_name: str):
+        self.model_probes += 1
+        model = genai.GenerativeModel(
+            model_name,
+            generation_config=genai.GenerationConfig(
+                response_mime_type="application/json"
+            ),
+            system_instruction=SYSTEM_PROMPT
+        )
+        print(f"--- [Moderator] Modello {model_name} inizializzato con successo ---")
+        return model
+
+    def _next_model(self, failed_model) -> bool:
+        """Passa al modello successivo dopo un 404; False se la lista è finita."""
+        with self._lock:
+            if self._model is not failed_model:
+                # Un altro thread ha già cambiato modello
+                return True
+            if self._model_index + 1 >= len(self.models_to_try):
+                return False
+            print(f"--- [Moderator] Modello {self.model_name} non disponibile (404), provo il successivo ---")
+            self._model_index += 1
+            self._model = None
+            return True
+
+    def _generate(self, prompt: str):
+        """Una chiamata generate_content; su 404 riprova con i modelli successivi."""
+        while True:
+            model = self.model
             try:
-                self.model = genai.GenerativeModel(
-                    model_name,
-                    generation_config=genai.GenerationConfig(
-                        response_mime_type="application/json"
-                    ),
-                    system_instruction=system_prompt
-                )
-                print(f"--- [Moderator] Modello {model_name} inizializzato con successo ---")
-                return  # Modello trovato, esci
+                return model.generate_content(prompt)
             except Exception as e:
-                last_error = e
-                print(f"--- [Moderator] Tentativo con {model_name} fallito: {e} ---")
-                continue
-        
-        # Se nessun modello funziona, solleva un errore
-        raise ValueError(f"Nessun modello Gemini disponibile. Ultimo errore: {last_error}")
+                if not _is_model_not_found(e) or not self._next_model(model):
+                    raise
 
     def moderate_message(self, text: str) -> ModerationResult:
         """
@@ -146,39 +203,12 @@ Tua Risposta:
         """
         try:
             prompt = f"Analizza il seguente messaggio: \"{text}\""
-            response = self.model.generate_content(prompt)
-            
-            # Pulisci e carica il JSON dalla risposta del modello
-            response_text = response.text.strip().replace("```json", "").replace("```", "")
-            data = json.loads(response_text)
-            
-            # Assicura che la decisione sia uno dei valori attesi
-            decision = data.get("decision", "PENDING").upper()
-            if decision not in ["APPROVE", "REJECT", "PENDING"]:
-                decision = "PENDING"
-
-            return ModerationResult(
-                decision=decision,
-                reason=data.get("reason", "Analisi AI non conclusiva."),
-                category=data.get("category", "Uncertain")
-            )
+            response = self._generate(prompt)
+            return _parse_result(_load_json(response.text))
         except Exception as e:
             error_msg = str(e)
             print(f"--- ERRORE [Moderator]: Impossibile analizzare il messaggio. Errore: {error_msg} ---")
-
-            # Controlla se è un errore di quota API
-            is_quota_error = "429" in error_msg and ("quota" in error_msg.lower() or "exceeded" in error_msg.lower())
-
-            if is_quota_error:
-                # Errore di quota - rilancia per far gestire dal task
-                raise ValueError(f"Quota API Gemini esaurita: {error_msg}")
-
-            # Se è un errore 404 sui modelli o API non disponibile, rilancia l'eccezione
-            if "404" in error_msg and ("models" in error_msg.lower() or "not found" in error_msg.lower()):
-                raise ValueError(f"Modelli Gemini non disponibili per questo account: {error_msg}")
-            # Se è un errore di API o autenticazione, rilancia
-            if "403" in error_msg or "401" in error_msg or "API" in error_msg.upper():
-                raise ValueError(f"Errore API Gemini: {error_msg}")
+            _raise_api_error(e)
             # In caso di altri errori, metti in pending per sicurezza
             return ModerationResult(
                 decision="PENDING",
@@ -186,9 +216,99 @@ Tua Risposta:
                 category="Error"
             )
 
+    def moderate_batch(self, items: list) -> dict:
+        """
+        Analizza più messaggi con una sola richiesta. `items` è una lista di
+        (id, testo); restituisce {id: ModerationResult} solo per i messaggi a
+        cui il modello ha risposto in modo valido: quelli mancanti vanno
+        analizzati singolarmente. Gli errori di quota e di API vengono
+        rilanciati come in moderate_message.
+        """
+        wanted = {message_id for message_id, _ in items}
+        messages = json.dumps([{"id": message_id, "text": text} for message_id, text in items], ensure_ascii=False)
+        try:
+            response = self._generate(BATCH_PROMPT.format(count=len(items)) + messages)
+            data = _load_json(response.text)
+        except Exception as e:
+            print(f"--- ERRORE [Moderator]: Analisi di {len(items)} messaggi fallita. Errore: {e} ---")
+            _raise_api_error(e)
+            return {}
+
+        if isinstance(data, dict):
+            data = data.get("results", [data])
+        results = {}
+        for entry in data if isinstance(data, list) else []:
+            if not isinstance(entry, dict) or str(entry.get("decision", "")).upper() not in VALID_DECISIONS:
+                continue
+            try:
+                message_id = int(entry.get("id"))
+            except (TypeError, ValueError):
+                continue
+            if message_id in wanted and message_id not in results:
+                results[message_id] = _parse_result(entry)
+        if len(results) < len(wanted):
+            print(f"--- [Moderator] Risposta parziale: {len(results)}/{len(wanted)} messaggi analizzati ---")
+        return results
+
+
+def _load_json(response_text: str):
+    # Pulisci e carica il JSON dalla risposta del modello
+    return json.loads(response_text.strip().replace("```json", "").replace("```", ""))
+
+
+def _parse_result(data: dict) -> ModerationResult:
+    # Assicura che la decisione sia uno dei valori attesi
+    decision = str(data.get("decision", "PENDING")).upper()
+    if decision not in VALID_DECISIONS:
+        decision = "PENDING"
+    return ModerationResult(
+        decision=decision,
+        reason=data.get("reason", "Analisi AI non conclusiva."),
+        category=data.get("category", "Uncertain")
+    )
+
+
+def is_quota_error(error) -> bool:
+    """True per gli errori 429 di quota o rate limit di Gemini."""
+    error_msg = str(error)
+    return "429" in error_msg and ("quota" in error_msg.lower() or "exceeded" in error_msg.lower())
+
+
+def _raise_api_error(error: Exception):
+    """Rilancia come ValueError gli errori che il task deve gestire (quota, modelli, API)."""
+    error_msg = str(error)
+
+    if is_quota_error(error):
+        # Errore di quota - rilancia per far gestire dal task
+        raise ValueError(f"Quota API Gemini esaurita: {error_msg}")
+
+    # Se è un errore 404 sui modelli o API non disponibile, rilancia l'eccezione
+    if _is_model_not_found(error):
+        raise ValueError(f"Modelli Gemini non disponibili per questo account: {error_msg}")
+    # Se è un errore di API o autenticazione, rilancia
+    if "403" in error_msg or "401" in error_msg or "API" in error_msg.upper():
+        raise ValueError(f"Errore API Gemini: {error_msg}")
+
+
+_moderator: Optional[GeminiModerator] = None
+_moderator_lock = threading.Lock()
+
+
+def get_moderator() -> GeminiModerator:
+    """
+    Restituisce il moderatore condiviso dal processo, creato alla prima
+    richiesta. Gli errori di configurazione (pacchetto o chiave mancanti)
+    vengono rilanciati a ogni chiamata.
+    """
+    global _moderator
+    with _moderator_lock:
+        if _moderator is None:
+            _moderator = GeminiModerator()
+        return _moderator
+
 # Esempio di utilizzo (per testare questo file singolarmente)
 if __name__ == '__main__':
-    moderator = GeminiModerator()
+    moderator = get_moderator()
     
     test_messages = [
         "Spotto un ragazzo altissimo con gli occhiali alla fermata del bus stamattina. Aveva uno zaino verde.",
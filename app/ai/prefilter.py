@@ -0,0 +1,209 @@
+"""
+Filtro locale che precede la moderazione AI.
+
+Le regole deterministiche del prompt di sistema (link, pubblicità evidente,
+testo senza senso) vengono verificate in locale: un automa di Aho-Corasick
+cerca tutte le parole chiave in una sola passata sul testo normalizzato,
+alcune espressioni regolari riconoscono URL e domini, e un punteggio di
+entropia e ripetizione individua lo spam. I casi certi vengono rifiutati in
+pochi microsecondi con le stesse categorie di ModerationResult; tutto il
+resto passa a Gemini. Il filtro è volutamente prudente: nel dubbio decide l'AI.
+"""
+
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from app.ai.gemini_moderator import ModerationResult
+from app.text_fingerprint import normalize_text
+
+# Parole chiave (già normalizzate: minuscole, senza accenti e punteggiatura) -> categoria
+KEYWORDS = {
+    # Link scritti per aggirare i filtri
+    "punto com": "Link", "punto it": "Link", "punto org": "Link", "punto net": "Link",
+    "dot com": "Link", "link in bio": "Link", "link nel profilo": "Link", "clicca qui": "Link",
+    # Pubblicità e promozione di altri canali
+    "codice sconto": "Advertisement", "codice promo": "Advertisement", "promo code": "Advertisement",
+    "seguitemi su": "Advertisement", "seguimi su": "Advertisement", "seguite la pagina": "Advertisement",
+    "iscriviti al mio canale": "Advertisement", "iscrivetevi al mio canale": "Advertisement",
+    "guadagna soldi": "Advertisement", "guadagni facili": "Advertisement", "soldi facili": "Advertisement",
+    "compra ora": "Advertisement", "acquista ora": "Advertisement", "spedizione gratuita": "Advertisement",
+    "scrivetemi in direct per info": "Advertisement", "onlyfans": "Advertisement",
+}
+
+URL_PATTERNS = [
+    ("url", re.compile(r"\b(?:https?|ftp)://", re.IGNORECASE)),
+    ("www", re.compile(r"\bwww\s*\.", re.IGNORECASE)),
+    ("domain", re.compile(
+        # Niente spazi attorno al punto e niente TLD che sono anche parole ("bello.Io")
+        r"\b[a-z0-9][a-z0-9-]{1,62}\.(?:com|it|org|net|eu|ly|info|biz|xyz|tk|shop|link)\b(?!\.\w)",
+        re.IGNORECASE,
+    )),
+]
+
+# Sequenze di tasti adiacenti tipiche del testo digitato a caso
+KEYBOARD_ROWS = ("qwertyuiop", "asdfghjkl", "zxcvbnm")
+KEYBOARD_MIN_RUN = 5
+
+SPAM_MIN_LETTERS = 12  # Testi più corti non hanno statistiche affidabili
+SPAM_MAX_ENTROPY = 2.0  # Bit per carattere: l'italiano ne ha circa 4
+SPAM_CHAR_RUN = 12  # Stesso carattere ripetuto (es. "aaaaaaaaaaaa")
+SPAM_WORD_SHARE = 0.7  # Quota di parole uguali in un testo di almeno 6 parole
+
+
+class PrefilterHit(NamedTuple):
+    rule: str
+    category: str
+    match: str
+
+
+class AhoCorasick:
+    """Automa di Aho-Corasick: trova tutte le parole chiave in una sola passata."""
+
+    def __init__(self, patterns: Dict[str, str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, str]]] = [[]]
+        for pattern, value in patterns.items():
+            state = 0
+            for char in pattern:
+                state = self._goto[state].get(char) or self._new_state(state, char)
+            self._out[state].append((pattern, value))
+        self._build_failure_links()
+
+    def _new_state(self, state: int, char: str) -> int:
+        self._goto.append({})
+        self._fail.append(0)
+        self._out.append([])
+        self._goto[state][char] = len(self._goto) - 1
+        return len(self._goto) - 1
+
+    def _build_failure_links(self):
+        queue = list(self._goto[0].values())
+        while queue:
+            state = queue.pop(0)
+            for char, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0) if self._goto[fallback].get(char) != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def search(self, text: str) -> List[Tuple[int, str, str]]:
+        """(posizione finale, parola chiave, valore) per ogni occorrenza."""
+        matches = []
+        state = 0
+        for position, char in enumerate(text):
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+            state = self._goto[state].get(char, 0)
+            for pattern, value in self._out[state]:
+                matches.append((position, pattern, value))
+        return matches
+
+
+def char_entropy(text: str) -> float:
+    """Entropia di Shannon dei caratteri, in bit per carattere."""
+    counts = Counter(text)
+    total = len(text)
+    return -sum(count / total * math.log2(count / total) for count in counts.values())
+
+
+class Prefilter:
+    """Regole locali compilate una volta; contatori per regola."""
+
+    def __init__(self, keywords: Dict[str, str] = None):
+        self._automaton = AhoCorasick(keywords or KEYWORDS)
+        self._lock = threading.Lock()
+        self.hits: Counter = Counter()
+        self.checks = 0
+        self.forwarded = 0
+        self.check_us_total = 0.0
+
+    def find(self, text: str) -> Optional[PrefilterHit]:
+        """Prima regola violata dal testo, o None se la decisione spetta all'AI."""
+        for rule, pattern in URL_PATTERNS:
+            match = pattern.search(text)
+            if match:
+                return PrefilterHit(rule, "Link", match.group(0))
+
+        normalized = normalize_text(text)
+        padded = f" {normalized} "
+        for end, keyword, category in self._automaton.search(padded):
+            # Solo parole intere: "promo code" sì, "supromo codex" no
+            start = end - len(keyword) + 1
+            if padded[start - 1] == " " and padded[end + 1] == " ":
+                return PrefilterHit(f"keyword:{keyword}", category, keyword)
+
+        return self._spam(normalized)
+
+    @staticmethod
+    def _spam(normalized: str) -> Optional[PrefilterHit]:
+        letters = normalized.replace(" ", "")
+        if len(letters) < SPAM_MIN_LETTERS:
+            return None
+        run = max(len(match.group(0)) for match in re.finditer(r"(.)\1*", letters))
+        if run >= SPAM_CHAR_RUN:
+            return PrefilterHit("repeated_char", "Spam", f"{run} caratteri uguali")
+        entropy = char_entropy(letters)
+        if entropy < SPAM_MAX_ENTROPY:
+            return PrefilterHit("low_entropy", "Spam", f"{entropy:.2f} bit/carattere")
+        words = normalized.split()
+        if len(words) >= 6 and Counter(words).most_common(1)[0][1] / len(words) >= SPAM_WORD_SHARE:
+            return PrefilterHit("repeated_word", "Spam", Counter(words).most_common(1)[0][0])
+        keyboard = sum(
+            len(word) for word in words
+            if len(word) >= KEYBOARD_MIN_RUN and any(_keyboard_run(word, row) for row in KEYBOARD_ROWS)
+        )
+        if keyboard >= len(letters) / 2:
+            return PrefilterHit("keyboard_mash", "Spam", "sequenze di tasti adiacenti")
+        return None
+
+    def check(self, text: str) -> Optional[ModerationResult]:
+        """REJECT con categoria se il testo viola una regola certa; None per inoltrarlo a Gemini."""
+        started = time.perf_counter()
+        hit = self.find(text or "")
+        elapsed = (time.perf_counter() - started) * 1_000_000
+        with self._lock:
+            self.checks += 1
+            self.check_us_total += elapsed
+            if hit is None:
+                self.forwarded += 1
+                return None
+            self.hits[hit.rule] += 1
+        return ModerationResult(
+            decision="REJECT",
+            reason=f"Filtro locale ({hit.rule}): {hit.match}",
+            category=hit.category
+        )
+
+    def stats(self) -> dict:
+        return {
+            "checks": self.checks,
+            "rejected": sum(self.hits.values()),
+            "forwarded": self.forwarded,
+            "avg_check_us": round(self.check_us_total / self.checks, 1) if self.checks else None,
+            "hits": dict(self.hits.most_common()),
+        }
+
+
+def _keyboard_run(word: str, row: str) -> bool:
+    """True se la parola contiene KEYBOARD_MIN_RUN tasti consecutivi della riga."""
+    return any(word[i:i + KEYBOARD_MIN_RUN] in row for i in range(len(word) - KEYBOARD_MIN_RUN + 1))
+
+
+_prefilter: Optional[Prefilter] = None
+_prefilter_lock = threading.Lock()
+
+
+def get_prefilter() -> Prefilter:
+    """Restituisce il filtro locale condiviso dal processo."""
+    global _prefilter
+    with _prefilter_lock:
+        if _prefilter is None:
+            _prefilter = Prefilter()
+        return _prefilter
@@ -0,0 +1,537 @@
+"""
+Servizio asincrono di moderazione con governo della quota Gemini.
+
+I task di moderazione non chiamano più Gemini: dopo il filtro locale e la
+cache accodano il messaggio nella tabella `moderation_jobs`, che sopravvive
+ai riavvii. ModerationService, un task asyncio avviato con l'app, prende i
+job per priorità (le rimoderazioni chieste dall'admin prima dei nuovi invii)
+a gruppi di `batch_max_items` e li analizza con una richiesta per gruppo,
+con al massimo `service_concurrency` richieste in volo.
+
+Ogni richiesta passa da QuotaGovernor: due token bucket, uno per le
+richieste al minuto (`gemini_rpm`) e uno per i token stimati al minuto
+(`gemini_tpm`), fanno attendere il servizio invece di farsi rispondere 429.
+Se il 429 arriva comunque, il servizio si ferma per il Retry-After indicato
+da Gemini (o per un backoff esponenziale con jitter) e i messaggi tornano in
+coda: nessun messaggio viene più approvato solo perché la quota è finita.
+Dopo `max_attempts` tentativi il messaggio resta in PENDING per
+l'approvazione manuale. Il client Gemini è sincrono: le chiamate girano in
+un thread con asyncio.to_thread, il loop resta libero.
+"""
+
+import asyncio
+import math
+import random
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import func, or_, update
+
+from app.ai.batching import moderate_items
+from app.ai.gemini_moderator import SYSTEM_PROMPT, ModerationResult, get_moderator, is_quota_error
+from app.database import MessageStatus, ModerationJob, SpottedMessage
+from config import settings
+
+# Priorità: le rimoderazioni chieste dall'admin prima dei nuovi invii
+PRIORITY_ADMIN = 10
+PRIORITY_SUBMISSION = 0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Stima dei token di una richiesta: circa 4 caratteri per token
+CHARS_PER_TOKEN = 4
+PROMPT_TOKENS = len(SYSTEM_PROMPT) // CHARS_PER_TOKEN
+RESPONSE_TOKENS = 60  # Esito JSON di un messaggio
+
+# Testo di gemini_analysis per i messaggi in attesa del servizio
+QUEUED_ANALYSIS = "In coda per la moderazione AI"
+
+RETRY_AFTER_PATTERNS = [
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)", re.IGNORECASE),
+    re.compile(r"retry[- ]after[\"']?\s*[:=]?\s*(\d+(?:\.\d+)?)", re.IGNORECASE),
+    re.compile(r"retry in\s*(\d+(?:\.\d+)?)\s*s", re.IGNORECASE),
+]
+
+
+class ClaimedModeration(NamedTuple):
+    id: int
+    message_id: int
+    priority: int
+    attempts: int
+
+
+def estimate_tokens(text: str) -> int:
+    """Token stimati per moderare un testo: prompt di sistema, messaggio ed esito."""
+    return PROMPT_TOKENS + len(text or "") // CHARS_PER_TOKEN + RESPONSE_TOKENS
+
+
+def retry_after_seconds(error) -> Optional[float]:
+    """Attesa indicata da Gemini in un errore 429 (retry_delay, Retry-After o "retry in Ns")."""
+    error_msg = str(error)
+    for pattern in RETRY_AFTER_PATTERNS:
+        match = pattern.search(error_msg)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def backoff_seconds(attempt: int, retry_after: float = None, base: float = None, maximum: float = None) -> float:
+    """
+    Attesa prima del tentativo successivo. Con un Retry-After si attende
+    almeno quanto chiesto, più un jitter fino al 20%; altrimenti backoff
+    esponenziale con jitter tra metà e tutto il ritardo.
+    """
+    base = base if base is not None else settings.moderation.backoff_base_seconds
+    maximum = maximum if maximum is not None else settings.moderation.backoff_max_seconds
+    if retry_after is not None:
+        return min(retry_after * (1 + random.random() * 0.2), maximum)
+    delay = min(base * 2 ** max(attempt - 1, 0), maximum)
+    return delay * (0.5 + random.random() / 2)
+
+
+class TokenBucket:
+    """Token bucket con ricarica continua di `rate_per_minute` token al minuto."""
+
+    def __init__(self, rate_per_minute: float, capacity: float = None, clock: Callable = time.monotonic):
+        self.rate = rate_per_minute / 60
+        self.capacity = capacity or rate_per_minute
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        """Secondi da attendere perché `amount` token siano disponibili."""
+        self._refill()
+        # Una richiesta più grande del bucket attende solo di trovarlo pieno
+        missing = min(amount, self.capacity) - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= min(amount, self.capacity)
+
+    def level(self) -> float:
+        self._refill()
+        return self.tokens
+
+
+class QuotaGovernor:
+    """Limiti di richieste e token al minuto verso Gemini, più la pausa dopo un 429."""
+
+    def __init__(self, rpm: int = None, tpm: int = None, clock: Callable = time.monotonic, sleep: Callable = None):
+        self.rpm = rpm or settings.moderation.gemini_rpm
+        self.tpm = tpm or settings.moderation.gemini_tpm
+        self.clock = clock
+        self.sleep = sleep or asyncio.sleep
+        self.requests = TokenBucket(self.rpm, clock=clock)
+        self.tokens = TokenBucket(self.tpm, clock=clock)
+        self.paused_until = 0.0
+        self.waited_seconds = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def delay(self, tokens: int) -> float:
+        return max(self.requests.delay(1), self.tokens.delay(tokens), self.paused_until - self.clock(), 0.0)
+
+    async def acquire(self, tokens: int):
+        """Attende finché una richiesta da `tokens` token rientra nei limiti, poi la conteggia."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Un solo richiedente alla volta: chi attende non viene sorpassato
+        async with self._lock:
+            while True:
+                wait = self.delay(tokens)
+                if wait <= 0:
+                    break
+                self.waited_seconds += wait
+                await self.sleep(wait)
+            self.requests.consume(1)
+            self.tokens.consume(tokens)
+
+    def pause(self, seconds: float):
+        """Nessuna richiesta per `seconds` secondi (Retry-After di un 429)."""
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    def paused_for(self) -> float:
+        return max(0.0, self.paused_until - self.clock())
+
+    def stats(self) -> dict:
+        return {
+            "rpm": self.rpm,
+            "tpm": self.tpm,
+            "requests_available": round(self.requests.level(), 2),
+            "tokens_available": int(self.tokens.level()),
+            "paused_seconds": round(self.paused_for(), 1),
+            "waited_seconds": round(self.waited_seconds, 1),
+        }
+
+
+class ModerationQueue:
+    """Coda durevole dei messaggi da moderare, nella tabella moderation_jobs."""
+
+    def __init__(self, session_factory: Callable = None):
+        if session_factory is None:
+            from app.database import SessionLocal
+            session_factory = SessionLocal
+        self.session_factory = session_factory
+
+    def submit(self, message_id: int, priority: int = PRIORITY_SUBMISSION) -> int:
+        """
+        Accoda il messaggio e restituisce l'id del job. Se il messaggio è già
+        in coda il job viene riusato, alzandone la priorità se serve.
+        """
+        db = self.session_factory()
+        try:
+            existing = db.query(ModerationJob).filter(
+                ModerationJob.message_id == message_id, ModerationJob.status.in_((QUEUED, RUNNING))
+            ).first()
+            if existing:
+                if existing.status == QUEUED and priority > (existing.priority or 0):
+                    existing.priority = priority
+                    existing.not_before = None
+                    db.commit()
+                return existing.id
+            job = ModerationJob(message_id=message_id, priority=priority, status=QUEUED)
+            db.add(job)
+            db.commit()
+            return job.id
+        finally:
+            db.close()
+
+    def claim(self, limit: int) -> List[ClaimedModeration]:
+        """Prende fino a `limit` job pronti, per priorità e poi in ordine di arrivo."""
+        db = self.session_factory()
+        try:
+            now = datetime.utcnow()
+            candidates = db.query(ModerationJob.id).filter(
+                ModerationJob.status == QUEUED,
+                or_(ModerationJob.not_before.is_(None), ModerationJob.not_before <= now),
+            ).order_by(ModerationJob.priority.desc(), ModerationJob.id).limit(limit).all()
+            claimed = []
+            for candidate in candidates:
+                # UPDATE condizionale: se un altro processo l'ha già preso non tocca righe
+                if not db.execute(
+                    update(ModerationJob)
+                    .where(ModerationJob.id == candidate.id, ModerationJob.status == QUEUED)
+                    .values(status=RUNNING, started_at=now, attempts=ModerationJob.attempts + 1)
+                ).rowcount:
+                    continue
+                claimed.append(candidate.id)
+            db.commit()
+            jobs = db.query(ModerationJob).filter(ModerationJob.id.in_(claimed)).order_by(
+                ModerationJob.priority.desc(), ModerationJob.id
+            ).all() if claimed else []
+            return [ClaimedModeration(job.id, job.message_id, job.priority or 0, job.attempts) for job in jobs]
+        finally:
+            db.close()
+
+    def complete(self, job_id: int):
+        self._finish(job_id, status=DONE, finished_at=datetime.utcnow())
+
+    def fail(self, job_id: int, error: str):
+        self._finish(job_id, status=FAILED, finished_at=datetime.utcnow(), error=str(error)[:500])
+
+    def retry(self, job_id: int, delay: float, error: str):
+        """Rimette il job in coda, da riprendere non prima di `delay` secondi."""
+        self._finish(job_id, status=QUEUED, not_before=datetime.utcnow() + timedelta(seconds=delay),
+                     error=str(error)[:500])
+
+    def _finish(self, job_id: int, **values):
+        db = self.session_factory()
+        try:
+            db.execute(update(ModerationJob).where(
+                ModerationJob.id == job_id, ModerationJob.status == RUNNING
+            ).values(**values))
+            db.commit()
+        finally:
+            db.close()
+
+    def recover_stale(self, stale_seconds: int = None) -> int:
+        """Rimette in coda i job rimasti in esecuzione su un processo terminato."""
+        stale_seconds = stale_seconds if stale_seconds is not None else settings.moderation.job_stale_seconds
+        db = self.session_factory()
+        try:
+            recovered = db.execute(update(ModerationJob).where(
+                ModerationJob.status == RUNNING,
+                ModerationJob.started_at < datetime.utcnow() - timedelta(seconds=stale_seconds),
+            ).values(status=QUEUED)).rowcount
+            db.commit()
+            return recovered
+        finally:
+            db.close()
+
+    def backlog(self) -> dict:
+        """Job in coda per priorità, job in esecuzione, token stimati e prossimo job in backoff."""
+        db = self.session_factory()
+        try:
+            by_priority = dict(db.query(ModerationJob.priority, func.count(ModerationJob.id)).filter(
+                ModerationJob.status == QUEUED
+            ).group_by(ModerationJob.priority).all())
+            running = db.query(func.count(ModerationJob.id)).filter(ModerationJob.status == RUNNING).scalar()
+            chars = db.query(func.coalesce(func.sum(func.length(SpottedMessage.text)), 0)).join(
+                ModerationJob, ModerationJob.message_id == SpottedMessage.id
+            ).filter(ModerationJob.status == QUEUED).scalar()
+            oldest = db.query(func.min(ModerationJob.created_at)).filter(ModerationJob.status == QUEUED).scalar()
+            latest_retry = db.query(func.max(ModerationJob.not_before)).filter(ModerationJob.status == QUEUED).scalar()
+        finally:
+            db.close()
+        now = datetime.utcnow()
+        depth = sum(by_priority.values())
+        return {
+            "depth": depth,
+            "by_priority": by_priority,
+            "running": running,
+            "tokens": depth * (PROMPT_TOKENS + RESPONSE_TOKENS) + chars // CHARS_PER_TOKEN,
+            "oldest_wait_seconds": round((now - oldest).total_seconds(), 1) if oldest else None,
+            "backoff_seconds": max(0.0, (latest_retry - now).total_seconds()) if latest_retry else 0.0,
+        }
+
+
+class ModerationService:
+    """Loop asyncio che svuota la coda di moderazione rispettando la quota Gemini."""
+
+    def __init__(self, queue: ModerationQueue = None, moderator_factory: Callable = get_moderator,
+                 governor: QuotaGovernor = None, concurrency: int = None, batch_size: int = None,
+                 poll_seconds: float = None, max_attempts: int = None):
+        moderation = settings.moderation
+        self.queue = queue or ModerationQueue()
+        self.moderator_factory = moderator_factory
+        self.governor = governor or QuotaGovernor()
+        self.concurrency = max(1, concurrency or moderation.service_concurrency)
+        self.batch_size = max(1, batch_size or moderation.batch_max_items)
+        self.poll_seconds = poll_seconds if poll_seconds is not None else moderation.service_poll_seconds
+        self.max_attempts = max_attempts or moderation.max_attempts
+        self.in_flight = 0
+        self.moderated = 0
+        self.requests = 0
+        self.retries = 0
+        self.quota_errors = 0
+        self.failed = 0
+        self.running = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+
+    def submit(self, message_id: int, priority: int = PRIORITY_SUBMISSION) -> int:
+        """Accoda il messaggio e sveglia il servizio se gira in questo processo."""
+        job_id = self.queue.submit(message_id, priority)
+        self.wake()
+        return job_id
+
+    def wake(self):
+        """Sveglia il loop (chiamabile da qualsiasi thread)."""
+        if self._loop is not None and self._wake is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def run(self):
+        """Serve la coda finché il task non viene cancellato."""
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self.running = True
+        recovered = await asyncio.to_thread(self.queue.recover_stale)
+        if recovered:
+            print(f"--- [ModerationService] {recovered} job rimessi in coda dopo un riavvio ---")
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks = set()
+        try:
+            while True:
+                await slots.acquire()
+                if self.governor.paused_for() > 0:
+                    # Quota esaurita: i job restano in coda, nessuno viene preso
+                    slots.release()
+                    await self._idle(self.governor.paused_for())
+                    continue
+                try:
+                    jobs = await asyncio.to_thread(self.queue.claim, self.batch_size)
+                except Exception as e:
+                    print(f"--- [ModerationService] Coda non disponibile: {e} ---")
+                    jobs = []
+                if not jobs:
+                    slots.release()
+                    await self._idle(self.poll_seconds)
+                    continue
+                task = asyncio.create_task(self._serve(jobs, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            self.running = False
+            for task in tasks:
+                task.cancel()
+
+    async def _idle(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wake.clear()
+
+    async def _serve(self, jobs: List[ClaimedModeration], slots: asyncio.Semaphore):
+        self.in_flight += len(jobs)
+        try:
+            await self.process(jobs)
+        except Exception as e:
+            print(f"--- [ModerationService] ERRORE durante la moderazione di {len(jobs)} messaggi: {e} ---")
+        finally:
+            self.in_flight -= len(jobs)
+            slots.release()
+
+    async def process(self, jobs: List[ClaimedModeration]):
+        """Modera un gruppo di job già presi dalla coda e ne applica gli esiti."""
+        texts = await asyncio.to_thread(self._load_texts, jobs)
+        jobs = [job for job in jobs if job.id in texts]
+        if not jobs:
+            return
+        items = [(job.message_id, texts[job.id]) for job in jobs]
+        await self.governor.acquire(sum(estimate_tokens(text) for _, text in items))
+        try:
+            moderator = self.moderator_factory()
+            results, requests = await asyncio.to_thread(moderate_items, moderator, items)
+        except Exception as e:
+            await asyncio.to_thread(self._handle_error, jobs, e)
+            return
+        self.requests += requests
+        approved = await asyncio.to_thread(self._apply, jobs, results)
+        if approved:
+            from app.tasks import prerender_card_task
+            for message_id in approved:
+                await asyncio.to_thread(prerender_card_task, message_id)
+
+    def _load_texts(self, jobs: List[ClaimedModeration]) -> Dict[int, str]:
+        """Testi dei messaggi ancora da moderare; i job degli altri vengono chiusi."""
+        texts = {}
+        db = self.queue.session_factory()
+        try:
+            for job in jobs:
+                message = db.get(SpottedMessage, job.message_id)
+                if message is None:
+                    self.queue.fail(job.id, "Messaggio eliminato")
+                elif message.status != MessageStatus.PENDING:
+                    # L'admin ha già deciso mentre il messaggio era in coda (anche le
+                    # rimoderazioni partono da PENDING: una storia pubblicata non si riapprova)
+                    self.queue.complete(job.id)
+                else:
+                    texts[job.id] = message.text
+        finally:
+            db.close()
+        return texts
+
+    def _apply(self, jobs: List[ClaimedModeration], results: Dict[int, ModerationResult]) -> List[int]:
+        """Aggiorna lo stato dei messaggi con gli esiti di Gemini; restituisce gli id approvati."""
+        from app.ai.cache import get_moderation_cache
+        statuses = {"APPROVE": MessageStatus.APPROVED, "REJECT": MessageStatus.REJECTED}
+        approved = []
+        db = self.queue.session_factory()
+        try:
+            for job in jobs:
+                result = results[job.message_id]
+                message = db.get(SpottedMessage, job.message_id)
+                if message is None:
+                    self.queue.fail(job.id, "Messaggio eliminato")
+                    continue
+                if message.status != MessageStatus.PENDING:
+                    # Deciso dall'admin durante la chiamata a Gemini
+                    self.queue.complete(job.id)
+                    continue
+                if settings.moderation.cache_enabled and result.category != "Error":
+                    try:
+                        get_moderation_cache().put(message.text, result)
+                    except Exception as e:
+                        print(f"--- [ModerationService] Esito non salvato in cache: {e} ---")
+                message.gemini_analysis = result.reason
+                message.status = statuses.get(result.decision, MessageStatus.PENDING)
+                db.commit()
+                self.queue.complete(job.id)
+                self.moderated += 1
+                if message.status == MessageStatus.APPROVED:
+                    approved.append(message.id)
+                print(f"--- [ModerationService] Messaggio ID {message.id}: {result.decision} ---")
+        finally:
+            db.close()
+        return approved
+
+    def _handle_error(self, jobs: List[ClaimedModeration], error: Exception):
+        """Quota e errori temporanei: job di nuovo in coda con backoff. Configurazione mancante: revisione manuale."""
+        error_msg = str(error)
+        quota = is_quota_error(error)
+        if quota:
+            self.quota_errors += 1
+            retry_after = retry_after_seconds(error)
+            pause = backoff_seconds(max(job.attempts for job in jobs), retry_after)
+            self.governor.pause(pause)
+            print(f"--- [ModerationService] Quota Gemini esaurita: pausa di {pause:.0f}s, {len(jobs)} messaggi di nuovo in coda ---")
+        elif any(keyword in error_msg for keyword in ["GEMINI_API_KEY", "google-generativeai", "non disponibili"]):
+            for job in jobs:
+                self._manual_review(job, "Moderazione AI non disponibile - richiede approvazione manuale", error_msg)
+            return
+        else:
+            print(f"--- [ModerationService] Errore AI ({error_msg[:200]}), {len(jobs)} messaggi di nuovo in coda ---")
+        for job in jobs:
+            if job.attempts >= self.max_attempts:
+                reason = "Quota API esaurita" if quota else "Errore tecnico AI"
+                self._manual_review(job, f"{reason} dopo {job.attempts} tentativi - richiede approvazione manuale", error_msg)
+                continue
+            self.retries += 1
+            delay = pause if quota else backoff_seconds(job.attempts)
+            self.queue.retry(job.id, delay, error_msg)
+
+    def _manual_review(self, job: ClaimedModeration, analysis: str, error: str):
+        """Chiude il job lasciando il messaggio in PENDING: decide l'admin."""
+        self.failed += 1
+        self.queue.fail(job.id, error)
+        db = self.queue.session_factory()
+        try:
+            message = db.get(SpottedMessage, job.message_id)
+            if message is not None and message.status == MessageStatus.PENDING:
+                message.gemini_analysis = analysis
+                db.commit()
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        """Profondità della coda e tempo stimato per svuotarla con la quota attuale."""
+        backlog = self.queue.backlog()
+        governor = self.governor.stats()
+        depth = backlog["depth"]
+        # Minuti di quota necessari: richieste (una per gruppo) e token stimati
+        by_requests = math.ceil(depth / self.batch_size) / self.governor.rpm * 60
+        by_tokens = backlog["tokens"] / self.governor.tpm * 60
+        drain = max(by_requests, by_tokens, backlog["backoff_seconds"]) + governor["paused_seconds"] if depth else 0.0
+        return {
+            "enabled": settings.moderation.service_enabled,
+            "running": self.running,
+            "queue_depth": depth,
+            "queued_by_priority": backlog["by_priority"],
+            "in_flight": self.in_flight,
+            "oldest_wait_seconds": backlog["oldest_wait_seconds"],
+            "expected_drain_seconds": round(drain, 1),
+            "moderated": self.moderated,
+            "requests": self.requests,
+            "retries": self.retries,
+            "quota_errors": self.quota_errors,
+            "manual_review": self.failed,
+            "quota": governor,
+        }
+
+
+_service: Optional[ModerationService] = None
+_service_lock = threading.Lock()
+
+
+def get_moderation_service() -> ModerationService:
+    """Restituisce il servizio di moderazione condiviso dal processo."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            from app.database import Base, engine
+            Base.metadata.create_all(bind=engine, tables=[ModerationJob.__table__])
+            _service = ModerationService()
+        return _service
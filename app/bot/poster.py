@@ -244,6 +244,30 @@ class InstagramBot:
         # Se arriviamo qui, tutti i tentativi sono falliti
         return None
 
+    def post_story_sequence(self, image_paths: list) -> Optional[str]:
+        """
+        Pubblica i fotogrammi di un messaggio lungo come storie consecutive,
+        uno dopo l'altro senza pause. Restituisce il media pk del primo
+        fotogramma; se si interrompe dopo averne pubblicati alcuni solleva
+        un'eccezione che indica quali sono già online.
+        """
+        if len(image_paths) == 1:
+            return self.post_story(image_paths[0])
+
+        media_pks = []
+        for index, image_path in enumerate(image_paths, start=1):
+            print(f"--- DEBUG [POSTER]: Fotogramma {index}/{len(image_paths)} ---")
+            media_pk = self.post_story(image_path)
+            if not media_pk:
+                if not media_pks:
+                    return None
+                raise RuntimeError(
+                    f"Sequenza interrotta al fotogramma {index}/{len(image_paths)}: già pubblicati {media_pks}"
+                )
+            media_pks.append(media_pk)
+        print(f"--- DEBUG [POSTER]: Sequenza di {len(media_pks)} storie pubblicata! ---")
+        return media_pks[0]
+
     def post_album(self, image_paths: list[str], caption: str) -> bool:
         if not image_paths: return False
         try:
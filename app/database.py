@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Enum, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Enum, ForeignKey, UniqueConstraint, Index, LargeBinary
 from sqlalchemy.orm import sessionmaker, relationship, Session, declarative_base
 from datetime import datetime
 import enum
@@ -65,10 +65,122 @@ class SpottedMessage(Base):
     media_pk = Column(String, nullable=True)
     admin_note = Column(String, nullable=True)
     gemini_analysis = Column(String, nullable=True)
+    # Card pre-renderizzata all'approvazione: percorso e sha256 del file
+    card_path = Column(String, nullable=True)
+    card_hash = Column(String, nullable=True)
+    card_template_version = Column(String, nullable=True)  # Versione del template usata
+    card_rendered_at = Column(DateTime, nullable=True)
+    # Rilevamento dei duplicati: hash percettivo della card e impronta del testo normalizzato
+    card_phash = Column(String, nullable=True)
+    text_fingerprint = Column(String, nullable=True)
+    duplicate_of_id = Column(Integer, nullable=True)  # Storia pubblicata di cui è quasi un duplicato
+    # Messaggi lunghi: fotogrammi in ordine, JSON [[percorso, sha256], ...] (card_path è il primo)
+    card_frames = Column(Text, nullable=True)
     
     technical_user_id = Column(String, ForeignKey("technical_users.id"))
     author = relationship("TechnicalUser", back_populates="messages")
 
+class ImageAsset(Base):
+    """Immagine generata nell'archivio content-addressed (nome = sha256 del contenuto)."""
+    __tablename__ = "image_assets"
+
+    sha256 = Column(String, primary_key=True)
+    path = Column(String, nullable=False)
+    kind = Column(String, nullable=False, index=True)  # card, collage, preview
+    size_bytes = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_used_at = Column(DateTime, default=datetime.utcnow)
+
+    refs = relationship("ImageAssetRef", back_populates="asset", cascade="all, delete-orphan")
+
+class ImageAssetRef(Base):
+    """Riferimento da un messaggio a un'immagine: finché ne esiste uno l'immagine non viene eliminata."""
+    __tablename__ = "image_asset_refs"
+    __table_args__ = (UniqueConstraint("asset_sha256", "message_id", "role"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    asset_sha256 = Column(String, ForeignKey("image_assets.sha256"), nullable=False, index=True)
+    # Senza vincolo di chiave esterna: un messaggio eliminato lascia un riferimento
+    # orfano che il garbage collector rimuove
+    message_id = Column(Integer, nullable=True, index=True)
+    role = Column(String, nullable=False)  # card, collage
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    asset = relationship("ImageAsset", back_populates="refs")
+
+class RenderJob(Base):
+    """Job della coda di rendering, eseguito dal processo render_service.py."""
+    __tablename__ = "render_jobs"
+    __table_args__ = (Index("ix_render_jobs_claim", "status", "priority", "id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, nullable=False)  # card, collage, preview
+    payload = Column(Text, nullable=True)  # Parametri in JSON
+    status = Column(String, nullable=False, default="queued")  # queued, running, done, failed, expired
+    priority = Column(Integer, default=0)  # Più alto = servito prima
+    dedup_key = Column(String, nullable=True, index=True)  # Job uguali ancora in coda vengono accorpati
+    attempts = Column(Integer, default=0)
+    worker_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    deadline_at = Column(DateTime, nullable=True)  # Oltre questa data il job non serve più a nessuno
+    result = Column(Text, nullable=True)  # Esito in JSON
+    result_blob = Column(LargeBinary, nullable=True)  # Immagini in memoria (anteprime)
+    error = Column(String, nullable=True)
+
+class RenderWorker(Base):
+    """Heartbeat di un processo del servizio di rendering."""
+    __tablename__ = "render_workers"
+
+    id = Column(String, primary_key=True)  # host:pid
+    concurrency = Column(Integer, default=1)
+    running = Column(Integer, default=0)
+    jobs_done = Column(Integer, default=0)
+    jobs_failed = Column(Integer, default=0)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    last_seen_at = Column(DateTime, default=datetime.utcnow)
+
+class ModerationCacheEntry(Base):
+    """Esito della moderazione AI di un testo, riusato per lo stesso testo o uno quasi uguale."""
+    __tablename__ = "moderation_cache"
+
+    text_hash = Column(String, primary_key=True)  # sha256 del testo normalizzato
+    simhash = Column(String, nullable=True)  # SimHash a 64 bit (hex), None per testi troppo corti
+    # Il SimHash diviso in 8 blocchi da 8 bit: due impronte entro 7 bit
+    # coincidono in almeno un blocco, quindi la ricerca usa solo gli indici
+    band0 = Column(Integer, nullable=True, index=True)
+    band1 = Column(Integer, nullable=True, index=True)
+    band2 = Column(Integer, nullable=True, index=True)
+    band3 = Column(Integer, nullable=True, index=True)
+    band4 = Column(Integer, nullable=True, index=True)
+    band5 = Column(Integer, nullable=True, index=True)
+    band6 = Column(Integer, nullable=True, index=True)
+    band7 = Column(Integer, nullable=True, index=True)
+    decision = Column(String, nullable=False)
+    reason = Column(String, nullable=True)
+    category = Column(String, nullable=True)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    last_used_at = Column(DateTime, default=datetime.utcnow, index=True)  # Per l'eviction LRU
+
+class ModerationJob(Base):
+    """Messaggio in attesa della moderazione AI, servito da ModerationService."""
+    __tablename__ = "moderation_jobs"
+    __table_args__ = (Index("ix_moderation_jobs_claim", "status", "priority", "id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    message_id = Column(Integer, nullable=False, index=True)
+    status = Column(String, nullable=False, default="queued")  # queued, running, done, failed
+    priority = Column(Integer, default=0)  # Più alto = servito prima (rimoderazioni dell'admin)
+    attempts = Column(Integer, default=0)
+    not_before = Column(DateTime, nullable=True)  # Backoff: il job non viene preso prima di questa data
+    created_at = Column(DateTime, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    error = Column(String, nullable=True)
+
 class DailyPostSettings(Base):
     """Impostazioni per il post giornaliero di riepilogo."""
     __tablename__ = "daily_post_settings"
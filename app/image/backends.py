@@ -0,0 +1,259 @@
+"""
+Registro dei backend di rendering delle card.
+
+Ogni backend (wkhtmltoimage, Playwright, PIL) viene verificato una volta
+all'avvio con un render "canary" di cui si misura la latenza. Per ogni
+template il registro propone i backend HTML che lo supportano, dal più veloce
+al più lento, con PIL come ultima risorsa. Un circuit breaker esclude per un
+periodo di cooldown i backend che falliscono più volte di fila, così un
+renderer rotto non viene ritentato (e atteso) a ogni card.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from typing import List, Optional
+
+from config import settings
+from app.image.browser_pool import PLAYWRIGHT_AVAILABLE, get_browser_pool
+from app.image.renderer import get_template_renderer
+from app.image.wkhtml_daemon import WkhtmlUnavailable, get_wkhtml_daemon
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Ordine di preferenza a parità di latenza: i backend HTML prima di PIL
+HTML_BACKENDS = ("wkhtmltoimage", "playwright")
+FALLBACK_BACKEND = "pil"
+BACKENDS = HTML_BACKENDS + (FALLBACK_BACKEND,)
+
+# Un template che usa CSS moderno (filtri, animazioni, variabili) lo dichiara con
+# <meta name="card-renderer" content="chromium"> e viene escluso da wkhtmltoimage
+BROWSER_ONLY_MARKER = 'name="card-renderer" content="chromium"'
+
+CANARY_TEXT = "Canary render ✓"
+
+# Peso dell'ultimo render nella media mobile della latenza
+LATENCY_ALPHA = 0.2
+
+
+class BackendState:
+    """Disponibilità, latenza misurata e stato del circuit breaker di un backend."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.available = False
+        self.reason: Optional[str] = None
+        self.probed = False
+        self.probe_ms: Optional[float] = None
+        self.latency_ms: Optional[float] = None
+        self.successes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.trips = 0
+        self.last_error: Optional[str] = None
+
+    def breaker_state(self, now: float) -> str:
+        if self.open_until == 0.0:
+            return "closed"
+        return "open" if now < self.open_until else "half-open"
+
+    def to_dict(self, now: float) -> dict:
+        return {
+            "available": self.available,
+            "reason": self.reason,
+            "probed": self.probed,
+            "probe_ms": self.probe_ms,
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "breaker": self.breaker_state(now),
+            "breaker_retry_in_s": max(0, round(self.open_until - now)) if self.open_until else 0,
+            "trips": self.trips,
+            "last_error": self.last_error,
+        }
+
+
+class BackendRegistry:
+    """Sceglie il backend per ogni template e tiene traccia di latenze e guasti."""
+
+    def __init__(self, failure_threshold: int = None, cooldown_seconds: float = None):
+        self.failure_threshold = failure_threshold or settings.image.backend_failure_threshold
+        self.cooldown_seconds = cooldown_seconds or settings.image.backend_cooldown_seconds
+        self.states = {name: BackendState(name) for name in BACKENDS}
+        self.decisions = deque(maxlen=50)
+        self._template_flags = {}  # nome -> (mtime, richiede browser)
+        self._lock = threading.Lock()
+        self.detect()
+
+    def detect(self):
+        """Disponibilità dei backend senza render (binari e librerie installate)."""
+        daemon = get_wkhtml_daemon()
+        daemon.start()
+        wkhtml = self.states["wkhtmltoimage"]
+        wkhtml.available, wkhtml.reason = bool(daemon.available), daemon.unavailable_reason
+
+        playwright = self.states["playwright"]
+        playwright.available = PLAYWRIGHT_AVAILABLE
+        playwright.reason = None if PLAYWRIGHT_AVAILABLE else "playwright non installato"
+
+        pil = self.states["pil"]
+        pil.available = PIL_AVAILABLE
+        pil.reason = None if PIL_AVAILABLE else "Pillow non installato"
+
+    def requires_browser(self, template_name: str) -> bool:
+        """True se il template dichiara di poter essere renderizzato solo da Chromium."""
+        renderer = get_template_renderer()
+        path = os.path.join(renderer.templates_dir, template_name)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return False
+        cached = self._template_flags.get(template_name)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, encoding='utf-8') as f:
+            flag = BROWSER_ONLY_MARKER in f.read()
+        self._template_flags[template_name] = (mtime, flag)
+        return flag
+
+    def supports(self, backend: str, template_name: str) -> bool:
+        if backend == "wkhtmltoimage":
+            return not self.requires_browser(template_name)
+        return True
+
+    def route(self, template_name: str) -> List[str]:
+        """
+        Backend da provare per il template: prima quelli che lo supportano, dal
+        più veloce; poi quelli HTML che lo renderizzano in modo approssimato;
+        PIL sempre per ultimo.
+        """
+        available = [name for name in HTML_BACKENDS if self.states[name].available]
+        candidates = [name for name in available if self.supports(name, template_name)]
+        # Ordinamento stabile: i backend senza latenza misurata restano nell'ordine di preferenza
+        candidates.sort(key=lambda name: self.states[name].latency_ms if self.states[name].latency_ms is not None else float('inf'))
+        candidates += [name for name in available if name not in candidates]
+        if self.states[FALLBACK_BACKEND].available:
+            candidates.append(FALLBACK_BACKEND)
+        return candidates
+
+    def allow(self, backend: str) -> bool:
+        """Circuit breaker: False finché il backend è in cooldown. PIL è sempre ammesso."""
+        if backend == FALLBACK_BACKEND:
+            return True
+        state = self.states[backend]
+        return state.breaker_state(time.monotonic()) != "open"
+
+    def record_success(self, backend: str, seconds: float):
+        with self._lock:
+            state = self.states[backend]
+            state.successes += 1
+            state.consecutive_failures = 0
+            state.open_until = 0.0
+            ms = seconds * 1000
+            state.latency_ms = ms if state.latency_ms is None else (1 - LATENCY_ALPHA) * state.latency_ms + LATENCY_ALPHA * ms
+
+    def record_failure(self, backend: str, error: Exception, trip: bool = False):
+        """Conta l'errore; `trip` apre subito il breaker (es. canary fallito all'avvio)."""
+        with self._lock:
+            state = self.states[backend]
+            state.failures += 1
+            state.consecutive_failures += 1
+            state.last_error = str(error)[:300]
+            if isinstance(error, WkhtmlUnavailable):
+                # Il binario non parte: inutile riprovarlo fino al riavvio
+                state.available, state.reason = False, str(error)
+                return
+            half_open = state.breaker_state(time.monotonic()) == "half-open"
+            if trip or half_open or state.consecutive_failures >= self.failure_threshold:
+                state.open_until = time.monotonic() + self.cooldown_seconds
+                state.trips += 1
+                print(f"🔌 [Backends] Circuit breaker aperto per {backend} ({self.cooldown_seconds}s): {error}")
+
+    def record_decision(self, template_name: str, backend: Optional[str], tried: List[str], seconds: float):
+        self.decisions.append({
+            "at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "template": template_name,
+            "backend": backend,
+            "tried": list(tried),
+            "ms": round(seconds * 1000, 1),
+        })
+
+    def probe(self, generator, backends: List[str] = None):
+        """Render canary su ogni backend disponibile per misurarne la latenza reale."""
+        for name in backends or BACKENDS:
+            state = self.states[name]
+            if not state.available:
+                continue
+            output_path = os.path.join(tempfile.gettempdir(), f"canary_{name}_{os.getpid()}.png")
+            started = time.perf_counter()
+            try:
+                path = generator.render_with_backend(name, CANARY_TEXT, output_path, 0)
+            except Exception as e:
+                # Un errore transitorio (Chromium lento, timeout) non esclude il backend per sempre:
+                # il breaker lo riammette dopo il cooldown. Solo WkhtmlUnavailable lo disattiva.
+                print(f"❌ [Backends] Canary {name} fallito: {e}")
+                self.record_failure(name, e, trip=True)
+                continue
+            finally:
+                state.probed = True
+            elapsed = time.perf_counter() - started
+            state.probe_ms = round(elapsed * 1000, 1)
+            self.record_success(name, elapsed)
+            print(f"✅ [Backends] Canary {name}: {state.probe_ms}ms")
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """Stato dei backend, routing per i template attivi e ultime decisioni."""
+        now = time.monotonic()
+        active = [os.path.basename(settings.image.template_path), get_template_renderer().template_name_for("info")]
+        return {
+            "backends": {name: state.to_dict(now) for name, state in self.states.items()},
+            "routing": {template: self.route(template) for template in active},
+            "decisions": list(self.decisions)[::-1],
+        }
+
+
+_registry: Optional[BackendRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_backend_registry() -> BackendRegistry:
+    """Restituisce il registro dei backend condiviso dal processo."""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = BackendRegistry()
+        return _registry
+
+
+def probe_render_backends():
+    """
+    Verifica i backend in background all'avvio. Chromium viene avviato solo se
+    serve: wkhtmltoimage assente o un template attivo che richiede il browser.
+    """
+    def _probe():
+        from app.image.generator import ImageGenerator
+        try:
+            registry = get_backend_registry()
+            active = [os.path.basename(settings.image.template_path), get_template_renderer().template_name_for("info")]
+            backends = ["wkhtmltoimage", "pil"]
+            needs_browser = not registry.states["wkhtmltoimage"].available or any(registry.requires_browser(t) for t in active)
+            if needs_browser and registry.states["playwright"].available:
+                get_browser_pool().start()
+                backends.insert(1, "playwright")
+            registry.probe(ImageGenerator(), backends)
+            print(f"🧭 [Backends] Routing: {registry.stats()['routing']}")
+        except Exception as e:
+            print(f"⚠️ [Backends] Verifica dei backend fallita: {e}")
+
+    threading.Thread(target=_probe, name="render-backend-probe", daemon=True).start()
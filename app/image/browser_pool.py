@@ -0,0 +1,238 @@
+"""
+Pool persistente di browser Chromium per il rendering delle card.
+
+L'API sync di Playwright è legata al thread che l'ha creata, quindi ogni
+slot del pool è un thread dedicato che possiede il proprio `sync_playwright`,
+il proprio browser e una pagina riutilizzabile. I job arrivano tramite una
+coda limitata e vengono eseguiti dal primo slot libero.
+"""
+
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable, Optional, Any
+
+from config import settings
+
+try:
+    from playwright.sync_api import sync_playwright
+    PLAYWRIGHT_AVAILABLE = True
+except ImportError:
+    PLAYWRIGHT_AVAILABLE = False
+
+CHROMIUM_ARGS = [
+    '--no-sandbox',
+    '--disable-setuid-sandbox',
+    '--disable-dev-shm-usage',
+    '--disable-web-security',  # Permetti file locali
+    '--allow-file-access-from-files',
+    '--disable-features=VizDisplayCompositor'
+]
+
+
+class BrowserPoolFull(RuntimeError):
+    """Sollevata quando la coda del pool è piena (backpressure verso il chiamante)."""
+
+
+class _BrowserSlot(threading.Thread):
+    """Thread che possiede un browser Chromium e una pagina riutilizzabile."""
+
+    def __init__(self, pool: "BrowserPool", index: int):
+        super().__init__(name=f"browser-slot-{index}", daemon=True)
+        self.pool = pool
+        self.index = index
+        self.ready = threading.Event()
+        self._playwright = None
+        self._browser = None
+        self._page = None
+        self.renders = 0
+        self.recycles = 0
+
+    def _launch(self):
+        """Avvia (o riavvia) il browser e la pagina dello slot."""
+        self._close_browser()
+        self._browser = self._playwright.chromium.launch(headless=True, args=CHROMIUM_ARGS)
+        self._page = self._browser.new_page(
+            viewport={'width': self.pool.viewport[0], 'height': self.pool.viewport[1]},
+            device_scale_factor=1
+        )
+        self.renders = 0
+        print(f"🌐 [BrowserPool] Slot {self.index}: Chromium avviato")
+
+    def _close_browser(self):
+        if self._browser is not None:
+            try:
+                self._browser.close()
+            except Exception:
+                pass
+        self._browser = None
+        self._page = None
+
+    def _is_healthy(self) -> bool:
+        """Health check: browser connesso e pagina ancora aperta."""
+        try:
+            return bool(self._browser and self._browser.is_connected() and self._page and not self._page.is_closed())
+        except Exception:
+            return False
+
+    def run(self):
+        try:
+            self._playwright = sync_playwright().start()
+            self._launch()
+        except Exception as e:
+            print(f"❌ [BrowserPool] Slot {self.index}: avvio Chromium fallito: {e}")
+            self.pool._slot_failed(self, e)
+            self.ready.set()
+            return
+        self.ready.set()
+
+        while not self.pool._stopping.is_set():
+            try:
+                job = self.pool._jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if job is None:
+                break
+
+            fn, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                # Riciclo dopo K render o se il browser non risponde più
+                if self.renders >= self.pool.recycle_after or not self._is_healthy():
+                    self.recycles += 1
+                    self._launch()
+                future.set_result(fn(self._page))
+            except Exception as e:
+                future.set_exception(e)
+                # Dopo un errore la pagina potrebbe essere in uno stato sporco
+                if not self._is_healthy():
+                    try:
+                        self._launch()
+                    except Exception as launch_error:
+                        print(f"❌ [BrowserPool] Slot {self.index}: riavvio fallito: {launch_error}")
+            finally:
+                self.renders += 1
+
+        self._close_browser()
+        try:
+            self._playwright.stop()
+        except Exception:
+            pass
+
+
+class BrowserPool:
+    """
+    Pool di N browser Chromium pre-avviati con pagine riutilizzabili,
+    health check, riciclo dopo K render e coda di job limitata.
+    """
+
+    def __init__(self, size: int = None, recycle_after: int = None, queue_size: int = None,
+                 viewport: tuple = None):
+        self.size = size or settings.image.browser_pool_size
+        self.recycle_after = recycle_after or settings.image.browser_recycle_after
+        self.viewport = viewport or (settings.image.width, settings.image.height)
+        self._jobs: "queue.Queue" = queue.Queue(maxsize=queue_size or settings.image.browser_queue_size)
+        self._stopping = threading.Event()
+        self._slots = []
+        self._failed = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Avvia tutti gli slot e attende che i browser siano pronti."""
+        with self._lock:
+            if any(slot.is_alive() for slot in self._slots):
+                return
+            if self._slots:
+                # Tutti i thread sono terminati (es. crash di Chromium): il pool va ricreato
+                print("♻️ [BrowserPool] Nessuno slot attivo: ricreo il pool")
+            self._stopping.clear()
+            self._failed = 0
+            self._slots = [_BrowserSlot(self, i) for i in range(self.size)]
+            for slot in self._slots:
+                slot.start()
+        for slot in self._slots:
+            slot.ready.wait(timeout=60)
+        if self._failed >= self.size:
+            self.shutdown()
+            raise RuntimeError("Nessun browser Chromium avviato nel pool")
+
+    def _slot_failed(self, slot: _BrowserSlot, error: Exception):
+        with self._lock:
+            self._failed += 1
+
+    @property
+    def running(self) -> bool:
+        return any(slot.is_alive() for slot in self._slots)
+
+    def submit(self, fn: Callable[[Any], Any], block_timeout: float = 5.0) -> Future:
+        """
+        Accoda un job `fn(page)` e restituisce un Future.
+        Se la coda è piena per più di `block_timeout` secondi solleva BrowserPoolFull.
+        """
+        if not self.running:
+            self.start()
+        future: Future = Future()
+        try:
+            self._jobs.put((fn, future), timeout=block_timeout)
+        except queue.Full:
+            raise BrowserPoolFull(f"Coda del browser pool piena ({self._jobs.maxsize} job)")
+        return future
+
+    def run(self, fn: Callable[[Any], Any], timeout: float = None) -> Any:
+        """Esegue `fn(page)` su una pagina del pool e ne restituisce il risultato."""
+        future = self.submit(fn)
+        return future.result(timeout=timeout or settings.image.browser_job_timeout)
+
+    def stats(self) -> dict:
+        """Statistiche del pool per dashboard e log."""
+        return {
+            "size": self.size,
+            "alive": sum(1 for slot in self._slots if slot.is_alive()),
+            "queued": self._jobs.qsize(),
+            "queue_size": self._jobs.maxsize,
+            "renders": [slot.renders for slot in self._slots],
+            "recycles": sum(slot.recycles for slot in self._slots),
+        }
+
+    def shutdown(self):
+        """Chiude tutti i browser del pool."""
+        self._stopping.set()
+        for slot in self._slots:
+            slot.join(timeout=10)
+        with self._lock:
+            self._slots = []
+            self._failed = 0
+
+
+_pool: Optional[BrowserPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_browser_pool() -> BrowserPool:
+    """Restituisce il pool di browser condiviso dal processo (creato alla prima richiesta)."""
+    global _pool
+    if not PLAYWRIGHT_AVAILABLE:
+        raise RuntimeError("Playwright non disponibile")
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def warm_up_browser_pool():
+    """Pre-avvia i browser del pool in background, senza bloccare il chiamante."""
+    if not PLAYWRIGHT_AVAILABLE:
+        return
+
+    def _warm():
+        try:
+            get_browser_pool().start()
+            print("🔥 [BrowserPool] Browser pre-avviati e pronti")
+        except Exception as e:
+            print(f"⚠️ [BrowserPool] Warm-up fallito: {e}")
+
+    threading.Thread(target=_warm, name="browser-pool-warmup", daemon=True).start()
@@ -0,0 +1,151 @@
+"""
+Cache content-addressed delle card generate.
+
+La chiave è un hash degli input del render (template, tipo, testo, id, titolo,
+dimensioni) più l'hash del contenuto del file template: se il template cambia
+su disco le vecchie card non vengono più servite. I PNG ottimizzati restano in
+`data/generated_images/cache` con eviction LRU limitata in byte.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from config import settings
+
+
+class RenderCache:
+    """Cache LRU su disco delle card già renderizzate, con contatori hit/miss."""
+
+    def __init__(self, cache_dir: str = None, max_bytes: int = None):
+        self.cache_dir = cache_dir or os.path.join(settings.image.output_folder, "cache")
+        self.max_bytes = max_bytes if max_bytes is not None else settings.image.render_cache_max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (path, size)
+        self._template_hashes = {}  # path -> (mtime, sha256)
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    def _load_index(self):
+        """Ricostruisce l'indice LRU dai file presenti, dal meno al più recente."""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if os.path.isfile(path):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, os.path.splitext(name)[0], path, stat.st_size))
+        for _, key, path, size in sorted(files):
+            self._entries[key] = (path, size)
+            self.total_bytes += size
+
+    def template_hash(self, template_path: str) -> str:
+        """Hash del contenuto del template, ricalcolato solo quando cambia l'mtime."""
+        mtime = os.path.getmtime(template_path)
+        cached = self._template_hashes.get(template_path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(template_path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        self._template_hashes[template_path] = (mtime, digest)
+        return digest
+
+    def make_key(self, template_path: str, message_type: str, message_text: str,
+                 message_id: int, title: Optional[str], **extra) -> str:
+        """Calcola la chiave content-addressed di un render."""
+        payload = {
+            "template": os.path.basename(template_path),
+            "template_hash": self.template_hash(template_path),
+            "message_type": message_type,
+            "text": message_text,
+            "id": message_id,
+            "title": title,
+            "width": settings.image.width,
+            "height": settings.image.height,
+        }
+        payload.update(extra)
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False).encode('utf-8')
+        return hashlib.sha256(raw).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Restituisce il percorso della card in cache, o None se assente."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and os.path.exists(entry[0]):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                path = entry[0]
+            else:
+                if entry:
+                    # File rimosso dall'esterno: pulisci l'indice
+                    self._entries.pop(key)
+                    self.total_bytes -= entry[1]
+                self.misses += 1
+                return None
+        try:
+            # Persiste la recency per ricostruire l'LRU al riavvio
+            os.utime(path, None)
+        except OSError:
+            pass
+        return path
+
+    def put(self, key: str, rendered_path: str) -> str:
+        """
+        Sposta la card appena generata nella cache e restituisce il nuovo percorso.
+        Il file viene spostato (non copiato) per non duplicarlo su disco.
+        """
+        extension = os.path.splitext(rendered_path)[1] or ".png"
+        cached_path = os.path.join(self.cache_dir, f"{key}{extension}")
+        os.replace(rendered_path, cached_path)
+        size = os.path.getsize(cached_path)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous:
+                self.total_bytes -= previous[1]
+            self._entries[key] = (cached_path, size)
+            self.total_bytes += size
+            self._evict()
+        return cached_path
+
+    def _evict(self):
+        """Elimina le card meno usate finché la cache rientra nel limite di byte."""
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            _, (path, size) = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        """Statistiche della cache per dashboard e log."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
+
+
+_cache: Optional[RenderCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> RenderCache:
+    """Restituisce la cache dei render condivisa dal processo."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RenderCache()
+        return _cache
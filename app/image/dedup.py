@@ -0,0 +1,254 @@
+"""
+Rilevamento delle storie quasi duplicate.
+
+Ogni card ha due impronte: un hash percettivo dell'immagine (dHash 16x16,
+256 bit) e un SimHash a 64 bit del testo normalizzato (minuscole, senza
+accenti, punteggiatura ed emoji). Le storie pubblicate negli ultimi
+`dedup_window_days` giorni stanno in memoria: le impronte del testo in un
+indice multi-index hashing, gli hash delle card (molto simili tra loro per
+via dello sfondo comune) in un BK-tree. La ricerca dei vicini entro pochi
+bit visita solo una piccola parte dell'indice e richiede frazioni di
+millisecondo.
+
+L'indice viene caricato dal database e riallineato periodicamente, così
+vede anche le storie pubblicate da un altro processo (es. worker.py).
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Callable, NamedTuple, Optional
+
+from PIL import Image
+
+from app.text_fingerprint import TEXT_BITS, from_hex, hamming
+from config import settings
+
+HASH_SIZE = 16  # dHash HASH_SIZE x HASH_SIZE bit
+# Card con testi brevi diversi hanno hash percettivi vicini: una somiglianza
+# solo visiva conta se anche i testi non sono del tutto scorrelati (due testi
+# indipendenti differiscono in circa 32 bit su 64)
+IMAGE_MATCH_TEXT_DISTANCE = 24
+
+
+def image_phash(image) -> int:
+    """dHash della card (percorso o immagine PIL): confronta i pixel adiacenti della miniatura in scala di grigi."""
+    if isinstance(image, str):
+        with Image.open(image) as img:
+            img.draft("L", (HASH_SIZE * 4, HASH_SIZE * 4))
+            small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    else:
+        small = image.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.BILINEAR)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            value = value << 1 | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class BKTree:
+    """BK-tree sulla distanza di Hamming: nodi [chiave, elementi, figli per distanza]."""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, key: int, item):
+        self.size += 1
+        if self.root is None:
+            self.root = [key, [item], {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [item], {}]
+                return
+            node = child
+
+    def search(self, key: int, max_distance: int) -> list:
+        """Elementi entro `max_distance` bit, come (distanza, elemento) ordinati per distanza."""
+        results = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(key, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            # Disuguaglianza triangolare: solo i figli a distanza compatibile
+            children = node[2]
+            for child_distance in range(max(1, distance - max_distance), distance + max_distance + 1):
+                child = children.get(child_distance)
+                if child is not None:
+                    stack.append(child)
+        return sorted(results, key=lambda result: result[0])
+
+
+class MultiIndexHash:
+    """
+    Multi-index hashing per chiavi distribuite in modo uniforme (le impronte
+    del testo): divisa la chiave in max_distance + 1 blocchi, due chiavi entro
+    max_distance bit coincidono esattamente in almeno un blocco.
+    """
+
+    def __init__(self, bits: int, max_distance: int):
+        self.max_distance = max_distance
+        chunks = max_distance + 1
+        self._spans = []
+        start = 0
+        for i in range(chunks):
+            width = bits // chunks + (1 if i < bits % chunks else 0)
+            self._spans.append((start, (1 << width) - 1))
+            start += width
+        self._tables = [{} for _ in self._spans]
+        self._keys = {}
+        self.size = 0
+
+    def add(self, key: int, item):
+        self.size += 1
+        self._keys[item] = key
+        for table, (shift, mask) in zip(self._tables, self._spans):
+            table.setdefault(key >> shift & mask, []).append(item)
+
+    def search(self, key: int, max_distance: int = None) -> list:
+        """Elementi entro `max_distance` bit (al massimo quella dell'indice), ordinati per distanza."""
+        max_distance = self.max_distance if max_distance is None else min(max_distance, self.max_distance)
+        candidates = set()
+        for table, (shift, mask) in zip(self._tables, self._spans):
+            candidates.update(table.get(key >> shift & mask, ()))
+        results = [(hamming(key, self._keys[item]), item) for item in candidates]
+        return sorted((result for result in results if result[0] <= max_distance), key=lambda result: result[0])
+
+
+class DuplicateMatch(NamedTuple):
+    message_id: int
+    reason: str  # text | image
+    distance: int
+
+
+class DuplicateIndex:
+    """Indice in memoria delle storie pubblicate di recente."""
+
+    def __init__(self, session_factory: Callable = None, window_days: int = None,
+                 text_max_distance: int = None, image_max_distance: int = None, refresh_seconds: float = 30):
+        self.session_factory = session_factory
+        self.window = timedelta(days=window_days if window_days is not None else settings.image.dedup_window_days)
+        self.text_max_distance = text_max_distance if text_max_distance is not None else settings.image.dedup_text_max_distance
+        self.image_max_distance = image_max_distance if image_max_distance is not None else settings.image.dedup_image_max_distance
+        self.refresh_seconds = refresh_seconds
+        self._entries = {}  # message_id -> (posted_at, impronta testo, hash immagine)
+        self._text_index = MultiIndexHash(TEXT_BITS, self.text_max_distance)
+        self._image_index = BKTree()
+        self._lock = threading.Lock()
+        self._watermark = None
+        self._next_refresh = 0.0
+        self.checks = 0
+        self.check_us_total = 0.0
+        self.duplicates = {"text": 0, "image": 0}
+
+    def add(self, message_id: int, text_fp: Optional[int], phash: Optional[int], posted_at: datetime = None):
+        with self._lock:
+            self._add(message_id, text_fp, phash, posted_at or datetime.utcnow())
+
+    def _add(self, message_id, text_fp, phash, posted_at):
+        if message_id in self._entries:
+            return
+        self._entries[message_id] = (posted_at, text_fp, phash)
+        if text_fp is not None:
+            self._text_index.add(text_fp, message_id)
+        if phash is not None:
+            self._image_index.add(phash, message_id)
+
+    def add_message(self, message):
+        """Aggiunge una storia pubblicata con le impronte registrate sul messaggio."""
+        self.add(message.id, from_hex(message.text_fingerprint), from_hex(message.card_phash), message.posted_at)
+
+    def check(self, text_fp: Optional[int], phash: Optional[int] = None, exclude_id: int = None) -> Optional[DuplicateMatch]:
+        """Storia pubblicata più vicina entro le soglie (prima il testo, poi l'immagine)."""
+        self.refresh()
+        started = time.perf_counter()
+        match = None
+        with self._lock:
+            for reason, key, tree, max_distance in (
+                ("text", text_fp, self._text_index, self.text_max_distance),
+                ("image", phash, self._image_index, self.image_max_distance),
+            ):
+                if key is None:
+                    continue
+                found = [
+                    (d, message_id) for d, message_id in tree.search(key, max_distance)
+                    if message_id != exclude_id and (reason == "text" or self._texts_related(text_fp, message_id))
+                ]
+                if found:
+                    match = DuplicateMatch(found[0][1], reason, found[0][0])
+                    self.duplicates[reason] += 1
+                    break
+            self.checks += 1
+            self.check_us_total += (time.perf_counter() - started) * 1_000_000
+        return match
+
+    def _texts_related(self, text_fp: Optional[int], message_id: int) -> bool:
+        other = self._entries[message_id][1]
+        return text_fp is None or other is None or hamming(text_fp, other) <= IMAGE_MATCH_TEXT_DISTANCE
+
+    def refresh(self, force: bool = False):
+        """Carica le storie pubblicate dopo l'ultimo allineamento e scarta quelle fuori finestra."""
+        if self.session_factory is None or (not force and time.monotonic() < self._next_refresh):
+            return
+        self._next_refresh = time.monotonic() + self.refresh_seconds
+        from app.database import MessageStatus, SpottedMessage
+
+        cutoff = datetime.utcnow() - self.window
+        db = self.session_factory()
+        try:
+            query = db.query(
+                SpottedMessage.id, SpottedMessage.posted_at, SpottedMessage.text_fingerprint, SpottedMessage.card_phash
+            ).filter(SpottedMessage.status == MessageStatus.POSTED, SpottedMessage.posted_at >= max(cutoff, self._watermark or cutoff))
+            rows = query.all()
+        finally:
+            db.close()
+        with self._lock:
+            for row in rows:
+                self._add(row.id, from_hex(row.text_fingerprint), from_hex(row.card_phash), row.posted_at)
+                if self._watermark is None or row.posted_at > self._watermark:
+                    self._watermark = row.posted_at
+            if any(posted_at < cutoff for posted_at, _, _ in self._entries.values()):
+                self._rebuild(cutoff)
+
+    def _rebuild(self, cutoff: datetime):
+        # I BK-tree non supportano la rimozione: si ricostruiscono con le sole storie in finestra
+        entries = {k: v for k, v in self._entries.items() if v[0] >= cutoff}
+        self._entries = {}
+        self._text_index = MultiIndexHash(TEXT_BITS, self.text_max_distance)
+        self._image_index = BKTree()
+        for message_id, (posted_at, text_fp, phash) in entries.items():
+            self._add(message_id, text_fp, phash, posted_at)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "checks": self.checks,
+            "avg_check_us": round(self.check_us_total / self.checks, 1) if self.checks else None,
+            "duplicates": dict(self.duplicates),
+            "action": settings.image.dedup_action,
+        }
+
+
+_index: Optional[DuplicateIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_duplicate_index() -> DuplicateIndex:
+    """Restituisce l'indice dei duplicati condiviso dal processo."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            from app.database import SessionLocal
+            _index = DuplicateIndex(session_factory=SessionLocal)
+        return _index
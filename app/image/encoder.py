@@ -0,0 +1,239 @@
+"""
+Stadio di codifica delle card generate.
+
+Tutti i renderer producono un'immagine PIL in memoria; qui viene adattata alle
+specifiche delle Instagram Stories e scritta su disco una sola volta, con
+l'encoder scelto in configurazione (PNG veloce, JPEG o WebP).
+
+Con `encode_target_kb` impostato la codifica cerca i parametri migliori che
+stanno sotto il budget di byte: la qualità per JPEG e WebP (ricerca binaria),
+compressione massima e poi palette ridotte per PNG. Le card di uno stesso
+template si comprimono in modo simile, quindi i parametri scelti vengono
+ricordati per profilo (template e backend) e la ricerca riparte da lì: a
+regime basta una sola codifica per card.
+"""
+
+import io
+import os
+import threading
+import time
+from typing import NamedTuple, Optional
+
+try:
+    from PIL import Image, features
+    WEBP_AVAILABLE = features.check("webp")
+except ImportError:
+    Image = None
+    WEBP_AVAILABLE = False
+
+from config import settings
+
+# Instagram Stories: massimo 1080x1920
+INSTAGRAM_MAX_SIZE = (1080, 1920)
+
+EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "webp": ".webp"}
+
+# Passi PNG dal migliore al più compatto: (compress_level, colori della palette)
+PNG_LADDER = ((None, None), (9, None), (9, 256), (9, 128))
+
+# Sotto questa frazione del budget si prova a risalire di qualità
+REFINE_BELOW = 0.75
+
+
+class EncodeResult(NamedTuple):
+    """Esito della codifica: percorso scritto, byte, tempo impiegato e parametri scelti."""
+    path: str
+    format: str
+    bytes_written: int
+    seconds: float
+    params: dict = {}
+    attempts: int = 1
+
+
+def prepare_for_instagram(img: "Image.Image") -> "Image.Image":
+    """Converte in RGB e ridimensiona entro 1080x1920, senza passare dal disco."""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if img.size[0] > INSTAGRAM_MAX_SIZE[0] or img.size[1] > INSTAGRAM_MAX_SIZE[1]:
+        img = img.copy()
+        img.thumbnail(INSTAGRAM_MAX_SIZE, Image.Resampling.LANCZOS)
+    return img
+
+
+def output_path_for(path: str, fmt: str) -> str:
+    """Adegua l'estensione del file al formato di output."""
+    root, _ = os.path.splitext(path)
+    return root + EXTENSIONS[fmt]
+
+
+def resolve_format(fmt: Optional[str] = None) -> str:
+    """Formato effettivo: WebP ricade su JPEG se Pillow non ha libwebp."""
+    fmt = (fmt or settings.image.output_format).lower()
+    if fmt not in EXTENSIONS:
+        raise ValueError(f"Formato di output non supportato: {fmt}")
+    if fmt == "webp" and not WEBP_AVAILABLE:
+        return "jpeg"
+    return fmt
+
+
+def encode_to_bytes(img: "Image.Image", fmt: Optional[str] = None, quality: Optional[int] = None,
+                    compress_level: Optional[int] = None, colors: Optional[int] = None) -> bytes:
+    """Codifica l'immagine in memoria con l'encoder scelto."""
+    fmt = resolve_format(fmt)
+    buffer = io.BytesIO()
+    if fmt == "jpeg":
+        # Instagram ricodifica comunque: JPEG di alta qualità senza subsampling
+        # del colore, per non sporcare il testo
+        img.save(buffer, 'JPEG', quality=quality or settings.image.jpeg_quality, subsampling=0, optimize=False)
+    elif fmt == "webp":
+        img.save(buffer, 'WEBP', quality=quality or settings.image.webp_quality, method=settings.image.webp_method)
+    else:
+        if colors:
+            img = img.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+        # Livello di compressione basso: un solo passaggio zlib veloce
+        img.save(buffer, 'PNG', compress_level=compress_level or settings.image.png_compress_level)
+    return buffer.getvalue()
+
+
+class _ProfileStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.bytes = 0
+        self.attempts = 0
+        self.over_budget = 0
+        self.params = {}
+
+
+class TargetSizeEncoder:
+    """Codifica sotto un budget di byte, con i parametri ricordati per profilo."""
+
+    def __init__(self, min_quality: int = None):
+        self.min_quality = min_quality if min_quality is not None else settings.image.encode_min_quality
+        self._params = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def encode(self, img: "Image.Image", fmt: str, profile: str, target_bytes: int):
+        """Restituisce (dati, parametri, tentativi): i migliori parametri che stanno nel budget."""
+        key = (profile, fmt, target_bytes)
+        with self._lock:
+            cached = self._params.get(key)
+        if fmt == "png":
+            data, params, attempts = self._search_png(img, target_bytes, cached)
+        else:
+            max_quality = settings.image.jpeg_quality if fmt == "jpeg" else settings.image.webp_quality
+            data, params, attempts = self._search_quality(img, fmt, target_bytes, max_quality, cached)
+        with self._lock:
+            self._params[key] = params
+        return data, params, attempts
+
+    def _search_quality(self, img, fmt, target_bytes, max_quality, cached):
+        attempts = 0
+        outputs = {}
+
+        def encode(quality):
+            nonlocal attempts
+            if quality not in outputs:
+                attempts += 1
+                outputs[quality] = encode_to_bytes(img, fmt, quality=quality)
+            return outputs[quality]
+
+        low, high = self.min_quality, max_quality
+        best = None
+        # Si parte dalla qualità scelta l'ultima volta per questo profilo, o dalla massima
+        start = min(max(cached["quality"], low), high) if cached else high
+        if len(encode(start)) <= target_bytes:
+            best = start
+            if start == high or len(outputs[start]) >= target_bytes * REFINE_BELOW:
+                return outputs[start], {"quality": start}, attempts
+            low = start + 1
+        else:
+            high = start - 1
+        while low <= high:
+            middle = (low + high) // 2
+            if len(encode(middle)) <= target_bytes:
+                best, low = middle, middle + 1
+            else:
+                high = middle - 1
+        if best is None:
+            # Budget irraggiungibile: la qualità minima è il meglio che si può fare
+            best = self.min_quality
+        return encode(best), {"quality": best}, attempts
+
+    def _search_png(self, img, target_bytes, cached):
+        attempts = 0
+        ladder = list(PNG_LADDER)
+        if cached:
+            # Lo stesso profilo riparte dal passo che aveva funzionato
+            step = (cached.get("compress_level"), cached.get("colors"))
+            ladder = ladder[ladder.index(step):] if step in ladder else ladder
+        data = None
+        for compress_level, colors in ladder:
+            attempts += 1
+            data = encode_to_bytes(img, "png", compress_level=compress_level, colors=colors)
+            if len(data) <= target_bytes:
+                break
+        return data, {"compress_level": compress_level, "colors": colors}, attempts
+
+    def record(self, profile: str, fmt: str, size: int, seconds: float, params: dict, attempts: int, target_bytes: int):
+        with self._lock:
+            stats = self._stats.setdefault(f"{profile}:{fmt}", _ProfileStats())
+            stats.count += 1
+            stats.seconds += seconds
+            stats.bytes += size
+            stats.attempts += attempts
+            stats.over_budget += bool(target_bytes and size > target_bytes)
+            stats.params = params
+
+    def stats(self) -> dict:
+        """Per profilo e formato: codifiche, tempo e dimensione medi, tentativi e parametri correnti."""
+        with self._lock:
+            return {
+                "target_kb": settings.image.encode_target_kb,
+                "profiles": {
+                    key: {
+                        "encodes": s.count,
+                        "avg_ms": round(s.seconds * 1000 / s.count, 1),
+                        "avg_kb": round(s.bytes / s.count / 1024, 1),
+                        "avg_attempts": round(s.attempts / s.count, 2),
+                        "over_budget": s.over_budget,
+                        "params": s.params,
+                    }
+                    for key, s in self._stats.items()
+                },
+            }
+
+
+_encoder: Optional[TargetSizeEncoder] = None
+_encoder_lock = threading.Lock()
+
+
+def get_target_encoder() -> TargetSizeEncoder:
+    """Restituisce l'encoder condiviso dal processo (parametri per profilo e statistiche)."""
+    global _encoder
+    with _encoder_lock:
+        if _encoder is None:
+            _encoder = TargetSizeEncoder()
+        return _encoder
+
+
+def encode_image(img: "Image.Image", output_path: str, fmt: Optional[str] = None,
+                 profile: str = "default", target_bytes: Optional[int] = None) -> EncodeResult:
+    """Prepara l'immagine per Instagram e la scrive su disco con una sola codifica (o una ricerca entro il budget)."""
+    fmt = resolve_format(fmt)
+    if target_bytes is None:
+        target_bytes = settings.image.encode_target_kb * 1024
+    encoder = get_target_encoder()
+    started = time.perf_counter()
+    img = prepare_for_instagram(img)
+    if target_bytes:
+        data, params, attempts = encoder.encode(img, fmt, profile, target_bytes)
+    else:
+        data, params, attempts = encode_to_bytes(img, fmt), {}, 1
+    path = output_path_for(output_path, fmt)
+    with open(path, 'wb') as f:
+        f.write(data)
+    seconds = time.perf_counter() - started
+    encoder.record(profile, fmt, len(data), seconds, params, attempts, target_bytes)
+    return EncodeResult(path, fmt, len(data), seconds, params, attempts)
@@ -1,472 +1,504 @@
-import imgkit
-import jinja2
+import io
 import os
-from pathlib import Path
-from typing import Optional
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, List, NamedTuple
 from config import settings
 
-# Import PIL come fallback di emergenza per problemi di compatibilità wkhtmltoimage
+# Import PIL (e NumPy per gli sfondi precalcolati) come fallback di emergenza
+# per problemi di compatibilità wkhtmltoimage
 try:
     from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
+    import numpy as np
     PIL_AVAILABLE = True
 except ImportError:
     PIL_AVAILABLE = False
 
-# Import Playwright come alternativa headless quando wkhtmltoimage non funziona
-try:
-    from playwright.sync_api import sync_playwright
-    PLAYWRIGHT_AVAILABLE = True
-except ImportError:
-    PLAYWRIGHT_AVAILABLE = False
+# Metodo di ImageGenerator che implementa ciascun backend del registro
+BACKEND_METHODS = {
+    "wkhtmltoimage": "_generate_with_wkhtmltoimage",
+    "playwright": "_generate_with_playwright",
+    "pil": "_generate_with_pil",
+}
+
+# Metodo che renderizza tutti i fotogrammi di un messaggio lungo con ciascun backend
+FRAME_METHODS = {
+    "wkhtmltoimage": "_frames_with_wkhtmltoimage",
+    "playwright": "_frames_with_playwright",
+    "pil": "_frames_with_pil",
+}
+
+# Tempi per stadio dell'ultimo render eseguito da ciascun thread
+_render_stats = threading.local()
+
+# Sfondi statici del fallback PIL, calcolati una volta per template e dimensione
+_PIL_BACKGROUND_CACHE = {}
+_PIL_BACKGROUND_LOCK = threading.Lock()
+
+# Atlante degli sfondi dei collage: uno per dimensione, stile e griglia,
+# costruito una volta e poi solo copiato
+_COLLAGE_ATLAS = {}
+_COLLAGE_ATLAS_LOCK = threading.Lock()
+
+# Stili dei collage giornalieri (valori di DailyPostStyle diversi da carousel)
+COLLAGE_STYLES = {
+    "grid": {
+        "background": (0, 20, 40), "rings": (0, 122, 255), "cell": (0, 122, 255, 30),
+        "text": "#00A0FF", "outline": "#FFFFFF", "title": "#00A0FF", "title_outline": "#001122",
+        "page_grid": (2, 3), "padding": 20,
+    },
+    "compact": {
+        "background": (0, 20, 40), "rings": (0, 122, 255), "cell": (0, 122, 255, 30),
+        "text": "#00A0FF", "outline": "#FFFFFF", "title": "#00A0FF", "title_outline": "#001122",
+        "page_grid": (3, 3), "padding": 12,
+    },
+    "elegant": {
+        "background": (18, 14, 10), "rings": (212, 175, 55), "cell": (212, 175, 55, 24),
+        "text": "#F5E6B8", "outline": "#1A1208", "title": "#D4AF37", "title_outline": "#1A1208",
+        "page_grid": (2, 2), "padding": 28,
+    },
+}
+
+# Playwright come alternativa headless quando wkhtmltoimage non funziona:
+# i browser sono gestiti da un pool persistente condiviso dal processo
+from app.image.browser_pool import PLAYWRIGHT_AVAILABLE, get_browser_pool
+from app.image.cache import get_render_cache
+from app.image.encoder import encode_image, encode_to_bytes
+from app.image.layout import FONT_PATH, fit_text, get_font, needs_pagination, paginate_text, word_width
+from app.image.renderer import INFO_TEMPLATE, TEMPLATES_DIR, get_template_renderer
+from app.image.wkhtml_daemon import get_wkhtml_daemon
+from app.image.backends import get_backend_registry
+
+class CardRequest(NamedTuple):
+    """Una card da renderizzare in un batch."""
+    text: str
+    id: int
+    message_type: str = "spotted"
+    title: Optional[str] = None
+
+class PreviewImage(NamedTuple):
+    """Anteprima JPEG in memoria di una card."""
+    data: bytes
+    backend: str
+    width: int
+    height: int
+    ms: float
+
+class BatchRenderResult(NamedTuple):
+    """Esito di un singolo elemento di render_batch."""
+    index: int
+    message_id: int
+    path: Optional[str]
+    error: Optional[str]
+    seconds: float
+    # Tutti i fotogrammi (il primo è `path`), solo se richiesti con frames=True
+    frames: Optional[List[str]] = None
+
+# Pronto quando i font sono caricati e, se il template emette il segnale
+# (script con attributo data-card-ready), quando ha impostato window.__cardReady
+CARD_READY_JS = """
+() => document.fonts.status === 'loaded'
+    && (window.__cardReady === true || !document.querySelector('script[data-card-ready]'))
+"""
+
+# Congela tutte le animazioni CSS al fotogramma iniziale, attende che il layout
+# sia stato dipinto (due requestAnimationFrame) e verifica che la card esista
+FREEZE_AND_CHECK_JS = """
+async () => {
+    await document.fonts.ready;
+    const animations = document.getAnimations ? document.getAnimations() : [];
+    for (const animation of animations) {
+        animation.pause();
+        animation.currentTime = 0;
+    }
+    await new Promise(resolve => requestAnimationFrame(() => requestAnimationFrame(resolve)));
+
+    const body = document.body;
+    const card = document.querySelector('.card');
+    return {
+        hasBody: !!body,
+        hasCard: !!card,
+        hasStars: !!document.querySelector('#stars'),
+        hasBg: !!document.querySelector('.bg-container'),
+        bodyHeight: body ? body.scrollHeight : 0,
+        cardVisible: card ? card.offsetWidth > 0 : false,
+        frozenAnimations: animations.length
+    };
+}
+"""
+
+# Aggiunti all'HTML di un fotogramma: dimensione del testo dei fotogrammi ed etichetta "n/totale"
+FRAME_HTML = """
+<style>.message {{ font-size: {size}px !important; }}</style>
+<div class="frame-label" style="position: absolute; top: 130px; right: 140px; z-index: 10;
+    font: 600 30px sans-serif; color: #5ac8fa; letter-spacing: 2px;">{label}</div>
+"""
+
+# Passa al fotogramma successivo nella pagina già caricata: sostituisce testo
+# ed etichetta e attende che il nuovo layout sia stato dipinto. False se il
+# template non ha un elemento .message (la pagina va ricaricata)
+SET_FRAME_JS = """
+async ({text, label}) => {
+    const message = document.querySelector('.message');
+    const tag = document.querySelector('.frame-label');
+    if (!message || !tag) return false;
+    message.textContent = text;
+    tag.textContent = label;
+    await new Promise(resolve => requestAnimationFrame(() => requestAnimationFrame(resolve)));
+    return true;
+}
+"""
+
+def get_last_render_stats() -> Optional[dict]:
+    """
+    Tempi per stadio (html/render/decode/encode in ms), backend, formato e byte
+    scritti dell'ultima card generata dal thread corrente.
+    """
+    return getattr(_render_stats, 'last', None)
 
 class ImageGenerator:
     """Gestisce la creazione di immagini per le storie di Instagram."""
 
     def __init__(self):
-        # --- Configurazione dinamica del percorso di wkhtmltoimage ---
-        if os.name == 'nt': # 'nt' è il nome per Windows
-            # Percorso per l'installazione predefinita su Windows
-            path_wkhtmltoimage = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltoimage.exe'
-            self.config = imgkit.config(wkhtmltoimage=path_wkhtmltoimage)
-        else:
-            # Su Linux (Replit, Render, etc.)
-            # Prova a trovare wkhtmltoimage nel PATH
-            import shutil
-            wkhtmltoimage_path = shutil.which('wkhtmltoimage')
-            if wkhtmltoimage_path:
-                self.config = imgkit.config(wkhtmltoimage=wkhtmltoimage_path)
-                print(f"✓ wkhtmltoimage trovato: {wkhtmltoimage_path}")
-            else:
-                # Se non trovato, prova percorsi comuni
-                common_paths = [
-                    '/usr/bin/wkhtmltoimage',
-                    '/usr/local/bin/wkhtmltoimage',
-                    '/bin/wkhtmltoimage'
-                ]
-                found = False
-                for path in common_paths:
-                    if os.path.exists(path):
-                        self.config = imgkit.config(wkhtmltoimage=path)
-                        print(f"✓ wkhtmltoimage trovato: {path}")
-                        found = True
-                        break
-
-                if not found:
-                    # Configurazione vuota - imgkit userà il PATH
-                    self.config = {}
-                    print("⚠ wkhtmltoimage non trovato nel PATH. Assicurati che sia installato.")
-        # --------------------------------------------------
-
-        # Configura il loader di Jinja2 per trovare i template nella cartella corretta
-        self.template_base_dir = os.path.dirname(settings.image.template_path)
-        self.template_loader = jinja2.FileSystemLoader(searchpath=self.template_base_dir)
-        self.template_env = jinja2.Environment(loader=self.template_loader)
+        # Template precompilati e font inline condivisi da tutte le istanze
+        self.renderer = get_template_renderer()
         self.output_folder = settings.image.output_folder
         self.image_width = settings.image.width
 
-
         # Assicura che la cartella di output esista
         os.makedirs(self.output_folder, exist_ok=True)
 
-        # Verifica se wkhtmltoimage è disponibile
-        import shutil
-        self.wkhtmltoimage_available = bool(shutil.which('wkhtmltoimage'))
+        # Disponibilità e latenza dei backend verificate una volta per processo
+        self.backends = get_backend_registry()
 
-        # Verifica disponibilità Playwright
-        self.playwright_available = PLAYWRIGHT_AVAILABLE
+    @staticmethod
+    def _template_path_for(message_type: str) -> str:
+        """Restituisce il percorso del template da usare per il tipo di messaggio."""
+        if message_type == "info":
+            return os.path.join(TEMPLATES_DIR, INFO_TEMPLATE)
+        return settings.image.template_path
 
     def _render_html(self, message_text: str, message_id: int, message_type: str = "spotted", title: str = None) -> str:
-        """Carica il template HTML e inserisce il messaggio e l'URL del font."""
+        """Renderizza l'HTML della card con il renderer condiviso (template già compilato)."""
+        return self.renderer.render(message_text, message_id, message_type, title)
 
-        # Scegli il template basato sul tipo di messaggio
-        if message_type == "info":
-            template_path = "app/image/templates/card_info.html"
-            print(f"🎨 [DEBUG] Usando template INFO: {template_path}")
-        else:
-            template_path = settings.image.template_path
-            print(f"🎨 [DEBUG] Usando template SPOTTED: {template_path}")
+    def _load_pil_fonts(self) -> dict:
+        """Carica i font della card (Komika Axis, con fallback di sistema)."""
+        font_path = FONT_PATH
+        sizes = {'brand': 95, 'message': 62, 'id': 26, 'footer': 30}  # font-size come card_v5
+
+        if os.path.exists(font_path) and os.path.getsize(font_path) > 1000:
+            try:
+                # Font condivisi dal processo: nessun ricaricamento a ogni card
+                return {name: get_font(font_path, size) for name, size in sizes.items()}
+            except Exception as e:
+                print(f"⚠️ Errore nel caricamento font Komika Axis: {e}")
+
+        try:
+            if os.name == 'nt':
+                try:
+                    brand = get_font("C:/Windows/Fonts/arialbd.ttf", 95)
+                except:
+                    brand = get_font("C:/Windows/Fonts/arial.ttf", 95)
+                regular, bold = "C:/Windows/Fonts/arial.ttf", "C:/Windows/Fonts/arial.ttf"
+            else:
+                brand = get_font("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 95)
+                regular = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+                bold = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
+            return {
+                'brand': brand,
+                'message': get_font(regular, 62),
+                'id': get_font(bold, 26),
+                'footer': get_font(regular, 30),
+            }
+        except:
+            default = ImageFont.load_default()
+            return {name: default for name in sizes}
+
+    @staticmethod
+    def _draw_text_with_shadows(img, xy: tuple, text: str, font, fill, shadows: list):
+        """
+        Disegna testo con text-shadow componendo solo il riquadro del testo,
+        invece di un layer a piena pagina per ogni ombra.
+        """
+        x, y = xy
+        bbox = ImageDraw.Draw(img).textbbox((x, y), text, font=font)
+        margin = max([abs(dx) + abs(dy) for dx, dy, _, _ in shadows] + [0]) + 2
+        left = max(0, bbox[0] - margin)
+        top = max(0, bbox[1] - margin)
+        right = min(img.width, bbox[2] + margin)
+        bottom = min(img.height, bbox[3] + margin)
+        if right <= left or bottom <= top:
+            return
+
+        region = img.crop((left, top, right, bottom)).convert('RGBA')
+        layer = Image.new('RGBA', region.size, (0, 0, 0, 0))
+        layer_draw = ImageDraw.Draw(layer)
+        for dx, dy, color, alpha in shadows:
+            # Ogni ombra è composta separatamente, come i layer CSS sovrapposti
+            layer_draw.text((x + dx - left, y + dy - top), text, fill=color + (alpha,), font=font)
+            region = Image.alpha_composite(region, layer)
+            layer = Image.new('RGBA', region.size, (0, 0, 0, 0))
+            layer_draw = ImageDraw.Draw(layer)
+        ImageDraw.Draw(region).text((x - left, y - top), text, fill=fill, font=font)
+        img.paste(region.convert('RGB'), (left, top))
+
+    def _get_pil_background(self, width: int, height: int):
+        """
+        Restituisce lo sfondo statico della card (cielo, glow, ombra, card, brand e
+        footer), calcolato una sola volta per template e dimensione e tenuto in memoria.
+        """
+        key = (settings.image.template_path, width, height)
+        with _PIL_BACKGROUND_LOCK:
+            background = _PIL_BACKGROUND_CACHE.get(key)
+            if background is None:
+                started = time.perf_counter()
+                background = self._build_pil_background(width, height)
+                _PIL_BACKGROUND_CACHE[key] = background
+                print(f"🖼️ Sfondo PIL precalcolato in {time.perf_counter() - started:.2f}s")
+        return background
+
+    def _build_pil_background(self, width: int, height: int):
+        """Costruisce lo sfondo statico della card replicando lo stile card_v5."""
+        # === SFONDO SPAZIALE come card_v11_celestial ===
+        img = Image.new('RGBA', (width, height), (11, 11, 26, 255))  # #0B0B1A
+        stars_draw = ImageDraw.Draw(img)
+
+        # Stelle casuali come nel template CSS (generatore locale: deterministico e thread-safe)
+        rng = random.Random(42)
+        for i in range(200):
+            x = rng.randint(0, width)
+            y = rng.randint(0, height)
+            brightness = rng.randint(180, 255)
+            size = rng.randint(1, 3)
+            stars_draw.rectangle([x, y, x+size, y+size], fill=(brightness, brightness, brightness, 220))
+
+        # Nebula gradients come nel CSS
+        nebula_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        nebula_draw = ImageDraw.Draw(nebula_layer)
+
+        # Nebula viola centrale (--nebula-purple: #9b59b6)
+        for radius in range(350, 100, -15):
+            alpha = int(120 * (1 - radius/350))
+            nebula_draw.ellipse(
+                [width//2 - radius, height//2 - radius,
+                 width//2 + radius, height//2 + radius],
+                fill=(155, 89, 182, alpha)  # #9b59b6
+            )
 
-        template = self.template_env.get_template(os.path.basename(template_path))
-        
-        # Crea un URL assoluto e corretto per il file del font
-        font_path = os.path.abspath(os.path.join(self.template_base_dir, 'fonts', 'Komika_Axis.ttf'))
-        font_url = Path(font_path).as_uri()
+        # Nebula blu ai lati (--nebula-blue: #3498db)
+        for radius in range(280, 80, -12):
+            alpha = int(100 * (1 - radius/280))
+            nebula_draw.ellipse(
+                [width//4 - radius, height//3 - radius,
+                 width//4 + radius, height//3 + radius],
+                fill=(52, 152, 219, alpha)  # #3498db
+            )
+            nebula_draw.ellipse(
+                [3*width//4 - radius, 2*height//3 - radius,
+                 3*width//4 + radius, 2*height//3 + radius],
+                fill=(52, 152, 219, alpha)
+            )
 
-        return template.render(message=message_text, id=message_id, font_url=font_url, title=title)
+        img = Image.alpha_composite(img, nebula_layer)
+
+        # === CARD V5 - Tema Blu Professionale ===
+        card_x = 90  # padding: 90px come nel template
+        card_y = 90
+        card_w = width - 180
+        card_h = height - 180
+
+        pixels = np.asarray(img.convert('RGB'), dtype=np.float32)
+
+        # Glow multi-layer blu calcolato sulla distanza dal bordo arrotondato della card
+        yy, xx = np.mgrid[0:height, 0:width].astype(np.float32)
+        radius = 45.0
+        qx = np.abs(xx - (card_x + card_w / 2)) - (card_w / 2 - radius)
+        qy = np.abs(yy - (card_y + card_h / 2)) - (card_h / 2 - radius)
+        distance = np.hypot(np.maximum(qx, 0), np.maximum(qy, 0)) + np.minimum(np.maximum(qx, qy), 0) - radius
+        outside = distance >= 0
+
+        glow_colors = [
+            (0, 122, 255, 60),   # Blu principale intenso
+            (52, 152, 219, 35),  # Blu cielo
+            (0, 180, 255, 25),   # Blu chiaro
+        ]
+        for color_r, color_g, color_b, base_alpha in glow_colors:
+            # Equivalente continuo di 30 contorni distanziati 2.5px con alpha decrescente
+            alpha = np.clip(base_alpha - (distance / 2.5) * 2, 0, base_alpha) / 255.0 * 0.4
+            alpha = np.where(outside & (distance <= 75), alpha, 0)[..., None]
+            pixels = pixels * (1 - alpha) + np.array([color_r, color_g, color_b], dtype=np.float32) * alpha
+
+        # Ombra profonda: trasmittanza cumulata di 60 rettangoli neri sfalsati verso il basso
+        transmittance = np.ones((height, width), dtype=np.float32)
+        for i in range(60):
+            alpha = (240 - i * 4) / 255.0
+            x0 = int(card_x + i * 1.2)
+            x1 = int(card_x + card_w - i * 1.2)
+            y0 = int(card_y + 50 + i * 1.8)
+            y1 = min(height, int(card_y + card_h + 50 + i * 1.8))
+            transmittance[y0:y1, x0:x1] *= (1 - alpha)
+        pixels *= transmittance[..., None]
+
+        # Card principale con gradiente verticale da #1a1a2e a #16213e
+        t = np.linspace(0, 1, card_h, endpoint=False, dtype=np.float32)[:, None]
+        gradient = np.concatenate([26 - 10 * t, 26 - 13 * t, 46 - 8 * t], axis=1).astype(np.int32)
+        pixels[card_y:card_y + card_h, card_x:card_x + card_w + 1] = gradient[:, None, :]
+
+        img = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8), 'RGB').convert('RGBA')
+
+        # Bordo blu luminoso professionale
+        border_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        ImageDraw.Draw(border_layer).rounded_rectangle(
+            [card_x, card_y, card_x + card_w, card_y + card_h],
+            radius=45,
+            outline=(0, 180, 255, 220),  # Blu luminoso con alpha
+            width=3
+        )
+        img = Image.alpha_composite(img, border_layer)
+
+        # Effetto shimmer digitale blu
+        shimmer_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+        shimmer_draw = ImageDraw.Draw(shimmer_layer)
+        for i in range(0, card_w + card_h, 50):
+            shimmer_draw.line(
+                [(card_x + i - card_h//2, card_y), (card_x + i - card_h//2 + card_h//6, card_y + card_h)],
+                fill=(100, 200, 255, 40),
+                width=2
+            )
+        for i in range(20):
+            x = card_x + rng.randint(0, card_w)
+            y = card_y + rng.randint(0, card_h)
+            shimmer_draw.ellipse([x-2, y-2, x+2, y+2], fill=(150, 220, 255, 60))
+        img = Image.alpha_composite(img, shimmer_layer).convert('RGB')
+
+        fonts = self._load_pil_fonts()
+        draw = ImageDraw.Draw(img)
+
+        # === BRAND "SPOTTED" con text-shadow esatto come card_v5 ===
+        brand_text = "SPOTTED"
+        brand_bbox = draw.textbbox((0, 0), brand_text, font=fonts['brand'])
+        brand_x = (width - (brand_bbox[2] - brand_bbox[0])) // 2
+        self._draw_text_with_shadows(img, (brand_x, card_y + 50), brand_text, fonts['brand'], '#ffffff', [
+            (0, 0, (0, 122, 255), 128),  # 0 0 10px rgba(0,122,255,0.5) = 128
+            (0, 0, (0, 122, 255), 77),   # 0 0 20px rgba(0,122,255,0.3) = 77
+            (0, 0, (0, 122, 255), 25),   # 0 0 30px rgba(0,122,255,0.1) = 25
+            (0, 2, (0, 0, 0), 204)       # 0 2px 5px rgba(0,0,0,0.8) = 204
+        ])
+
+        # === FOOTER ===
+        footer_text = "@spottedatbz"
+        footer_bbox = draw.textbbox((0, 0), footer_text, font=fonts['footer'])
+        footer_x = (width - (footer_bbox[2] - footer_bbox[0])) // 2
+        footer_y = card_y + card_h - 100  # padding-top: 60px + padding-bottom: 40px
+        draw.text((footer_x, footer_y), footer_text, fill=(140, 140, 140), font=fonts['footer'])  # rgba(255,255,255,0.55)
+
+        return img
 
     def _generate_with_pil(self, message_text: str, output_path: str, message_id: int, message_type: str = "spotted", title: str = None) -> Optional[str]:
-        """Fallback PIL che replica esattamente lo stile card_v5.html con glow 3D."""
+        """Fallback PIL che replica lo stile card_v5.html partendo da uno sfondo precalcolato."""
+        img, stages = self._draw_pil_card(message_text, message_id)
+        # Una sola codifica dell'immagine in memoria
+        return self._encode_card(img, output_path, 'pil', stages, self._encode_profile(message_type, 'pil'))
+
+    def _draw_pil_card(self, message_text: str, message_id: int, frame: tuple = None):
+        """
+        Disegna la card con PIL e restituisce l'immagine in memoria e i tempi per stadio.
+        `frame` = (numero, totale) disegna un fotogramma di un messaggio lungo con la sua etichetta.
+        """
         if not PIL_AVAILABLE:
             raise RuntimeError("PIL non disponibile")
 
         try:
+            started = time.perf_counter()
+
             # Dimensioni per Instagram Stories (1080x1920)
             width = self.image_width
             height = 1920
-
-            # === SFONDO V5 OTTIMIZZATO - Tema Blu Professionale ===
-            img = Image.new('RGB', (width, height), color='#000000')
-            draw = ImageDraw.Draw(img)
-
-            # Sfondo con pattern geometrici blu come card_v5 migliorato
-            bg_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-            bg_draw = ImageDraw.Draw(bg_layer)
-
-            # Pattern di cerchi concentrici blu come sfondo professionale
-            import random
-            random.seed(456)  # Seed diverso per V5
-            for i in range(12):
-                center_x = random.randint(width//6, 5*width//6)
-                center_y = random.randint(height//6, 5*height//6)
-                base_radius = random.randint(150, 300)
-
-                for r in range(base_radius, 30, -25):
-                    alpha = int(50 * (1 - r/base_radius))
-                    bg_draw.ellipse(
-                        [center_x - r, center_y - r, center_x + r, center_y + r],
-                        outline=(0, 122, 255, alpha),
-                        width=2
-                    )
-
-            # Aggiungi punti luce blu sparsi come stelle digitali
-            for i in range(80):
-                x = random.randint(0, width)
-                y = random.randint(0, height)
-                size = random.randint(2, 6)
-                alpha = random.randint(120, 220)
-                bg_draw.ellipse([x-size, y-size, x+size, y+size], fill=(0, 122, 255, alpha))
-
-            # Linee geometriche sottili per effetto tech
-            for i in range(5):
-                start_x = random.randint(0, width//3)
-                end_x = random.randint(2*width//3, width)
-                y = random.randint(0, height)
-                alpha = random.randint(20, 40)
-                bg_draw.line([start_x, y, end_x, y], fill=(0, 122, 255, alpha), width=1)
-
-            img = Image.alpha_composite(img.convert('RGBA'), bg_layer).convert('RGB')
-            draw = ImageDraw.Draw(img)
-
-            # === TEMPLATE CELESTIAL - Rendering OTTIMIZZATO ===
-            # Sfondo spaziale con stelle simulate come nel CSS
-            stars_layer = Image.new('RGBA', (width, height), (11, 11, 26, 255))  # #0B0B1A
-            stars_draw = ImageDraw.Draw(stars_layer)
-
-            # Stelle casuali come nel template CSS
-            import random
-            random.seed(42)  # Per consistenza
-            for i in range(200):  # Molte stelle per effetto spaziale
-                x = random.randint(0, width)
-                y = random.randint(0, height)
-                brightness = random.randint(180, 255)
-                size = random.randint(1, 3)
-                stars_draw.rectangle([x, y, x+size, y+size], fill=(brightness, brightness, brightness, 220))
-
-            # Nebula gradients come nel CSS
-            nebula_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-            nebula_draw = ImageDraw.Draw(nebula_layer)
-
-            # Nebula viola centrale (--nebula-purple: #9b59b6)
-            for radius in range(350, 100, -15):
-                alpha = int(120 * (1 - radius/350))
-                nebula_draw.ellipse(
-                    [width//2 - radius, height//2 - radius,
-                     width//2 + radius, height//2 + radius],
-                    fill=(155, 89, 182, alpha)  # #9b59b6
-                )
-
-            # Nebula blu ai lati (--nebula-blue: #3498db)
-            for radius in range(280, 80, -12):
-                alpha = int(100 * (1 - radius/280))
-                nebula_draw.ellipse(
-                    [width//4 - radius, height//3 - radius,
-                     width//4 + radius, height//3 + radius],
-                    fill=(52, 152, 219, alpha)  # #3498db
-                )
-
-                nebula_draw.ellipse(
-                    [3*width//4 - radius, 2*height//3 - radius,
-                     3*width//4 + radius, 2*height//3 + radius],
-                    fill=(52, 152, 219, alpha)
-                )
-
-            # Combina sfondi spaziali
-            celestial_bg = Image.alpha_composite(stars_layer, nebula_layer)
-            img = Image.alpha_composite(img.convert('RGBA'), celestial_bg).convert('RGB')
-            draw = ImageDraw.Draw(img)
-
-            # === CARD V5 OTTIMIZZATA - Tema Blu Professionale ===
-            card_x = 90  # padding: 90px come nel template
             card_y = 90
-            card_w = width - 180
             card_h = height - 180
 
-            # Glow complesso blu professionale
-            card_glow = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-            glow_draw = ImageDraw.Draw(card_glow)
-
-            # Glow multi-layer blu ispirato a design moderno
-            glow_colors = [
-                (0, 122, 255, 60),   # Blu principale intenso
-                (52, 152, 219, 35),  # Blu cielo
-                (0, 180, 255, 25),   # Blu chiaro
-            ]
-
-            for color_r, color_g, color_b, base_alpha in glow_colors:
-                for i in range(30):
-                    alpha = max(0, base_alpha - i * 2)
-                    offset = i * 2.5
-                    glow_draw.rounded_rectangle(
-                        [card_x - offset, card_y - offset,
-                         card_x + card_w + offset, card_y + card_h + offset],
-                        radius=45 + offset//3,
-                        outline=(color_r, color_g, color_b, alpha)
-                    )
-
-            img = Image.alpha_composite(img.convert('RGBA'), card_glow).convert('RGB')
-            draw = ImageDraw.Draw(img)
-
-            # Ombra profonda professionale
-            shadow_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-            shadow_draw = ImageDraw.Draw(shadow_layer)
-
-            for i in range(60):
-                alpha = int(240 - i * 4)  # Simula box-shadow professionale
-                offset_x = i * 1.2
-                offset_y = 50 + i * 1.8
-                shadow_draw.rounded_rectangle(
-                    [card_x + offset_x, card_y + offset_y,
-                     card_x + card_w - offset_x, card_y + card_h + offset_y],
-                    radius=45,
-                    fill=(0, 0, 0, alpha)
-                )
-
-            img = Image.alpha_composite(img.convert('RGBA'), shadow_layer).convert('RGB')
-            draw = ImageDraw.Draw(img)
-
-            # Card principale con gradiente blu professionale
-            card_main = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-            card_draw = ImageDraw.Draw(card_main)
-
-            # Gradiente blu professionale da scuro a chiaro
-            for y in range(card_h):
-                t = y / card_h
-                # Gradiente da blu scuro (#1a1a2e) a blu medio (#16213e)
-                r = int(26 - 10 * t)  # 1a=26, 16=22
-                g = int(26 - 13 * t)  # 1a=26, 21=33 (inverted)
-                b = int(46 - 8 * t)   # 2e=46, 3e=62
-                card_draw.line(
-                    [(card_x, card_y + y), (card_x + card_w, card_y + y)],
-                    fill=(r, g, b, 255)
-                )
-
-            # Bordo blu luminoso professionale
-            card_draw.rounded_rectangle(
-                [card_x, card_y, card_x + card_w, card_y + card_h],
-                radius=45,
-                outline=(0, 180, 255, 220),  # Blu luminoso con alpha
-                width=3
-            )
-
-            # Effetto shimmer digitale blu
-            shimmer_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-            shimmer_draw = ImageDraw.Draw(shimmer_layer)
-
-            # Linee diagonali shimmer blu
-            for i in range(0, card_w + card_h, 50):
-                shimmer_draw.line(
-                    [(card_x + i - card_h//2, card_y), (card_x + i - card_h//2 + card_h//6, card_y + card_h)],
-                    fill=(100, 200, 255, 40),
-                    width=2
-                )
-
-            # Punti luce digitali
-            for i in range(20):
-                x = card_x + random.randint(0, card_w)
-                y = card_y + random.randint(0, card_h)
-                shimmer_draw.ellipse([x-2, y-2, x+2, y+2], fill=(150, 220, 255, 60))
-
-            img = Image.alpha_composite(img.convert('RGBA'), card_main).convert('RGB')
-            img = Image.alpha_composite(img.convert('RGBA'), shimmer_layer).convert('RGB')
+            # Sfondo e cornice statici: copia della versione in memoria
+            img = self._get_pil_background(width, height).copy()
             draw = ImageDraw.Draw(img)
+            fonts = self._load_pil_fonts()
+            message_font = fonts['message']
+            id_font = fonts['id']
 
-            # === CARICA FONT KOMIKA AXIS ===
-            font_path = os.path.abspath(os.path.join(self.template_base_dir, 'fonts', 'Komika_Axis.ttf'))
-
-            brand_font = None
-            message_font = None
-            id_font = None
-            footer_font = None
-
-            if os.path.exists(font_path) and os.path.getsize(font_path) > 1000:
-                try:
-                    brand_font = ImageFont.truetype(font_path, 95)  # font-size: 95px come card_v5
-                    message_font = ImageFont.truetype(font_path, 62)  # font-size: 62px come card_v5
-                    id_font = ImageFont.truetype(font_path, 26)  # font-size: 26px come card_v5
-                    footer_font = ImageFont.truetype(font_path, 30)  # font-size: 30px come card_v5
-                except Exception as e:
-                    print(f"⚠️ Errore nel caricamento font Komika Axis: {e}")
-
-            if not brand_font:
-                try:
-                    if os.name == 'nt':
-                        try:
-                            brand_font = ImageFont.truetype("C:/Windows/Fonts/arialbd.ttf", 95)
-                        except:
-                            brand_font = ImageFont.truetype("C:/Windows/Fonts/arial.ttf", 95)
-                        message_font = ImageFont.truetype("C:/Windows/Fonts/arial.ttf", 62)
-                        id_font = ImageFont.truetype("C:/Windows/Fonts/arial.ttf", 26)
-                        footer_font = ImageFont.truetype("C:/Windows/Fonts/arial.ttf", 30)
-                    else:
-                        brand_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 95)
-                        message_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 62)
-                        id_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", 26)
-                        footer_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 30)
-                except:
-                    brand_font = ImageFont.load_default()
-                    message_font = ImageFont.load_default()
-                    id_font = ImageFont.load_default()
-                    footer_font = ImageFont.load_default()
-
-            # === HEADER CON BRAND E BADGE (esatto come card_v5.html) ===
-            header_y = card_y + 50  # padding-top: 50px
-
-            # BRAND "SPOTTED" con text-shadow esatto come card_v5
-            brand_text = "SPOTTED"
-            brand_bbox = draw.textbbox((0, 0), brand_text, font=brand_font)
-            brand_width = brand_bbox[2] - brand_bbox[0]
-            brand_x = (width - brand_width) // 2
-            brand_y = header_y
-
-            # Text shadows esatti come card_v5.html (4 livelli)
-            for dx, dy, color, alpha in [
-                (0, 0, (0, 122, 255), 128),  # 0 0 10px rgba(0,122,255,0.5) = 128
-                (0, 0, (0, 122, 255), 77),   # 0 0 20px rgba(0,122,255,0.3) = 77
-                (0, 0, (0, 122, 255), 25),   # 0 0 30px rgba(0,122,255,0.1) = 25
-                (0, 2, (0, 0, 0), 204)       # 0 2px 5px rgba(0,0,0,0.8) = 204
-            ]:
-                shadow_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-                shadow_draw = ImageDraw.Draw(shadow_layer)
-                shadow_draw.text((brand_x + dx, brand_y + dy), brand_text, fill=color + (alpha,), font=brand_font)
-                img = Image.alpha_composite(img.convert('RGBA'), shadow_layer).convert('RGB')
-                draw = ImageDraw.Draw(img)
-
-            draw.text((brand_x, brand_y), brand_text, fill='#ffffff', font=brand_font)
-
-            # BADGE ID esatto come card_v5.html
+            # === BADGE ID esatto come card_v5.html ===
+            brand_y = card_y + 50  # padding-top: 50px
             id_text = f"sp#{message_id}"
             id_bbox = draw.textbbox((0, 0), id_text, font=id_font)
             id_width = id_bbox[2] - id_bbox[0]
             id_x = (width - id_width) // 2
             id_y = brand_y + int(95 * 1.1) + 35  # font-size 95px con line-height 1.1 + margin 35px
 
-            badge = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-            bdraw = ImageDraw.Draw(badge)
-
-            # Padding esatto: 12px 30px
+            # Padding esatto: 12px 30px; badge e ombra composti solo nel loro riquadro
             pad_x, pad_y = 30, 12
-            badge_width = id_width + (pad_x * 2)
-            badge_height = 32 + (pad_y * 2)  # Altezza base 32px come nel template
-
-            # Box-shadow per il badge
-            for shadow_dx, shadow_dy, shadow_color, shadow_alpha in [
-                (0, 4, (0, 122, 255), 38)  # 0 4px 20px rgba(0,122,255,0.15) ≈ 38
-            ]:
-                shadow_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-                shadow_draw = ImageDraw.Draw(shadow_layer)
-                shadow_draw.rounded_rectangle(
-                    [id_x - pad_x + shadow_dx, id_y - pad_y + shadow_dy,
-                     id_x + id_width + pad_x + shadow_dx, id_y + 32 + pad_y + shadow_dy],
-                    radius=25,
-                    fill=shadow_color + (shadow_alpha,)
-                )
-                img = Image.alpha_composite(img.convert('RGBA'), shadow_layer).convert('RGB')
-                draw = ImageDraw.Draw(img)
-
-            # Badge principale
-            bdraw.rounded_rectangle(
-                [id_x - pad_x, id_y - pad_y, id_x + id_width + pad_x, id_y + 32 + pad_y],
+            box = (id_x - pad_x, id_y - pad_y, id_x + id_width + pad_x + 1, id_y + 32 + pad_y + 5)
+            region = img.crop(box).convert('RGBA')
+            badge = Image.new('RGBA', region.size, (0, 0, 0, 0))
+            badge_draw = ImageDraw.Draw(badge)
+            inner = [0, 0, id_width + 2 * pad_x, 32 + 2 * pad_y]
+            # Box-shadow 0 4px 20px rgba(0,122,255,0.15) ≈ 38
+            badge_draw.rounded_rectangle([inner[0], inner[1] + 4, inner[2], inner[3] + 4], radius=25, fill=(0, 122, 255, 38))
+            region = Image.alpha_composite(region, badge)
+            badge = Image.new('RGBA', region.size, (0, 0, 0, 0))
+            ImageDraw.Draw(badge).rounded_rectangle(
+                inner,
                 radius=25,  # border-radius: 25px
                 fill=(0, 122, 255, 30),  # background: rgba(0,122,255,0.12)
                 outline=(0, 122, 255, 64)  # border: 1px solid rgba(0,122,255,0.25)
             )
-            img = Image.alpha_composite(img.convert('RGBA'), badge).convert('RGB')
+            region = Image.alpha_composite(region, badge)
+            img.paste(region.convert('RGB'), box[:2])
             draw = ImageDraw.Draw(img)
             draw.text((id_x, id_y), id_text, fill='#5ac8fa', font=id_font)  # color: #5ac8fa
 
             # === BODY CON MESSAGGIO ===
             body_top = id_y + 80  # margin-bottom: 80px dell'header
             body_bottom = card_y + card_h - 100  # Prima del footer
+            card_w = width - 180
 
-            # Word wrap per max-width: 80% come card_v5
-            words = message_text.split()
-            lines = []
-            current_line = []
-            current_width = 0
-            max_width = int(card_w * 0.8)  # max-width: 80%
-            line_height = int(62 * 1.5)  # line-height: 1.5
-
-            for word in words:
-                word_bbox = draw.textbbox((0, 0), word + " ", font=message_font)
-                word_width = word_bbox[2] - word_bbox[0]
-
-                if current_width + word_width > max_width and current_line:
-                    lines.append(" ".join(current_line))
-                    current_line = [word]
-                    current_width = word_width
-                else:
-                    current_line.append(word)
-                    current_width += word_width
-
-            if current_line:
-                lines.append(" ".join(current_line))
+            # Layout: la dimensione più grande (fino a 62px come card_v5) con cui
+            # l'intero messaggio sta nel body, con max-width: 80% e line-height: 1.5
+            layout = fit_text(
+                message_text,
+                max_width=int(card_w * 0.8),
+                max_height=body_bottom - body_top,
+                max_size=settings.image.frame_font_size if frame else 62,
+                font=message_font
+            )
+            if layout.truncated:
+                print(f"⚠️ Messaggio troppo lungo anche a {layout.size}px: testo troncato")
 
             # Centro verticale nel body (flexbox center)
-            total_message_height = len(lines) * line_height
+            total_message_height = len(layout.lines) * layout.line_height
             message_start_y = body_top + (body_bottom - body_top - total_message_height) // 2
 
-            for i, line in enumerate(lines[:5]):  # Limite ragionevole
+            for i, line in enumerate(layout.lines):
                 if not line.strip():
                     continue
 
-                line_bbox = draw.textbbox((0, 0), line, font=message_font)
-                line_width = line_bbox[2] - line_bbox[0]
-                line_x = (width - line_width) // 2
-                y_pos = message_start_y + i * line_height
-
-                if y_pos > body_bottom - line_height:
-                    break
+                line_x = int((width - word_width(layout.font, line)) // 2)
+                y_pos = message_start_y + i * layout.line_height
 
                 # Text shadows esatti come card_v5 (3 livelli)
-                for dx, dy, color, alpha in [
+                self._draw_text_with_shadows(img, (line_x, y_pos), line, layout.font, '#ffffff', [
                     (0, 0, (255, 255, 255), 77),  # 0 0 8px rgba(255,255,255,0.3) ≈ 77/255
                     (0, 0, (0, 0, 0), 153),       # 0 0 15px rgba(0,0,0,0.6) ≈ 153/255
                     (0, 5, (0, 0, 0), 204)        # 0 5px 10px rgba(0,0,0,0.8) ≈ 204/255
-                ]:
-                    shadow_layer = Image.new('RGBA', (width, height), (0, 0, 0, 0))
-                    shadow_draw = ImageDraw.Draw(shadow_layer)
-                    shadow_draw.text((line_x + dx, y_pos + dy), line, fill=color + (alpha,), font=message_font)
-                    img = Image.alpha_composite(img.convert('RGBA'), shadow_layer).convert('RGB')
-                    draw = ImageDraw.Draw(img)
-
-                draw.text((line_x, y_pos), line, fill='#ffffff', font=message_font)
-
-            # === FOOTER ===
-            footer_text = "@spottedatbz"
-            footer_bbox = draw.textbbox((0, 0), footer_text, font=footer_font)
-            footer_width = footer_bbox[2] - footer_bbox[0]
-            footer_x = (width - footer_width) // 2
-            footer_y = card_y + card_h - 100  # padding-top: 60px + padding-bottom: 40px
+                ])
 
-            draw.text((footer_x, footer_y), footer_text, fill=(140, 140, 140), font=footer_font)  # rgba(255,255,255,0.55) ≈ 140/255
+            if frame:
+                # Etichetta "n/totale" in alto a destra, sulla riga del badge
+                label = f"{frame[0]}/{frame[1]}"
+                label_x = int(width - 90 - 50 - word_width(id_font, label))
+                draw.text((label_x, id_y), label, fill='#5ac8fa', font=id_font)
 
-            # Salva e ottimizza per Instagram
-            img.save(output_path, 'PNG', quality=100, optimize=False)
-            print(f"✅ Immagine generata con successo (PIL fallback): {output_path}")
-
-            # Ottimizza per Instagram
-            optimized_path = self._optimize_for_instagram(output_path)
-            return optimized_path
+            return img, {'render_ms': (time.perf_counter() - started) * 1000}
 
         except Exception as e:
             print(f"❌ Errore PIL fallback: {e}")
@@ -474,152 +506,204 @@ class ImageGenerator:
 
     def _generate_with_playwright(self, message_text: str, output_path: str, message_id: int, message_type: str = "spotted", title: str = None) -> Optional[str]:
         """Screenshot diretto dell'HTML renderizzato in browser reale."""
-        if not self.playwright_available:
-            raise RuntimeError("Playwright non disponibile")
+        screenshot, stages = self._playwright_screenshot(message_text, message_id, message_type, title)
+        return self._decode_and_encode(screenshot, output_path, 'playwright', stages, self._encode_profile(message_type, 'playwright'))
 
-        import tempfile
-        temp_html_path = None
+    def _playwright_screenshot(self, message_text: str, message_id: int, message_type: str = "spotted", title: str = None,
+                               image_type: str = 'png', ready_timeout_ms: int = None, strict_ready: bool = True):
+        """
+        Screenshot in memoria della card renderizzata da Chromium.
+        Con strict_ready=False (anteprime) un segnale di readiness mancante non è un errore.
+        """
+        if not PLAYWRIGHT_AVAILABLE:
+            raise RuntimeError("Playwright non disponibile")
 
         try:
-            # Renderizza l'HTML
+            stages = {}
+            started = time.perf_counter()
             html_content = self._render_html(message_text, message_id, message_type, title)
+            stages['html_ms'] = (time.perf_counter() - started) * 1000
 
-            # Crea file HTML temporaneo
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False, encoding='utf-8') as f:
-                f.write(html_content)
-                temp_html_path = f.name
-
-            print(f"📄 File HTML temporaneo creato: {temp_html_path}")
-
-            with sync_playwright() as p:
-                # Lancia browser con configurazione ottimale per screenshot
-                browser = p.chromium.launch(
-                    headless=True,
-                    args=[
-                        '--no-sandbox',
-                        '--disable-setuid-sandbox',
-                        '--disable-dev-shm-usage',
-                        '--disable-web-security',  # Permetti file locali
-                        '--allow-file-access-from-files',
-                        '--disable-features=VizDisplayCompositor'
-                    ]
-                )
+            def render_on_page(page):
+                # La pagina arriva già pronta dal pool: l'HTML viene caricato
+                # direttamente, senza passare da un file temporaneo
+                page.set_content(html_content, wait_until='load', timeout=10000)
 
+                # Readiness guidata da eventi: font caricati, flag __cardReady del
+                # template e animazioni CSS congelate su un fotogramma deterministico
                 try:
-                    # Crea pagina con viewport fisso
-                    page = browser.new_page(
-                        viewport={'width': self.image_width, 'height': 1920},
-                        device_scale_factor=1
-                    )
-
-                    # Naviga direttamente al file HTML
-                    file_url = f'file://{temp_html_path}'
-                    page.goto(file_url, wait_until='networkidle', timeout=10000)
-
-                    # Aspetta caricamento completo (font, CSS, animazioni, etc.)
-                    page.wait_for_timeout(4000)  # 4 secondi per animazioni e stelle
-
-                    # Verifica rendering completo
-                    render_status = page.evaluate('''
-                        () => {
-                            const body = document.body;
-                            const card = document.querySelector('.card');
-                            const stars = document.querySelector('#stars');
-                            const bg = document.querySelector('.bg-container');
-
-                            return {
-                                hasBody: !!body,
-                                hasCard: !!card,
-                                hasStars: !!stars,
-                                hasBg: !!bg,
-                                bodyHeight: body ? body.scrollHeight : 0,
-                                cardVisible: card ? card.offsetWidth > 0 : false
-                            };
-                        }
-                    ''')
-
-                    print(f"🔍 Render status: {render_status}")
-
-                    if not (render_status.get('hasBody') and render_status.get('hasCard') and render_status.get('bodyHeight', 0) > 500):
-                        raise RuntimeError(f"HTML non renderizzato correttamente: {render_status}")
-
-                    # Aspetta ancora un po' per animazioni CSS (stelle, gradienti)
-                    page.wait_for_timeout(1000)
-
-                    print("🎨 HTML renderizzato correttamente, catturo screenshot...")
-
-                    # Screenshot della viewport completa
-                    page.screenshot(
-                        path=output_path,
-                        full_page=True,
-                        type='png',
-                        omit_background=False
-                    )
-
-                    print(f"✅ Screenshot HTML diretto completato: {output_path}")
-
-                    # Ottimizza per Instagram dopo la generazione
-                    optimized_path = self._optimize_for_instagram(output_path)
-                    if optimized_path != output_path:
-                        print(f"📱 Ottimizzato per Instagram: {optimized_path}")
-
-                    return optimized_path
-
-                finally:
-                    browser.close()
+                    page.wait_for_function(CARD_READY_JS, timeout=ready_timeout_ms or settings.image.render_ready_timeout_ms)
+                except Exception:
+                    if strict_ready:
+                        raise
+                render_status = page.evaluate(FREEZE_AND_CHECK_JS)
+
+                if not (render_status.get('hasBody') and render_status.get('hasCard') and render_status.get('bodyHeight', 0) > 500):
+                    raise RuntimeError(f"HTML non renderizzato correttamente: {render_status}")
+
+                # Screenshot in memoria: nessuna scrittura intermedia su disco
+                if image_type == 'jpeg':
+                    return page.screenshot(full_page=True, type='jpeg', quality=settings.image.preview_jpeg_quality)
+                return page.screenshot(full_page=True, type='png', omit_background=False)
+
+            # Il render gira su un browser già avviato del pool condiviso
+            started = time.perf_counter()
+            screenshot = get_browser_pool().run(render_on_page)
+            stages['render_ms'] = (time.perf_counter() - started) * 1000
+            return screenshot, stages
 
         except Exception as e:
             print(f"❌ Errore screenshot HTML diretto: {e}")
             raise
-        finally:
-            # Pulisci file temporaneo
-            if temp_html_path and os.path.exists(temp_html_path):
-                try:
-                    os.unlink(temp_html_path)
-                    print("🧹 File HTML temporaneo pulito")
-                except:
-                    pass
-
-    def _optimize_for_instagram(self, image_path: str) -> str:
-        """Ottimizza l'immagine per Instagram Stories"""
-        try:
-            from PIL import Image
-            import os
-
-            with Image.open(image_path) as img:
-                original_size = os.path.getsize(image_path)
-
-                # Converti a RGB se necessario
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                    print("🔄 Converted to RGB for Instagram")
 
-                # Ridimensiona se troppo grande (Instagram Stories: max 1080x1920)
-                max_width, max_height = 1080, 1920
-                if img.size[0] > max_width or img.size[1] > max_height:
-                    img.thumbnail((max_width, max_height), Image.Resampling.LANCZOS)
-                    print(f"📐 Resized to Instagram specs: {img.size}")
+    def _encode_profile(self, message_type: str, backend: str) -> str:
+        """Profilo di codifica: le card dello stesso template e backend si comprimono in modo simile."""
+        return f"{os.path.basename(self._template_path_for(message_type))}:{backend}"
+
+    def _decode_and_encode(self, data: bytes, output_path: str, backend: str, stages: dict, profile: str = "default") -> str:
+        """Decodifica il PNG prodotto dal renderer e lo codifica una sola volta su disco."""
+        started = time.perf_counter()
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        stages['decode_ms'] = (time.perf_counter() - started) * 1000
+        return self._encode_card(img, output_path, backend, stages, profile)
+
+    def _encode_card(self, img, output_path: str, backend: str, stages: dict, profile: str = "default") -> str:
+        """Scrive la card con l'encoder configurato e registra i tempi per stadio."""
+        result = encode_image(img, output_path, profile=profile)
+        stages['encode_ms'] = result.seconds * 1000
+        stats = {
+            'backend': backend,
+            'format': result.format,
+            'bytes': result.bytes_written,
+            'encode_params': result.params,
+            'encode_attempts': result.attempts,
+            **{name: round(value, 1) for name, value in stages.items()},
+        }
+        _render_stats.last = stats
+        timings = ", ".join(f"{name[:-3]} {value:.0f}ms" for name, value in stages.items())
+        print(f"✅ Card generata ({backend}): {result.path} — {timings}, {result.bytes_written} byte")
+        return result.path
 
-                # Salva con ottimizzazione
-                img.save(image_path, 'PNG', optimize=True, quality=95)
-
-                final_size = os.path.getsize(image_path)
-                compression_ratio = (original_size - final_size) / original_size * 100
-                print(f"📱 Instagram optimization: {original_size} → {final_size} bytes ({compression_ratio:.1f}% reduction)")
-
-                return image_path
+    def from_text(self, message_text: str, output_filename: str, message_id: int, message_type: str = "spotted", title: str = None) -> Optional[str]:
+        """
+        Genera l'immagine di una card da un testo, passando prima dalla cache dei render.
 
-        except Exception as e:
-            print(f"⚠️ Instagram optimization failed: {e}")
-            return image_path
+        Se la stessa combinazione (template, tipo, testo, id, titolo) è già stata
+        renderizzata restituisce subito il file in cache; altrimenti genera la card
+        e la sposta in cache. Il percorso restituito può quindi differire da
+        `output_filename`.
+        """
+        if not settings.image.render_cache_enabled:
+            return self._render_uncached(message_text, output_filename, message_id, message_type, title)
+
+        cache = get_render_cache()
+        cache_key = self._cache_key(message_text, message_id, message_type, title)
+        cached_path = cache.get(cache_key)
+        if cached_path:
+            print(f"⚡ Card servita dalla cache: {cached_path}")
+            return cached_path
+
+        rendered_path = self._render_uncached(message_text, output_filename, message_id, message_type, title)
+        if not rendered_path:
+            return rendered_path
+        return cache.put(cache_key, rendered_path)
+
+    def _cache_key(self, message_text: str, message_id: int, message_type: str, title: Optional[str], **extra) -> str:
+        template_path = self._template_path_for(message_type)
+        # La versione del template include font e template inclusi: un loro
+        # cambiamento invalida le card in cache anche se il file principale è uguale
+        return get_render_cache().make_key(template_path, message_type, message_text, message_id, title,
+                                           output_format=settings.image.output_format,
+                                           encode_target_kb=settings.image.encode_target_kb,
+                                           template_version=self.renderer.template_version(os.path.basename(template_path)),
+                                           **extra)
+
+    def _generate_with_wkhtmltoimage(self, message_text: str, output_path: str, message_id: int, message_type: str = "spotted", title: str = None) -> Optional[str]:
+        """Render nativo con wkhtmltoimage tramite il demone di rendering."""
+        data, stages = self._wkhtml_render(message_text, message_id, message_type, title)
+        return self._decode_and_encode(data, output_path, 'wkhtmltoimage', stages, self._encode_profile(message_type, 'wkhtmltoimage'))
+
+    def _wkhtml_render(self, message_text: str, message_id: int, message_type: str = "spotted", title: str = None, zoom: float = 1.0,
+                       html_content: str = None):
+        """PNG in memoria prodotto dal demone wkhtmltoimage; zoom < 1 renderizza già a scala ridotta."""
+        stages = {}
+        started = time.perf_counter()
+        html_content = html_content or self._render_html(message_text, message_id, message_type, title)
+        stages['html_ms'] = (time.perf_counter() - started) * 1000
+
+        # Opzioni per wkhtmltoimage: larghezza, encoding e accesso ai file locali
+        options = {
+            'width': round(self.image_width * zoom),
+            'encoding': "UTF-8",
+            'enable-local-file-access': None, # Necessario per eventuali risorse locali
+            'quiet': '' # Sopprime l'output di wkhtmltoimage
+        }
+        if zoom != 1.0:
+            options['zoom'] = zoom
+
+        # Il render passa dal demone wkhtmltoimage: worker persistenti,
+        # timeout per job e nessun blocco del chiamante su un renderer appeso
+        started = time.perf_counter()
+        data = get_wkhtml_daemon().render(html_content, options)
+        stages['render_ms'] = (time.perf_counter() - started) * 1000
+        return data, stages
+
+    def render_with_backend(self, backend: str, message_text: str, output_path: str, message_id: int, message_type: str = "spotted", title: str = None) -> str:
+        """Renderizza con un backend specifico ("wkhtmltoimage", "playwright" o "pil")."""
+        return getattr(self, BACKEND_METHODS[backend])(message_text, output_path, message_id, message_type, title)
+
+    def render_preview(self, message_text: str, message_id: int = 0, message_type: str = "info", title: str = None, scale: float = None) -> PreviewImage:
+        """
+        Anteprima a scala ridotta per il pannello admin: JPEG in memoria, nessun
+        file su disco. Segue lo stesso routing dei render definitivi, ma con
+        attese di readiness brevi; la card a piena risoluzione si genera solo
+        alla pubblicazione.
+        """
+        scale = scale or settings.image.preview_scale
+        template_name = os.path.basename(self._template_path_for(message_type))
+        started = time.perf_counter()
+        errors = []
+        for backend in self.backends.route(template_name):
+            if not self.backends.allow(backend):
+                continue
+            try:
+                img = self._preview_image(backend, message_text, message_id, message_type, title, scale)
+                break
+            except Exception as e:
+                self.backends.record_failure(backend, e)
+                errors.append(f"{backend}: {e}")
+        else:
+            raise RuntimeError(f"Anteprima non generata: {'; '.join(errors) or 'nessun backend disponibile'}")
+
+        target_width = round(self.image_width * scale)
+        img = img.convert('RGB')
+        if img.width > target_width:
+            img = img.resize((target_width, round(img.height * target_width / img.width)), Image.BILINEAR, reducing_gap=2.0)
+        data = encode_to_bytes(img, "jpeg", quality=settings.image.preview_jpeg_quality)
+        return PreviewImage(data, backend, img.width, img.height, (time.perf_counter() - started) * 1000)
+
+    def _preview_image(self, backend: str, message_text: str, message_id: int, message_type: str, title: Optional[str], scale: float):
+        """Immagine dell'anteprima dal backend scelto (a scala ridotta se il backend lo supporta)."""
+        if backend == "pil":
+            return self._draw_pil_card(message_text, message_id)[0]
+        if backend == "wkhtmltoimage":
+            data, _ = self._wkhtml_render(message_text, message_id, message_type, title, zoom=scale)
+        else:
+            data, _ = self._playwright_screenshot(message_text, message_id, message_type, title, image_type='jpeg',
+                                                  ready_timeout_ms=settings.image.preview_ready_timeout_ms, strict_ready=False)
+        img = Image.open(io.BytesIO(data))
+        img.load()
+        return img
 
-    def from_text(self, message_text: str, output_filename: str, message_id: int, message_type: str = "spotted", title: str = None) -> Optional[str]:
+    def _render_uncached(self, message_text: str, output_filename: str, message_id: int, message_type: str = "spotted", title: str = None) -> Optional[str]:
         """
-        Genera un'immagine PNG da un testo con gerarchia di metodi:
+        Genera l'immagine (PNG o JPEG, vedi settings.image.output_format) da un testo.
 
-        1. wkhtmltoimage (principale - rendering nativo)
-        2. Playwright (alternativa headless - rendering perfetto CSS)
-        3. PIL (fallback finale - simulazione PIL)
+        Il registro dei backend decide l'ordine: prima i renderer HTML che
+        supportano il template, dal più veloce secondo le latenze misurate, poi
+        PIL come fallback finale. I backend con circuit breaker aperto vengono
+        saltati senza attendere il loro timeout.
 
         Args:
             message_text: Il testo da inserire nell'immagine.
@@ -627,113 +711,259 @@ class ImageGenerator:
             message_id: L'ID del messaggio, da passare al template.
 
         Returns:
-            Il percorso del file generato, o None se si verifica un errore.
+            Il percorso del file generato.
         """
         # Definisce il percorso completo per il file di output
         output_path = os.path.join(self.output_folder, output_filename)
+        template_name = os.path.basename(self._template_path_for(message_type))
+
+        started = time.perf_counter()
+        tried, errors = [], []
+        for backend in self.backends.route(template_name):
+            if not self.backends.allow(backend):
+                continue
+            tried.append(backend)
+            backend_started = time.perf_counter()
+            try:
+                path = self.render_with_backend(backend, message_text, output_path, message_id, message_type, title)
+            except Exception as e:
+                print(f"❌ Backend {backend} fallito: {e}")
+                self.backends.record_failure(backend, e)
+                errors.append(f"{backend}: {e}")
+                continue
+            self.backends.record_success(backend, time.perf_counter() - backend_started)
+            self.backends.record_decision(template_name, backend, tried, time.perf_counter() - started)
+            return path
+
+        self.backends.record_decision(template_name, None, tried, time.perf_counter() - started)
+        if not tried:
+            raise RuntimeError("ERRORE CRITICO: nessun backend di rendering disponibile (wkhtmltoimage, Playwright, PIL).")
+        raise RuntimeError(f"Tutti i backend hanno fallito. {'; '.join(errors)}")
+
+    # --- Messaggi lunghi: sequenze di fotogrammi ---
+
+    def _message_box(self) -> tuple:
+        """Riquadro del testo (larghezza, altezza) nella card 1080x1920, con le misure di _draw_pil_card."""
+        card_y, card_h = 90, 1920 - 180
+        id_y = card_y + 50 + int(95 * 1.1) + 35
+        return int((self.image_width - 180) * 0.8), (card_y + card_h - 100) - (id_y + 80)
+
+    def paginate(self, message_text: str) -> List[str]:
+        """
+        Testo di ciascun fotogramma del messaggio: [message_text] se il messaggio
+        sta in una card. Il layout viene calcolato una volta, con le metriche del
+        font della card, e vale per tutti i backend.
+        """
+        if not PIL_AVAILABLE:
+            return [message_text]
+        font_path = getattr(self._load_pil_fonts()['message'], 'path', None) or FONT_PATH
+        max_width, max_height = self._message_box()
+        try:
+            if not needs_pagination(message_text, max_width, max_height, settings.image.frame_min_font_size, font_path=font_path):
+                return [message_text]
+            return paginate_text(message_text, max_width, max_height, settings.image.frame_font_size,
+                                 font_path=font_path, max_pages=settings.image.max_frames)
+        except OSError as e:
+            print(f"⚠️ Paginazione non disponibile ({e}): messaggio in una sola card")
+            return [message_text]
+
+    def render_frames(self, message_text: str, base_filename: str, message_id: int, message_type: str = "spotted",
+                      title: str = None) -> List[str]:
+        """
+        Renderizza il messaggio come sequenza ordinata di fotogrammi, da pubblicare
+        come storie consecutive. Un messaggio che sta in una card dà un solo
+        fotogramma, identico a from_text.
 
-        # Verifica se stiamo usando un template complesso che richiede Playwright
-        template_name = os.path.basename(settings.image.template_path)
-        is_complex_template = 'celestial' in template_name or 'prestige' in template_name or 'voltaic' in template_name
-
-        # Per template complessi, salta wkhtmltoimage e usa direttamente Playwright
-        if is_complex_template:
-            if self.playwright_available:
-                print(f"🎨 Template complesso rilevato ({template_name}), uso Playwright per rendering perfetto...")
-                try:
-                    return self._generate_with_playwright(message_text, output_path, message_id, message_type, title)
-                except Exception as pw_error:
-                    print(f"❌ Playwright fallito per template complesso: {pw_error}")
-                    print("🔄 Fallback a wkhtmltoimage...")
-            else:
-                print(f"⚠️ Template complesso ({template_name}) ma Playwright non disponibile, uso wkhtmltoimage...")
+        Tutti i fotogrammi escono dallo stesso backend in una sola sessione: con
+        Playwright la pagina viene caricata una volta e per ogni fotogramma si
+        sostituisce solo il testo prima dello screenshot.
 
-        # Prima prova con wkhtmltoimage (per template semplici)
-        if self.wkhtmltoimage_available:
+        Args:
+            base_filename: Nome senza estensione (es. 'spotted_123' → spotted_123_f1.png, ...).
+        """
+        pages = self.paginate(message_text)
+        if len(pages) == 1:
+            return [self.from_text(message_text, f"{base_filename}.png", message_id, message_type, title)]
+
+        print(f"🎞️ Messaggio ID {message_id} diviso in {len(pages)} fotogrammi")
+        cache = get_render_cache() if settings.image.render_cache_enabled else None
+        keys = [
+            self._cache_key(page, message_id, message_type, title, frame=f"{i}/{len(pages)}")
+            for i, page in enumerate(pages, start=1)
+        ]
+        if cache:
+            cached = [cache.get(key) for key in keys]
+            if all(cached):
+                print(f"⚡ Fotogrammi serviti dalla cache: {len(cached)}")
+                return cached
+
+        paths = self._render_frames_uncached(pages, base_filename, message_id, message_type, title)
+        if cache:
+            paths = [cache.put(key, path) for key, path in zip(keys, paths)]
+        return paths
+
+    def _render_frames_uncached(self, pages: List[str], base_filename: str, message_id: int, message_type: str,
+                                title: Optional[str]) -> List[str]:
+        """Come _render_uncached, ma tutti i fotogrammi con lo stesso backend (stesso aspetto)."""
+        output_paths = [os.path.join(self.output_folder, f"{base_filename}_f{i}.png") for i in range(1, len(pages) + 1)]
+        template_name = os.path.basename(self._template_path_for(message_type))
+
+        started = time.perf_counter()
+        tried, errors = [], []
+        for backend in self.backends.route(template_name):
+            if not self.backends.allow(backend):
+                continue
+            tried.append(backend)
+            backend_started = time.perf_counter()
             try:
-                # Renderizza l'HTML con il messaggio e il percorso base
-                html_content = self._render_html(message_text, message_id, message_type, title)
+                paths = getattr(self, FRAME_METHODS[backend])(pages, output_paths, message_id, message_type, title)
+            except Exception as e:
+                print(f"❌ Backend {backend} fallito sui fotogrammi: {e}")
+                self.backends.record_failure(backend, e)
+                errors.append(f"{backend}: {e}")
+                continue
+            # La latenza registrata è quella di un fotogramma, confrontabile con le card singole
+            self.backends.record_success(backend, (time.perf_counter() - backend_started) / len(pages))
+            self.backends.record_decision(template_name, backend, tried, time.perf_counter() - started)
+            return paths
+
+        self.backends.record_decision(template_name, None, tried, time.perf_counter() - started)
+        if not tried:
+            raise RuntimeError("ERRORE CRITICO: nessun backend di rendering disponibile (wkhtmltoimage, Playwright, PIL).")
+        raise RuntimeError(f"Tutti i backend hanno fallito. {'; '.join(errors)}")
+
+    def _frame_html(self, page: str, index: int, total: int, message_id: int, message_type: str, title: Optional[str]) -> str:
+        """HTML di un fotogramma: il template con il testo della pagina, la dimensione dei fotogrammi e l'etichetta."""
+        html_content = self._render_html(page, message_id, message_type, title)
+        extra = FRAME_HTML.format(size=settings.image.frame_font_size, label=f"{index}/{total}")
+        if "</body>" in html_content:
+            return html_content.replace("</body>", extra + "</body>", 1)
+        return html_content + extra
+
+    def _frames_with_pil(self, pages, output_paths, message_id, message_type, title) -> List[str]:
+        """Fotogrammi PIL: lo sfondo precalcolato viene copiato, il testo ridisegnato."""
+        profile = self._encode_profile(message_type, 'pil')
+        paths = []
+        for i, (page, output_path) in enumerate(zip(pages, output_paths), start=1):
+            img, stages = self._draw_pil_card(page, message_id, frame=(i, len(pages)))
+            paths.append(self._encode_card(img, output_path, 'pil', stages, profile))
+        return paths
+
+    def _frames_with_wkhtmltoimage(self, pages, output_paths, message_id, message_type, title) -> List[str]:
+        """Fotogrammi wkhtmltoimage: un job per fotogramma sui worker già avviati del demone."""
+        profile = self._encode_profile(message_type, 'wkhtmltoimage')
+        paths = []
+        for i, (page, output_path) in enumerate(zip(pages, output_paths), start=1):
+            html_content = self._frame_html(page, i, len(pages), message_id, message_type, title)
+            data, stages = self._wkhtml_render(page, message_id, message_type, title, html_content=html_content)
+            paths.append(self._decode_and_encode(data, output_path, 'wkhtmltoimage', stages, profile))
+        return paths
+
+    def _frames_with_playwright(self, pages, output_paths, message_id, message_type, title) -> List[str]:
+        """Fotogrammi Playwright: una sola pagina del browser, caricata una volta, e uno screenshot per fotogramma."""
+        if not PLAYWRIGHT_AVAILABLE:
+            raise RuntimeError("Playwright non disponibile")
 
-                # Opzioni per imgkit: larghezza, qualità, e abilitazione accesso file locali
-                options = {
-                    'width': self.image_width,
-                    'encoding': "UTF-8",
-                    'enable-local-file-access': None, # Necessario per caricare font locali
-                    'quiet': '' # Sopprime l'output di wkhtmltoimage
-                }
+        total = len(pages)
+        started = time.perf_counter()
+        first_html = self._frame_html(pages[0], 1, total, message_id, message_type, title)
+        html_ms = (time.perf_counter() - started) * 1000
+
+        def load(page, html_content):
+            page.set_content(html_content, wait_until='load', timeout=10000)
+            page.wait_for_function(CARD_READY_JS, timeout=settings.image.render_ready_timeout_ms)
+            render_status = page.evaluate(FREEZE_AND_CHECK_JS)
+            if not (render_status.get('hasBody') and render_status.get('hasCard') and render_status.get('bodyHeight', 0) > 500):
+                raise RuntimeError(f"HTML non renderizzato correttamente: {render_status}")
+
+        def render_on_page(page):
+            load(page, first_html)
+            screenshots = [page.screenshot(full_page=True, type='png', omit_background=False)]
+            for i, text in enumerate(pages[1:], start=2):
+                if not page.evaluate(SET_FRAME_JS, {"text": text, "label": f"{i}/{total}"}):
+                    # Template senza .message: il fotogramma viene ricaricato per intero
+                    load(page, self._frame_html(text, i, total, message_id, message_type, title))
+                screenshots.append(page.screenshot(full_page=True, type='png', omit_background=False))
+            return screenshots
+
+        started = time.perf_counter()
+        screenshots = get_browser_pool().run(render_on_page)
+        render_ms = (time.perf_counter() - started) * 1000
+        print(f"📸 {total} fotogrammi in una sessione del browser: {render_ms:.0f}ms")
+
+        profile = self._encode_profile(message_type, 'playwright')
+        return [
+            self._decode_and_encode(data, output_path, 'playwright', {'html_ms': html_ms, 'render_ms': render_ms / total}, profile)
+            for data, output_path in zip(screenshots, output_paths)
+        ]
+
+    def render_batch(self, messages: list, base_filename: str, max_workers: int = None,
+                     frames: bool = False) -> List[BatchRenderResult]:
+        """
+        Renderizza più card in parallelo mantenendo l'ordine di input.
 
-                # Genera l'immagine dall'HTML usando wkhtmltoimage
-                imgkit.from_string(html_content, output_path, options=options, config=self.config)
+        Ogni elemento può essere un SpottedMessage o un CardRequest (serve almeno
+        `text` e `id`). Gli errori del singolo elemento vengono riportati nel
+        risultato senza interrompere il resto del batch.
 
-                print(f"Immagine generata con successo (wkhtmltoimage): {output_path}")
+        Con frames=True i messaggi lunghi passano da render_frames: `path` è il
+        primo fotogramma e `frames` la sequenza completa, come per card_for_message.
+        """
+        # Estrae i campi nel thread chiamante: gli oggetti ORM non vanno letti da altri thread
+        requests = [
+            CardRequest(
+                text=message.text,
+                id=message.id,
+                message_type=getattr(message, 'message_type', None) or "spotted",
+                title=getattr(message, 'title', None)
+            )
+            for message in messages
+        ]
+        if not requests:
+            return []
 
-                # Ottimizza per Instagram anche le immagini wkhtmltoimage
-                optimized_path = self._optimize_for_instagram(output_path)
-                return optimized_path
+        workers = max(1, min(max_workers or settings.image.render_batch_workers, len(requests)))
+        print(f"🧵 Render batch di {len(requests)} card con {workers} worker...")
 
+        def render_one(index: int, request: CardRequest) -> BatchRenderResult:
+            started = time.perf_counter()
+            try:
+                if frames:
+                    paths = self.render_frames(
+                        request.text, f"{base_filename}_{index}", request.id,
+                        message_type=request.message_type, title=request.title
+                    )
+                else:
+                    paths = [self.from_text(
+                        request.text, f"{base_filename}_{index}.png", request.id,
+                        message_type=request.message_type, title=request.title
+                    )]
+                if not paths or not all(paths):
+                    raise RuntimeError("Generazione immagine ha restituito None")
+                return BatchRenderResult(index, request.id, paths[0], None, time.perf_counter() - started,
+                                         paths if frames else None)
             except Exception as e:
-                # Controlla se è un errore di compatibilità GLIBC o librerie
-                error_str = str(e).lower()
-                is_glibc_error = ('glibc' in error_str and ('version' in error_str or 'not found' in error_str)) or \
-                                'exited with non-zero code' in error_str
+                print(f"❌ Errore render batch elemento {index} (ID {request.id}): {e}")
+                return BatchRenderResult(index, request.id, None, str(e), time.perf_counter() - started)
 
-                if is_glibc_error:
-                    print(f"⚠️ wkhtmltoimage ha problemi di compatibilità GLIBC, provo con PIL come fallback...")
-                else:
-                    print(f"⚠️ Errore con wkhtmltoimage: {e}")
-                    print("Provo con PIL come fallback...")
-
-                # Se wkhtmltoimage fallisce, prova Playwright come seconda opzione
-                if self.playwright_available:
-                    try:
-                        print("🎭 Provo Playwright per rendering HTML accurato...")
-                        return self._generate_with_playwright(message_text, output_path, message_id, message_type, title)
-                    except Exception as pw_error:
-                        print(f"❌ Playwright fallito: {pw_error}")
-                        print("Cado su PIL come ultimo fallback...")
-
-                        # Terza opzione: PIL come fallback finale
-                        if PIL_AVAILABLE:
-                            try:
-                                print("🔄 Uso PIL come fallback finale...")
-                                return self._generate_with_pil(message_text, output_path, message_id, message_type, title)
-                            except Exception as pil_error:
-                                print(f"❌ Anche PIL ha fallito: {pil_error}")
-                                raise RuntimeError(f"Tutti i metodi hanno fallito. wkhtmltoimage: {e}, Playwright: {pw_error if 'pw_error' in locals() else 'N/A'}, PIL: {pil_error}") from pil_error
-                        else:
-                            raise RuntimeError(f"wkhtmltoimage fallito e nessun fallback disponibile: {e}") from e
-        else:
-            # wkhtmltoimage non disponibile, prova prima Playwright poi PIL
-            if self.playwright_available:
-                try:
-                    print("🎭 wkhtmltoimage non disponibile, provo Playwright...")
-                    return self._generate_with_playwright(message_text, output_path, message_id, message_type, title)
-                except Exception as pw_error:
-                    print(f"❌ Playwright fallito: {pw_error}")
-
-            # Fallback finale: PIL
-            print("🔄 wkhtmltoimage e Playwright non disponibili, uso PIL...")
-            if PIL_AVAILABLE:
-                try:
-                    return self._generate_with_pil(message_text, output_path, message_id, message_type, title)
-                except Exception as pil_error:
-                    raise RuntimeError(f"Tutti i fallback hanno fallito: {pil_error}") from pil_error
-            else:
-                raise RuntimeError("ERRORE CRITICO: wkhtmltoimage, Playwright e PIL non disponibili.")
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="render-batch") as executor:
+            results = list(executor.map(render_one, range(len(requests)), requests))
 
-    def create_daily_collage(self, messages: list, output_filename: str, title: str = None) -> Optional[list]:
+        failed = sum(1 for result in results if result.error)
+        print(f"🧵 Render batch completato: {len(results) - failed} ok, {failed} falliti")
+        return results
+
+    def create_daily_collage(self, messages: list, output_filename: str, title: str = None, style: str = "grid") -> Optional[list]:
         """
-        Crea un collage giornaliero con più messaggi.
+        Crea un collage giornaliero con più messaggi nello stile indicato
+        (grid, compact o elegant, come DailyPostStyle).
         Ritorna una lista di percorsi di immagini per carousel Instagram.
         """
         if not messages:
             return None
 
         try:
-            print(f"🎨 Creando collage giornaliero con {len(messages)} messaggi...")
-
-            # Dimensioni per Instagram Stories/Carousel
-            width, height = 1080, 1920
+            print(f"🎨 Creando collage giornaliero ({style}) con {len(messages)} messaggi...")
 
             # Diversi layout basati sul numero di messaggi
             if len(messages) == 1:
@@ -742,19 +972,19 @@ class ImageGenerator:
 
             elif len(messages) <= 4:
                 # 2x2 grid layout
-                return self._create_grid_layout(messages, output_filename, 2, 2, title)
+                return self._create_grid_layout(messages, output_filename, 2, 2, title, style)
 
             elif len(messages) <= 6:
                 # 2x3 grid layout
-                return self._create_grid_layout(messages, output_filename, 2, 3, title)
+                return self._create_grid_layout(messages, output_filename, 2, 3, title, style)
 
             elif len(messages) <= 9:
                 # 3x3 grid layout
-                return self._create_grid_layout(messages, output_filename, 3, 3, title)
+                return self._create_grid_layout(messages, output_filename, 3, 3, title, style)
 
             else:
                 # Più di 9 messaggi - crea multiple immagini
-                return self._create_multi_page_layout(messages, output_filename, title)
+                return self._create_multi_page_layout(messages, output_filename, title, style)
 
         except Exception as e:
             print(f"❌ Errore nella creazione del collage giornaliero: {e}")
@@ -772,29 +1002,20 @@ class ImageGenerator:
         try:
             print(f"🎨 Creando carousel giornaliero con {len(messages)} messaggi...")
 
-            image_paths = []
-
-            # 1. Crea immagine di introduzione con il titolo
+            # 1. Immagine di introduzione con il titolo (ID 0), poi una card per messaggio:
+            #    tutte renderizzate in parallelo mantenendo l'ordine del carousel
             intro_text = f"📸 {title}\n\nEcco i post della giornata! 🌟"
-            intro_filename = f"{base_filename}_intro.png"
-            intro_path = self.from_text(intro_text, intro_filename, 0)  # ID 0 per intro
-            if intro_path:
-                image_paths.append(intro_path)
-                print(f"✅ Creata immagine introduzione: {intro_path}")
-
-            # 2. Crea immagini individuali per ogni messaggio
-            for i, message in enumerate(messages, 1):
-                try:
-                    message_filename = f"{base_filename}_{i}.png"
-                    message_path = self.from_text(message.text, message_filename, message.id)
-                    if message_path:
-                        image_paths.append(message_path)
-                        print(f"✅ Creata immagine messaggio {i}: {message_path}")
-                    else:
-                        print(f"⚠️ Saltata immagine messaggio {i} - generazione fallita")
-                except Exception as e:
-                    print(f"❌ Errore creazione immagine messaggio {i}: {e}")
-                    continue
+            cards = [CardRequest(text=intro_text, id=0)] + list(messages)
+            results = self.render_batch(cards, base_filename)
+
+            image_paths = []
+            for result in results:
+                label = "introduzione" if result.index == 0 else f"messaggio {result.index}"
+                if result.path:
+                    image_paths.append(result.path)
+                    print(f"✅ Creata immagine {label}: {result.path}")
+                else:
+                    print(f"⚠️ Saltata immagine {label} - generazione fallita: {result.error}")
 
             if len(image_paths) > 1:  # Almeno intro + 1 messaggio
                 print(f"🎉 Carousel creato con {len(image_paths)} immagini")
@@ -807,52 +1028,50 @@ class ImageGenerator:
             print(f"❌ Errore nella creazione del carousel giornaliero: {e}")
             return None
 
-    def _create_grid_layout(self, messages: list, base_filename: str, rows: int, cols: int, title: str = None) -> list:
+    def _create_grid_layout(self, messages: list, base_filename: str, rows: int, cols: int, title: str = None, style: str = "grid") -> list:
         """Crea un layout a griglia per il collage giornaliero."""
         if not PIL_AVAILABLE:
             raise RuntimeError("PIL non disponibile per collage")
 
         try:
+            palette = COLLAGE_STYLES.get(style, COLLAGE_STYLES["grid"])
+            width, height = 1080, 1920
+
             # Dimensioni per ogni cella
-            cell_width = 1080 // cols
-            cell_height = 1920 // rows
+            cell_width = width // cols
+            cell_height = height // rows
 
-            # Crea immagine principale
-            img = Image.new('RGB', (1080, 1920), color='#000000')
+            # Sfondo, pattern e riquadri delle celle arrivano già pronti dall'atlante
+            img = self._get_collage_background(width, height, style, rows, cols, bool(title)).copy()
             draw = ImageDraw.Draw(img)
 
-            # Font per il testo
+            # Font per il testo (percorso assoluto, condivisi dal processo)
             try:
-                font = ImageFont.truetype("app/image/templates/fonts/Komika_Axis.ttf", 32)
-                title_font = ImageFont.truetype("app/image/templates/fonts/Komika_Axis.ttf", 48)
+                font = get_font(FONT_PATH, 32)
+                title_font = get_font(FONT_PATH, 48)
             except:
                 font = ImageFont.load_default()
                 title_font = ImageFont.load_default()
 
-            # Sfondo con pattern blu professionale
-            self._add_professional_background(img, draw)
-
             # Aggiungi titolo se fornito
             if title:
                 # Calcola dimensioni del testo del titolo
                 bbox = draw.textbbox((0, 0), title, font=title_font)
                 title_width = bbox[2] - bbox[0]
-                title_x = (1080 - title_width) // 2
+                title_x = (width - title_width) // 2
                 title_y = 50
 
-                # Aggiungi outline al titolo
-                for offset_x, offset_y in [(-2,-2), (-2,2), (2,-2), (2,2)]:
-                    draw.text((title_x + offset_x, title_y + offset_y), title, font=title_font, fill='#001122')
-                draw.text((title_x, title_y), title, font=title_font, fill='#00A0FF')
+                # Outline e titolo da un'unica maschera del testo
+                title_box = (0, 0, width, 200)
+                mask = self._text_mask(title_box, [(title_x, title_y, title)], title_font)
+                self._paint_mask(img, mask, title_box[:2], palette["title_outline"], [(-2, -2), (-2, 2), (2, -2), (2, 2)])
+                self._paint_mask(img, mask, title_box[:2], palette["title"], [(0, 0)])
 
             # Calcola posizioni per la griglia
             start_y = 200 if title else 100
-            cell_padding = 20
-
-            for i, message in enumerate(messages):
-                if i >= rows * cols:
-                    break
+            cell_padding = palette["padding"]
 
+            for i, message in enumerate(messages[:rows * cols]):
                 row = i // cols
                 col = i % cols
 
@@ -861,16 +1080,11 @@ class ImageGenerator:
                 w = cell_width - 2 * cell_padding
                 h = cell_height - 2 * cell_padding
 
-                # Crea rettangolo semi-trasparente per il messaggio
-                overlay = Image.new('RGBA', (w, h), (0, 122, 255, 30))
-                img.paste(overlay, (x, y), overlay)
-
                 # Scrivi il testo del messaggio
-                self._draw_message_text(draw, message.text, x, y, w, h, font)
+                self._draw_message_text(img, message.text, x, y, w, h, font, palette)
 
-            # Salva l'immagine
-            output_path = os.path.join(self.output_folder, base_filename)
-            img.save(output_path, 'PNG', optimize=True)
+            # Salva l'immagine con l'encoder configurato (una sola codifica)
+            output_path = encode_image(img, os.path.join(self.output_folder, base_filename), profile=f"collage:{style}").path
             print(f"✅ Collage giornaliero creato: {output_path}")
 
             return [output_path]
@@ -879,74 +1093,111 @@ class ImageGenerator:
             print(f"❌ Errore nel layout griglia: {e}")
             return None
 
-    def _create_multi_page_layout(self, messages: list, base_filename: str, title: str = None) -> list:
-        """Crea multiple immagini per molti messaggi."""
-        images = []
-        messages_per_page = 6  # 2x3 layout per pagina
+    def _create_multi_page_layout(self, messages: list, base_filename: str, title: str = None, style: str = "grid") -> list:
+        """Crea multiple immagini per molti messaggi, renderizzando le pagine in parallelo."""
+        rows, cols = COLLAGE_STYLES.get(style, COLLAGE_STYLES["grid"])["page_grid"]
+        messages_per_page = rows * cols
 
+        pages = []
         for i in range(0, len(messages), messages_per_page):
-            page_messages = messages[i:i + messages_per_page]
-            page_title = f"{title} (Parte {i//messages_per_page + 1})" if title else f"Parte {i//messages_per_page + 1}"
-
-            page_filename = f"{base_filename.replace('.png', '')}_part{i//messages_per_page + 1}.png"
-            page_images = self._create_grid_layout(page_messages, page_filename, 2, 3, page_title)
-
-            if page_images:
-                images.extend(page_images)
+            page_number = i // messages_per_page + 1
+            page_title = f"{title} (Parte {page_number})" if title else f"Parte {page_number}"
+            page_filename = f"{base_filename.replace('.png', '')}_part{page_number}.png"
+            pages.append((messages[i:i + messages_per_page], page_filename, rows, cols, page_title, style))
+
+        # Le pagine sono indipendenti: map mantiene l'ordine del carousel. Il lavoro
+        # è CPU-bound, quindi non più thread che core (su un solo core nessun pool)
+        workers = max(1, min(settings.image.render_batch_workers, os.cpu_count() or 1, len(pages)))
+        if workers == 1:
+            results = [self._create_grid_layout(*page) for page in pages]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(lambda page: self._create_grid_layout(*page), pages))
 
+        images = [path for page_images in results if page_images for path in page_images]
         return images if images else None
 
-    def _add_professional_background(self, img: Image, draw: ImageDraw):
-        """Aggiunge uno sfondo professionale blu al collage."""
-        width, height = img.size
-
-        # Sfondo base blu scuro
-        bg = Image.new('RGBA', (width, height), (0, 20, 40, 255))
-        img.paste(bg, (0, 0), bg)
-
-        # Pattern di cerchi blu
-        import random
-        random.seed(42)  # Seed fisso per consistenza
-
+    def _get_collage_background(self, width: int, height: int, style: str, rows: int, cols: int, has_title: bool):
+        """Sfondo del collage dall'atlante: costruito una volta per dimensione, stile e griglia."""
+        key = (width, height, style, rows, cols, has_title)
+        with _COLLAGE_ATLAS_LOCK:
+            background = _COLLAGE_ATLAS.get(key)
+            if background is None:
+                background = self._build_collage_background(*key)
+                _COLLAGE_ATLAS[key] = background
+        return background
+
+    def _build_collage_background(self, width: int, height: int, style: str, rows: int, cols: int, has_title: bool):
+        """Sfondo professionale del collage con i riquadri semi-trasparenti delle celle."""
+        palette = COLLAGE_STYLES.get(style, COLLAGE_STYLES["grid"])
+        img = Image.new('RGB', (width, height), palette["background"])
+        draw = ImageDraw.Draw(img)
+
+        # Pattern di cerchi concentrici (seed fisso per consistenza)
+        rng = random.Random(42)
         for i in range(15):
-            center_x = random.randint(width//8, 7*width//8)
-            center_y = random.randint(height//8, 7*height//8)
-            radius = random.randint(100, 200)
-            alpha = random.randint(20, 50)
+            center_x = rng.randint(width//8, 7*width//8)
+            center_y = rng.randint(height//8, 7*height//8)
+            radius = rng.randint(100, 200)
+            rng.randint(20, 50)  # alpha storico: ignorato su canvas RGB, mantiene la sequenza
 
-            # Cerchi concentrici
             for r in range(radius, 50, -30):
                 draw.ellipse(
                     [center_x - r, center_y - r, center_x + r, center_y + r],
-                    outline=(0, 122, 255, alpha),
+                    outline=palette["rings"],
                     width=1
                 )
 
-    def _draw_message_text(self, draw: ImageDraw, text: str, x: int, y: int, w: int, h: int, font):
-        """Disegna il testo del messaggio in una cella del collage."""
-        # Tronca il testo se troppo lungo
-        if len(text) > 150:
-            text = text[:147] + "..."
-
-        # Calcola dimensioni del testo
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-
-        # Ridimensiona font se necessario
-        if text_width > w - 20:
-            font = ImageFont.truetype("app/image/templates/fonts/Komika_Axis.ttf", 24) if font.size > 24 else font
-
-        # Posiziona il testo
-        text_x = x + 10
-        text_y = y + 10
-
-        # Aggiungi outline bianco per leggibilità
-        for offset_x, offset_y in [(-1,-1), (-1,1), (1,-1), (1,1)]:
-            draw.text((text_x + offset_x, text_y + offset_y), text, font=font, fill='#FFFFFF')
-
-        # Testo principale blu
-        draw.text((text_x, text_y), text, font=font, fill='#00A0FF')
+        # Riquadri semi-trasparenti delle celle
+        cell_width = width // cols
+        cell_height = height // rows
+        start_y = 200 if has_title else 100
+        padding = palette["padding"]
+        w = cell_width - 2 * padding
+        h = cell_height - 2 * padding
+        overlay = Image.new('RGBA', (w, h), palette["cell"])
+        for i in range(rows * cols):
+            x = (i % cols) * cell_width + padding
+            y = start_y + (i // cols) * cell_height + padding
+            img.paste(overlay, (x, y), overlay)
+        return img
+
+    @staticmethod
+    def _text_mask(box: tuple, lines: list, font):
+        """Rasterizza una volta sola le righe (x, y, testo) nella maschera L del riquadro."""
+        left, top, right, bottom = box
+        mask = Image.new('L', (right - left, bottom - top), 0)
+        mask_draw = ImageDraw.Draw(mask)
+        for x, y, line in lines:
+            mask_draw.text((x - left, y - top), line, font=font, fill=255)
+        return mask
+
+    @staticmethod
+    def _paint_mask(img, mask, origin: tuple, color, offsets: list):
+        """Colora l'immagine attraverso la maschera del testo, a ciascuno degli offset."""
+        bbox = mask.getbbox()
+        if not bbox:
+            return
+        region = mask.crop(bbox)
+        left, top = origin[0] + bbox[0], origin[1] + bbox[1]
+        for dx, dy in offsets:
+            img.paste(color, (left + dx, top + dy, left + dx + region.width, top + dy + region.height), region)
+
+    def _draw_message_text(self, img, text: str, x: int, y: int, w: int, h: int, font, palette: dict = None):
+        """Disegna il testo del messaggio in una cella del collage, adattandolo alla cella."""
+        palette = palette or COLLAGE_STYLES["grid"]
+        # Stesso motore di layout delle card: il testo va a capo e il font si
+        # riduce (fino a 18px) finché il messaggio non sta nella cella
+        layout = fit_text(text, max_width=w - 20, max_height=h - 20,
+                          max_size=getattr(font, 'size', 32), min_size=18, line_spacing=1.3, font=font)
+
+        # Ogni riga viene rasterizzata una volta: outline e testo sono la stessa
+        # maschera incollata a offset diversi, non cinque draw.text per riga
+        lines = [(x + 10, y + 10 + i * layout.line_height, line) for i, line in enumerate(layout.lines)]
+        cell_box = (x, y, x + w, y + h)
+        mask = self._text_mask(cell_box, lines, layout.font)
+        self._paint_mask(img, mask, cell_box[:2], palette["outline"], [(-1, -1), (-1, 1), (1, -1), (1, 1)])
+        self._paint_mask(img, mask, cell_box[:2], palette["text"], [(0, 0)])
 
 # Esempio di utilizzo (per testare questo file singolarmente)
 if __name__ == '__main__':
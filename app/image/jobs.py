@@ -0,0 +1,459 @@
+"""
+Coda dei job di rendering e servizio che li esegue.
+
+Il processo web non renderizza: accoda un job nella tabella `render_jobs`
+e, se gli serve il risultato, ne attende l'esito. I job vengono eseguiti
+da render_service.py, un processo separato con concorrenza configurabile:
+un Chromium bloccato occupa uno slot del servizio di rendering, non il
+threadpool dell'app web.
+
+Ogni job ha una scadenza (attesa in coda inclusa): un job scaduto non
+viene eseguito e chi lo aspetta riceve subito l'errore. Quando i job in
+attesa superano `render_queue_max_depth` chi accoda viene frenato per al
+massimo `render_queue_block_seconds`, poi riceve RenderQueueFull.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Callable, Dict, NamedTuple, Optional
+
+from sqlalchemy import func, update
+
+from app.database import Base, RenderJob, RenderWorker, SessionLocal, engine
+from config import settings
+
+# Priorità: le anteprime dell'admin prima delle pubblicazioni, i pre-render per ultimi
+PRIORITY_PREVIEW = 20
+PRIORITY_INTERACTIVE = 10
+PRIORITY_BACKGROUND = 0
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+EXPIRED = "expired"
+FINISHED = (DONE, FAILED, EXPIRED)
+
+# Un job in esecuzione su un servizio senza heartbeat da più di così torna in coda
+STALE_HEARTBEATS = 3
+MAX_ATTEMPTS = 2
+# Intervallo tra due verifiche della presenza di un servizio di rendering (RENDER_SERVICE non impostato)
+LIVE_CHECK_SECONDS = 10
+
+
+class RenderQueueFull(Exception):
+    """La coda ha raggiunto la profondità massima (backpressure)."""
+
+
+class RenderJobError(Exception):
+    """Il job è fallito, è scaduto o non è terminato in tempo."""
+
+
+class ClaimedJob(NamedTuple):
+    id: int
+    kind: str
+    payload: dict
+    deadline_at: Optional[datetime]
+
+
+class JobResult(NamedTuple):
+    id: int
+    result: object
+    blob: Optional[bytes]
+
+
+_inline = False
+
+
+def set_inline_rendering(enabled: bool = True):
+    """Dichiara che questo processo (servizio di rendering, worker.py) renderizza direttamente."""
+    global _inline
+    _inline = enabled
+
+
+def renders_inline() -> bool:
+    """
+    True se il processo corrente renderizza senza passare dalla coda. Senza
+    RENDER_SERVICE esplicito la coda si usa solo se un servizio di rendering
+    è attivo: un deploy che avvia solo uvicorn continua a generare le card.
+    """
+    if _inline:
+        return True
+    enabled = settings.image.render_service_enabled
+    if enabled is None:
+        return not _render_service_live()
+    return not enabled
+
+
+_live_check = (0.0, False)
+
+
+def _render_service_live() -> bool:
+    """Servizio di rendering con heartbeat recente; il database si interroga al massimo ogni LIVE_CHECK_SECONDS."""
+    global _live_check
+    checked_at, live = _live_check
+    now = time.monotonic()
+    if not checked_at or now - checked_at >= LIVE_CHECK_SECONDS:
+        try:
+            live = bool(get_render_queue().live_workers())
+        except Exception as e:
+            print(f"--- [RenderQueue] Stato del servizio di rendering non verificabile: {e} ---")
+            live = False
+        _live_check = (now, live)
+    return live
+
+
+class RenderQueue:
+    """Coda durevole dei job di rendering su database (SQLite o Postgres)."""
+
+    def __init__(self, session_factory: Callable = None, max_depth: int = None, block_seconds: float = None):
+        self.session_factory = session_factory or SessionLocal
+        self.max_depth = max_depth if max_depth is not None else settings.image.render_queue_max_depth
+        self.block_seconds = block_seconds if block_seconds is not None else settings.image.render_queue_block_seconds
+        self.rejected = 0
+
+    # --- Lato chiamante ---
+
+    def submit(self, kind: str, payload: dict = None, priority: int = PRIORITY_BACKGROUND,
+               deadline_seconds: float = None, dedup_key: str = None, block_seconds: float = None) -> int:
+        """
+        Accoda un job e ne restituisce l'id. Un job con la stessa `dedup_key`
+        ancora in coda viene riusato. Con la coda piena attende un posto per
+        al massimo `block_seconds`, poi solleva RenderQueueFull.
+        """
+        deadline_seconds = deadline_seconds or settings.image.render_job_deadline_seconds
+        block_seconds = self.block_seconds if block_seconds is None else block_seconds
+        give_up = time.monotonic() + block_seconds
+        while True:
+            db = self.session_factory()
+            try:
+                if dedup_key:
+                    existing = db.query(RenderJob.id).filter(
+                        RenderJob.dedup_key == dedup_key, RenderJob.status == QUEUED
+                    ).first()
+                    if existing:
+                        return existing.id
+                depth = db.query(func.count(RenderJob.id)).filter(RenderJob.status == QUEUED).scalar()
+                if depth < self.max_depth:
+                    now = datetime.utcnow()
+                    job = RenderJob(
+                        kind=kind,
+                        payload=json.dumps(payload or {}),
+                        status=QUEUED,
+                        priority=priority,
+                        dedup_key=dedup_key,
+                        created_at=now,
+                        deadline_at=now + timedelta(seconds=deadline_seconds),
+                    )
+                    db.add(job)
+                    db.commit()
+                    return job.id
+            finally:
+                db.close()
+            if time.monotonic() >= give_up:
+                self.rejected += 1
+                raise RenderQueueFull(f"Coda di rendering piena ({depth} job in attesa)")
+            time.sleep(0.1)
+
+    def wait(self, job_id: int, timeout: float = None) -> JobResult:
+        """Attende l'esito del job (di default fino alla sua scadenza)."""
+        give_up = time.monotonic() + timeout if timeout is not None else None
+        poll = 0.02
+        while True:
+            db = self.session_factory()
+            try:
+                job = db.get(RenderJob, job_id)
+                if job is None:
+                    raise RenderJobError(f"Job di rendering {job_id} inesistente")
+                if job.status == DONE:
+                    return JobResult(job.id, json.loads(job.result) if job.result else None, job.result_blob)
+                if job.status in (FAILED, EXPIRED):
+                    raise RenderJobError(job.error or f"Job di rendering {job_id}: {job.status}")
+                if give_up is None:
+                    remaining = (job.deadline_at - datetime.utcnow()).total_seconds() if job.deadline_at else 0
+                    # Margine per lasciare al servizio il tempo di registrare la scadenza
+                    give_up = time.monotonic() + max(0.0, remaining) + 2
+            finally:
+                db.close()
+            if time.monotonic() >= give_up:
+                raise RenderJobError(f"Job di rendering {job_id} non completato in tempo")
+            time.sleep(poll)
+            poll = min(poll * 1.5, 0.25)
+
+    def run(self, kind: str, payload: dict = None, priority: int = PRIORITY_INTERACTIVE,
+            deadline_seconds: float = None, dedup_key: str = None) -> JobResult:
+        """Accoda un job e ne attende l'esito."""
+        return self.wait(self.submit(kind, payload, priority, deadline_seconds, dedup_key))
+
+    # --- Lato servizio di rendering ---
+
+    def claim(self, worker_id: str) -> Optional[ClaimedJob]:
+        """Prende il job in coda con priorità più alta; i job già scaduti vengono chiusi senza eseguirli."""
+        db = self.session_factory()
+        try:
+            while True:
+                candidate = db.query(RenderJob.id).filter(RenderJob.status == QUEUED).order_by(
+                    RenderJob.priority.desc(), RenderJob.id
+                ).first()
+                if candidate is None:
+                    return None
+                now = datetime.utcnow()
+                # UPDATE condizionale: se un altro servizio l'ha già preso non tocca righe
+                claimed = db.execute(
+                    update(RenderJob)
+                    .where(RenderJob.id == candidate.id, RenderJob.status == QUEUED)
+                    .values(status=RUNNING, worker_id=worker_id, started_at=now, attempts=RenderJob.attempts + 1)
+                ).rowcount
+                db.commit()
+                if not claimed:
+                    continue
+                job = db.get(RenderJob, candidate.id)
+                if job.deadline_at and job.deadline_at < now:
+                    job.status = EXPIRED
+                    job.error = "Scadenza superata in coda"
+                    job.finished_at = now
+                    db.commit()
+                    continue
+                return ClaimedJob(job.id, job.kind, json.loads(job.payload or "{}"), job.deadline_at)
+        finally:
+            db.close()
+
+    def complete(self, job_id: int, result=None, blob: bytes = None) -> bool:
+        return self._finish(job_id, DONE, result=json.dumps(result), result_blob=blob)
+
+    def fail(self, job_id: int, error: str, status: str = FAILED) -> bool:
+        return self._finish(job_id, status, error=str(error)[:500])
+
+    def _finish(self, job_id: int, status: str, **values) -> bool:
+        # Solo i job ancora in esecuzione: uno già chiuso per scadenza resta chiuso
+        db = self.session_factory()
+        try:
+            updated = db.execute(
+                update(RenderJob)
+                .where(RenderJob.id == job_id, RenderJob.status == RUNNING)
+                .values(status=status, finished_at=datetime.utcnow(), **values)
+            ).rowcount
+            db.commit()
+            return bool(updated)
+        finally:
+            db.close()
+
+    def heartbeat(self, worker_id: str, concurrency: int, running: int, done: int, failed: int):
+        db = self.session_factory()
+        try:
+            worker = db.get(RenderWorker, worker_id)
+            if worker is None:
+                worker = RenderWorker(id=worker_id, started_at=datetime.utcnow())
+                db.add(worker)
+            worker.concurrency = concurrency
+            worker.running = running
+            worker.jobs_done = done
+            worker.jobs_failed = failed
+            worker.last_seen_at = datetime.utcnow()
+            db.commit()
+        finally:
+            db.close()
+
+    def _heartbeat_cutoff(self) -> datetime:
+        return datetime.utcnow() - timedelta(seconds=settings.image.render_service_heartbeat_seconds * STALE_HEARTBEATS)
+
+    def live_workers(self) -> list:
+        db = self.session_factory()
+        try:
+            return [w.id for w in db.query(RenderWorker).filter(RenderWorker.last_seen_at >= self._heartbeat_cutoff())]
+        finally:
+            db.close()
+
+    def recover_orphans(self) -> int:
+        """Rimette in coda i job rimasti in esecuzione su un servizio che non dà più segni di vita."""
+        live = set(self.live_workers())
+        recovered = 0
+        db = self.session_factory()
+        try:
+            for job in db.query(RenderJob).filter(RenderJob.status == RUNNING):
+                if job.worker_id in live:
+                    continue
+                if job.attempts >= MAX_ATTEMPTS:
+                    job.status = FAILED
+                    job.error = "Servizio di rendering terminato durante il job"
+                    job.finished_at = datetime.utcnow()
+                else:
+                    job.status = QUEUED
+                    job.worker_id = None
+                recovered += 1
+            db.commit()
+            return recovered
+        finally:
+            db.close()
+
+    def purge(self, retention_hours: int = None) -> int:
+        """Elimina i job conclusi più vecchi della retention e i servizi spenti da tempo."""
+        hours = retention_hours if retention_hours is not None else settings.image.render_job_retention_hours
+        cutoff = datetime.utcnow() - timedelta(hours=hours)
+        db = self.session_factory()
+        try:
+            deleted = db.query(RenderJob).filter(
+                RenderJob.status.in_(FINISHED), RenderJob.finished_at < cutoff
+            ).delete(synchronize_session=False)
+            db.query(RenderWorker).filter(RenderWorker.last_seen_at < cutoff).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        finally:
+            db.close()
+
+    def depth(self) -> int:
+        db = self.session_factory()
+        try:
+            return db.query(func.count(RenderJob.id)).filter(RenderJob.status == QUEUED).scalar()
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        """Profondità della coda, esiti dell'ultima ora e servizi di rendering attivi."""
+        now = datetime.utcnow()
+        db = self.session_factory()
+        try:
+            counts = dict(db.query(RenderJob.status, func.count(RenderJob.id)).filter(
+                (RenderJob.status.in_((QUEUED, RUNNING))) | (RenderJob.finished_at >= now - timedelta(hours=1))
+            ).group_by(RenderJob.status).all())
+            queued_by_kind = dict(db.query(RenderJob.kind, func.count(RenderJob.id)).filter(
+                RenderJob.status == QUEUED
+            ).group_by(RenderJob.kind).all())
+            oldest = db.query(func.min(RenderJob.created_at)).filter(RenderJob.status == QUEUED).scalar()
+            recent = db.query(RenderJob.created_at, RenderJob.started_at, RenderJob.finished_at).filter(
+                RenderJob.status == DONE, RenderJob.finished_at >= now - timedelta(hours=1)
+            ).all()
+            cutoff = self._heartbeat_cutoff()
+            workers = [
+                {"id": w.id, "concurrency": w.concurrency, "running": w.running,
+                 "done": w.jobs_done, "failed": w.jobs_failed}
+                for w in db.query(RenderWorker).filter(RenderWorker.last_seen_at >= cutoff)
+            ]
+        finally:
+            db.close()
+        waits = [(r.started_at - r.created_at).total_seconds() * 1000 for r in recent if r.started_at]
+        runs = [(r.finished_at - r.started_at).total_seconds() * 1000 for r in recent if r.started_at]
+        return {
+            "queued": counts.get(QUEUED, 0),
+            "running": counts.get(RUNNING, 0),
+            "queued_by_kind": queued_by_kind,
+            "oldest_queued_seconds": round((now - oldest).total_seconds(), 1) if oldest else None,
+            "last_hour": {status: counts.get(status, 0) for status in FINISHED},
+            "avg_wait_ms": round(sum(waits) / len(waits), 1) if waits else None,
+            "avg_run_ms": round(sum(runs) / len(runs), 1) if runs else None,
+            "max_depth": self.max_depth,
+            "rejected": self.rejected,
+            "workers": workers,
+        }
+
+
+class RenderService:
+    """
+    Esegue i job della coda con `concurrency` thread. Un job oltre la scadenza
+    viene chiuso subito come scaduto; il suo slot si libera quando il backend
+    termina il render (i backend hanno timeout propri).
+    """
+
+    def __init__(self, handlers: Dict[str, Callable], queue: RenderQueue = None,
+                 concurrency: int = None, worker_id: str = None, poll_seconds: float = 0.05):
+        self.handlers = handlers
+        self.queue = queue or RenderQueue()
+        self.concurrency = max(1, concurrency or settings.image.render_service_concurrency)
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.poll_seconds = poll_seconds
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="render-job")
+        self._active = {}
+        self._overdue = set()
+        self._stop = threading.Event()
+        self.done = 0
+        self.failed = 0
+        self.expired = 0
+
+    def run_once(self) -> int:
+        """Raccoglie gli esiti, applica le scadenze e prende nuovi job fino a riempire gli slot."""
+        self._reap()
+        claimed = 0
+        while len(self._active) < self.concurrency:
+            job = self.queue.claim(self.worker_id)
+            if job is None:
+                break
+            handler = self.handlers.get(job.kind)
+            if handler is None:
+                self.queue.fail(job.id, f"Tipo di job sconosciuto: {job.kind}")
+                self.failed += 1
+                continue
+            self._active[job.id] = (self._executor.submit(handler, job.payload), job)
+            claimed += 1
+        return claimed
+
+    def _reap(self):
+        now = datetime.utcnow()
+        for job_id, (future, job) in list(self._active.items()):
+            if future.done():
+                del self._active[job_id]
+                if job_id in self._overdue:
+                    self._overdue.discard(job_id)
+                    continue
+                try:
+                    output = future.result()
+                    result, blob = output if isinstance(output, tuple) else (output, None)
+                    self.queue.complete(job_id, result, blob)
+                    self.done += 1
+                except Exception as e:
+                    print(f"--- [RENDER SERVICE] ❌ Job {job_id} ({job.kind}) fallito: {e} ---", flush=True)
+                    self.queue.fail(job_id, e)
+                    self.failed += 1
+            elif job.deadline_at and now > job.deadline_at and job_id not in self._overdue:
+                print(f"--- [RENDER SERVICE] ⏱️ Job {job_id} ({job.kind}) oltre la scadenza ---", flush=True)
+                self.queue.fail(job_id, "Scadenza superata durante il rendering", status=EXPIRED)
+                self._overdue.add(job_id)
+                self.expired += 1
+
+    def heartbeat(self):
+        self.queue.heartbeat(self.worker_id, self.concurrency, len(self._active), self.done, self.failed + self.expired)
+
+    def run_forever(self):
+        """Ciclo principale del processo render_service.py."""
+        heartbeat_every = settings.image.render_service_heartbeat_seconds
+        next_heartbeat = next_maintenance = 0.0
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= next_heartbeat:
+                self.heartbeat()
+                next_heartbeat = now + heartbeat_every
+            if now >= next_maintenance:
+                recovered = self.queue.recover_orphans()
+                if recovered:
+                    print(f"--- [RENDER SERVICE] ♻️ {recovered} job orfani rimessi in coda ---", flush=True)
+                self.queue.purge()
+                next_maintenance = now + 60
+            try:
+                claimed = self.run_once()
+            except Exception as e:
+                print(f"--- [RENDER SERVICE] ❌ Errore nel ciclo di rendering: {e} ---", flush=True)
+                claimed = 0
+            if not claimed:
+                self._stop.wait(self.poll_seconds)
+
+    def stop(self):
+        self._stop.set()
+        self._executor.shutdown(wait=False)
+
+
+_queue: Optional[RenderQueue] = None
+_queue_lock = threading.Lock()
+
+
+def get_render_queue() -> RenderQueue:
+    """Restituisce la coda di rendering condivisa dal processo."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            Base.metadata.create_all(bind=engine, tables=[RenderJob.__table__, RenderWorker.__table__])
+            _queue = RenderQueue()
+        return _queue
@@ -0,0 +1,235 @@
+"""
+Motore di layout del testo per le card generate con PIL.
+
+I font vengono caricati una sola volta per processo, le larghezze delle parole
+sono memorizzate per (font, dimensione) e la dimensione del testo viene scelta
+con una ricerca binaria, così il costo del layout cresce con il numero di parole
+distinte e non con il numero di misurazioni.
+"""
+
+import os
+import threading
+from functools import lru_cache
+from typing import List, NamedTuple, Optional
+
+try:
+    from PIL import ImageFont
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Percorso assoluto del font: non dipende dalla cartella di lavoro corrente
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates', 'fonts', 'Komika_Axis.ttf')
+
+# Oltre questa soglia la memoria delle larghezze di un font viene svuotata
+MAX_CACHED_WORDS = 50000
+
+_word_widths = {}  # (font_path, size) -> {parola: larghezza}
+_word_widths_lock = threading.Lock()
+
+
+class TextLayout(NamedTuple):
+    """Risultato del layout: font scelto, righe e altezza di riga."""
+    font: object
+    size: int
+    lines: List[str]
+    line_height: int
+    truncated: bool
+
+
+@lru_cache(maxsize=64)
+def get_font(path: str = FONT_PATH, size: int = 62):
+    """Restituisce un ImageFont condiviso dal processo per (percorso, dimensione)."""
+    return ImageFont.truetype(path, size)
+
+
+def _font_key(font) -> tuple:
+    return (getattr(font, 'path', None) or id(font), getattr(font, 'size', 0))
+
+
+def word_width(font, word: str) -> float:
+    """Larghezza (advance) di una parola, memorizzata per font e dimensione."""
+    key = _font_key(font)
+    widths = _word_widths.get(key)
+    if widths is None:
+        with _word_widths_lock:
+            widths = _word_widths.setdefault(key, {})
+    width = widths.get(word)
+    if width is None:
+        if len(widths) > MAX_CACHED_WORDS:
+            widths.clear()
+        width = font.getlength(word)
+        widths[word] = width
+    return width
+
+
+def _split_long_word(font, word: str, max_width: float) -> List[str]:
+    """Spezza una parola più larga della riga in pezzi che ci stanno."""
+    pieces = []
+    current = ""
+    for char in word:
+        if current and word_width(font, current + char) > max_width:
+            pieces.append(current)
+            current = char
+        else:
+            current += char
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def wrap_text(text: str, font, max_width: float) -> List[str]:
+    """Word wrap greedy che rispetta gli a capo espliciti del testo."""
+    space = word_width(font, " ")
+    lines = []
+    for paragraph in text.split("\n"):
+        words = paragraph.split()
+        if not words:
+            lines.append("")
+            continue
+        current = []
+        current_width = 0.0
+        for word in words:
+            width = word_width(font, word)
+            if width > max_width:
+                # Parola troppo lunga (es. "aaaaaaaa..."): va spezzata
+                if current:
+                    lines.append(" ".join(current))
+                    current, current_width = [], 0.0
+                pieces = _split_long_word(font, word, max_width)
+                lines.extend(pieces[:-1])
+                current, current_width = [pieces[-1]], word_width(font, pieces[-1])
+                continue
+            extra = width + (space if current else 0)
+            if current and current_width + extra > max_width:
+                lines.append(" ".join(current))
+                current, current_width = [word], width
+            else:
+                current.append(word)
+                current_width += extra
+        if current:
+            lines.append(" ".join(current))
+    return lines
+
+
+def fit_text(text: str, max_width: float, max_height: float, max_size: int = 62, min_size: int = 28,
+             line_spacing: float = 1.5, font_path: str = FONT_PATH, font=None) -> TextLayout:
+    """
+    Sceglie con ricerca binaria la dimensione più grande (tra min_size e max_size)
+    con cui l'intero testo sta nel riquadro. Se non ci sta nemmeno alla dimensione
+    minima, tronca l'ultima riga visibile con "…".
+
+    `font` permette di passare un font già caricato (es. fallback di sistema):
+    in quel caso la dimensione non viene cambiata.
+    """
+    def layout_for(size: int):
+        current_font = get_font(font_path, size)
+        lines = wrap_text(text, current_font, max_width)
+        return current_font, lines, int(size * line_spacing)
+
+    if font is not None and not getattr(font, 'path', None):
+        # Font bitmap di default: niente ridimensionamento possibile
+        lines = wrap_text(text, font, max_width)
+        size = getattr(font, 'size', 11)
+        return _truncate(TextLayout(font, size, lines, int(size * line_spacing), False), max_width, max_height)
+    if font is not None:
+        font_path = font.path
+
+    low, high = min_size, max_size
+    best: Optional[tuple] = None
+    while low <= high:
+        size = (low + high) // 2
+        current_font, lines, line_height = layout_for(size)
+        if len(lines) * line_height <= max_height:
+            best = (current_font, size, lines, line_height)
+            low = size + 1
+        else:
+            high = size - 1
+
+    if best:
+        current_font, size, lines, line_height = best
+        return TextLayout(current_font, size, lines, line_height, False)
+
+    current_font, lines, line_height = layout_for(min_size)
+    return _truncate(TextLayout(current_font, min_size, lines, line_height, False), max_width, max_height)
+
+
+def _truncate(layout: TextLayout, max_width: float, max_height: float) -> TextLayout:
+    """Tiene solo le righe che entrano in altezza, chiudendo l'ultima con "…"."""
+    max_lines = max(1, int(max_height // layout.line_height))
+    if len(layout.lines) <= max_lines:
+        return layout
+    lines = layout.lines[:max_lines]
+    last = lines[-1]
+    while last and word_width(layout.font, last + "…") > max_width:
+        last = last[:-1].rstrip()
+    lines[-1] = last + "…"
+    return TextLayout(layout.font, layout.size, lines, layout.line_height, True)
+
+
+# Fine frase o fine paragrafo: punti preferiti per chiudere un fotogramma
+_SENTENCE_END = ('.', '!', '?', '…', ':', ';', '"', '»', ')')
+
+
+def needs_pagination(text: str, max_width: float, max_height: float, min_size: int,
+                     line_spacing: float = 1.5, font_path: str = FONT_PATH) -> bool:
+    """True se il testo non sta in un solo riquadro nemmeno alla dimensione `min_size`."""
+    font = get_font(font_path, min_size)
+    return len(wrap_text(text, font, max_width)) * int(min_size * line_spacing) > max_height
+
+
+def paginate_text(text: str, max_width: float, max_height: float, size: int,
+                  line_spacing: float = 1.5, font_path: str = FONT_PATH, max_pages: int = None) -> List[str]:
+    """
+    Divide il testo in pagine che stanno ciascuna nel riquadro alla dimensione `size`.
+
+    Il word wrap viene fatto una sola volta sull'intero testo; una pagina piena
+    viene chiusa preferibilmente a fine paragrafo o frase, purché resti piena
+    almeno per due terzi. Ogni pagina è restituita come testo (le righe dello
+    stesso paragrafo riunite da spazi), così i renderer HTML possono
+    ridistribuirla con le proprie metriche. Con `max_pages` l'ultima pagina
+    viene troncata con "…".
+    """
+    font = get_font(font_path, size)
+    per_page = max(1, int(max_height // int(size * line_spacing)))
+
+    # Righe con il paragrafo di appartenenza e se chiudono una frase
+    lines = []
+    for index, paragraph in enumerate(text.split("\n")):
+        wrapped = wrap_text(paragraph, font, max_width)
+        for position, line in enumerate(wrapped):
+            last = position == len(wrapped) - 1
+            lines.append((index, line, last or line.rstrip().endswith(_SENTENCE_END)))
+
+    pages = []
+    start = 0
+    while start < len(lines):
+        end = min(start + per_page, len(lines))
+        if end < len(lines):
+            for candidate in range(end, start + max(1, per_page * 2 // 3) - 1, -1):
+                if lines[candidate - 1][2]:
+                    end = candidate
+                    break
+        chunk = lines[start:end]
+        # Le righe vuote a inizio e fine pagina sprecano spazio
+        while chunk and not chunk[0][1].strip():
+            chunk = chunk[1:]
+        while chunk and not chunk[-1][1].strip():
+            chunk = chunk[:-1]
+        if chunk:
+            pages.append(_join_lines(chunk))
+        start = end
+
+    if max_pages and len(pages) > max_pages:
+        last = pages[max_pages - 1].rstrip()
+        pages = pages[:max_pages - 1] + [last.rstrip(".…") + "…"]
+    return pages or [text]
+
+
+def _join_lines(lines: list) -> str:
+    parts = []
+    for i, (paragraph, line, _) in enumerate(lines):
+        if i:
+            parts.append(" " if paragraph == lines[i - 1][0] else "\n")
+        parts.append(line)
+    return "".join(parts)
@@ -0,0 +1,152 @@
+"""
+Anteprime veloci delle card per il pannello admin.
+
+Il form delle info card chiede una nuova anteprima a ogni modifica. Le
+richieste della stessa sessione admin vengono raggruppate: il render parte
+solo dopo `preview_debounce_ms` senza nuove richieste e tutte quelle in
+attesa ricevono lo stesso risultato, calcolato sull'ultimo testo inviato.
+Le anteprime sono JPEG a scala ridotta tenuti in memoria (piccola LRU):
+nessun file viene scritto su disco.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Optional
+
+from config import settings
+
+# Sessioni inattive da più di così vengono dimenticate
+SESSION_TTL_SECONDS = 600
+
+
+class _PreviewSession:
+    """Stato delle richieste di anteprima di una sessione admin."""
+
+    def __init__(self):
+        self.params = None
+        self.pending: Optional[Future] = None
+        self.last_request = 0.0
+        self.render_lock = threading.Lock()
+
+
+class PreviewService:
+    """Debounce, raggruppamento per sessione e LRU in memoria delle anteprime."""
+
+    def __init__(self, render_fn: Callable = None, debounce_ms: int = None, cache_size: int = 32):
+        self.render_fn = render_fn or self._render
+        self.debounce = (debounce_ms if debounce_ms is not None else settings.image.preview_debounce_ms) / 1000
+        self.cache_size = cache_size
+        self._cache: "OrderedDict[tuple, object]" = OrderedDict()
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._generator = None
+        self.requests = 0
+        self.renders = 0
+        self.cache_hits = 0
+        self.render_ms_total = 0.0
+
+    def _render(self, message_type: str, title: str, text: str):
+        from app.image.jobs import PRIORITY_PREVIEW, get_render_queue, renders_inline
+        if not renders_inline():
+            # Dall'app web l'anteprima la genera il servizio di rendering, prima degli altri job
+            job = get_render_queue().run(
+                "preview", {"message_type": message_type, "title": title, "text": text},
+                priority=PRIORITY_PREVIEW, deadline_seconds=settings.image.render_preview_deadline_seconds
+            )
+            from app.image.generator import PreviewImage
+            return PreviewImage(job.blob, **job.result)
+        if self._generator is None:
+            from app.image.generator import ImageGenerator
+            self._generator = ImageGenerator()
+        return self._generator.render_preview(text, 0, message_type, title)
+
+    def _cache_key(self, params: tuple) -> tuple:
+        # La versione del template fa parte della chiave: un template modificato non serve anteprime vecchie
+        from app.image.renderer import get_template_renderer
+        renderer = get_template_renderer()
+        return (renderer.template_version(renderer.template_name_for(params[0])),) + params
+
+    def request(self, session_key: str, title: str, text: str, message_type: str = "info"):
+        """Restituisce l'anteprima più recente richiesta dalla sessione."""
+        params = (message_type, title, text)
+        with self._lock:
+            self.requests += 1
+            self._prune()
+            session = self._sessions.setdefault(session_key, _PreviewSession())
+            session.params = params
+            session.last_request = time.monotonic()
+            if session.pending is None:
+                session.pending = Future()
+            future = session.pending
+
+        # Debounce: si aspetta che l'admin smetta di scrivere
+        while True:
+            with self._lock:
+                remaining = session.last_request + self.debounce - time.monotonic()
+            if remaining <= 0:
+                break
+            time.sleep(remaining)
+
+        # Un render alla volta per sessione, sempre sull'ultimo testo ricevuto;
+        # chi trova il proprio Future già preso riceve quel risultato
+        with session.render_lock:
+            with self._lock:
+                owner = session.pending is future
+                if owner:
+                    session.pending = None
+                    params = session.params
+            if owner:
+                try:
+                    future.set_result(self._render_cached(params))
+                except Exception as e:
+                    future.set_exception(e)
+        return future.result(timeout=settings.image.browser_job_timeout)
+
+    def _render_cached(self, params: tuple):
+        key = self._cache_key(params)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+        preview = self.render_fn(*params)
+        with self._lock:
+            self.renders += 1
+            self.render_ms_total += preview.ms
+            self._cache[key] = preview
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return preview
+
+    def _prune(self):
+        cutoff = time.monotonic() - SESSION_TTL_SECONDS
+        for key in [k for k, s in self._sessions.items() if s.last_request < cutoff and s.pending is None]:
+            del self._sessions[key]
+
+    def stats(self) -> dict:
+        """Richieste, render effettivi e richieste assorbite da debounce o cache."""
+        return {
+            "requests": self.requests,
+            "renders": self.renders,
+            "cache_hits": self.cache_hits,
+            "coalesced": max(0, self.requests - self.renders - self.cache_hits),
+            "avg_render_ms": round(self.render_ms_total / self.renders, 1) if self.renders else None,
+            "sessions": len(self._sessions),
+            "cached": len(self._cache),
+        }
+
+
+_service: Optional[PreviewService] = None
+_service_lock = threading.Lock()
+
+
+def get_preview_service() -> PreviewService:
+    """Restituisce il servizio di anteprima condiviso dal processo."""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = PreviewService()
+        return _service
@@ -0,0 +1,304 @@
+"""
+Renderer HTML delle card condiviso dal processo.
+
+Un solo `jinja2.Environment` precompila tutti i template di
+`app/image/templates` all'avvio, con una bytecode cache su disco che
+sopravvive ai riavvii. Il font Komika Axis viene letto una volta sola e
+inserito nei template come data URI base64, così il browser non tocca il
+filesystem a ogni render.
+
+Un watcher a polling controlla la cartella dei template (fonts/ compresa):
+quando un file cambia l'Environment viene ricostruito e ricompilato in
+parallelo e poi sostituito in un colpo solo, così i render in corso finiscono
+con la versione che avevano già. Ogni template ha una versione (hash del
+sorgente, dei template che include e dei font) che entra nelle chiavi di cache.
+Il template attivo si cambia a runtime e la scelta viene condivisa tra
+processi (web e worker) tramite un file nella cartella di output.
+"""
+
+import base64
+import glob
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+from typing import List, NamedTuple, Optional
+
+import jinja2
+from jinja2 import meta
+
+from config import settings
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+FONTS_DIR = os.path.join(TEMPLATES_DIR, 'fonts')
+FONT_FILE = os.path.join(FONTS_DIR, 'Komika_Axis.ttf')
+INFO_TEMPLATE = "card_info.html"
+# Template attivo scelto dall'admin, letto da tutti i processi
+ACTIVE_TEMPLATE_FILE = ".active_template"
+
+
+class _RendererState(NamedTuple):
+    """Environment, font e versioni dei template: sostituiti insieme a ogni reload."""
+    env: jinja2.Environment
+    font_url: str
+    versions: dict
+
+
+def _font_data_uri(path: str) -> str:
+    """Legge il font una volta e lo restituisce come data URI base64."""
+    with open(path, 'rb') as f:
+        encoded = base64.b64encode(f.read()).decode('ascii')
+    return f"data:font/ttf;base64,{encoded}"
+
+
+def _strftime(value, fmt: str) -> str:
+    """Filtro Jinja: formatta una data; "now" indica il momento del render."""
+    if value == "now":
+        value = datetime.now()
+    return value.strftime(fmt)
+
+
+class TemplateRenderer:
+    """Environment Jinja2 unico, con template precompilati, font inline e hot-reload."""
+
+    def __init__(self, templates_dir: str = TEMPLATES_DIR, bytecode_dir: str = None, active_file: str = None):
+        self.templates_dir = templates_dir
+        self.fonts_dir = os.path.join(templates_dir, 'fonts')
+        self.bytecode_dir = bytecode_dir or os.path.join(settings.image.output_folder, ".jinja_cache")
+        self.active_file = active_file or os.path.join(settings.image.output_folder, ACTIVE_TEMPLATE_FILE)
+        os.makedirs(self.bytecode_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher: Optional[threading.Thread] = None
+        self.reloads = 0
+        self.last_reload: Optional[str] = None
+        self._state = self._build_state()
+        self._snapshot = self._scan()
+        self._apply_active_file()
+
+    @property
+    def env(self) -> jinja2.Environment:
+        return self._state.env
+
+    @property
+    def font_url(self) -> str:
+        return self._state.font_url
+
+    def _build_state(self) -> _RendererState:
+        env = jinja2.Environment(
+            loader=jinja2.FileSystemLoader(searchpath=self.templates_dir),
+            bytecode_cache=jinja2.FileSystemBytecodeCache(self.bytecode_dir),
+            # Nessuno stat a ogni render: i cambiamenti li rileva il watcher
+            auto_reload=False,
+        )
+        # {{ "now"|strftime("%d/%m/%Y") }} usato da card_info.html
+        env.filters['strftime'] = _strftime
+        font_file = os.path.join(self.fonts_dir, os.path.basename(FONT_FILE))
+        font_url = _font_data_uri(font_file) if os.path.exists(font_file) else ""
+        return _RendererState(env, font_url, self._compute_versions(env))
+
+    def _compute_versions(self, env: jinja2.Environment) -> dict:
+        """Versione di ogni template: hash del sorgente, dei template inclusi e dei font."""
+        fonts = hashlib.sha256()
+        for path in sorted(glob.glob(os.path.join(self.fonts_dir, '*'))):
+            with open(path, 'rb') as f:
+                fonts.update(os.path.basename(path).encode() + f.read())
+
+        sources, dependencies = {}, {}
+        for path in glob.glob(os.path.join(self.templates_dir, '*.html')):
+            name = os.path.basename(path)
+            with open(path, 'rb') as f:
+                sources[name] = f.read()
+            try:
+                referenced = meta.find_referenced_templates(env.parse(sources[name].decode('utf-8')))
+                dependencies[name] = sorted(ref for ref in referenced if ref)
+            except jinja2.TemplateError:
+                dependencies[name] = []
+
+        versions = {}
+
+        def version(name: str, visiting: frozenset) -> str:
+            if name in versions:
+                return versions[name]
+            digest = hashlib.sha256(sources.get(name, b'') + fonts.digest())
+            for dep in dependencies.get(name, []):
+                if dep not in visiting:
+                    digest.update(version(dep, visiting | {name}).encode())
+            versions[name] = digest.hexdigest()[:16]
+            return versions[name]
+
+        for name in sources:
+            version(name, frozenset())
+        return versions
+
+    def precompile(self, env: jinja2.Environment = None) -> int:
+        """Compila tutti i template *.html e restituisce quanti ne sono stati caricati."""
+        env = env or self.env
+        started = time.perf_counter()
+        compiled = 0
+        for path in sorted(glob.glob(os.path.join(self.templates_dir, '*.html'))):
+            try:
+                env.get_template(os.path.basename(path))
+                compiled += 1
+            except jinja2.TemplateError as e:
+                print(f"⚠️ Template {os.path.basename(path)} non compilato: {e}")
+        print(f"🧩 {compiled} template precompilati in {time.perf_counter() - started:.3f}s")
+        return compiled
+
+    # --- Hot-reload ---
+
+    def _scan(self) -> dict:
+        """mtime e dimensione di template, font e file del template attivo."""
+        paths = glob.glob(os.path.join(self.templates_dir, '*.html')) + glob.glob(os.path.join(self.fonts_dir, '*'))
+        paths.append(self.active_file)
+        snapshot = {}
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            snapshot[path] = (stat.st_mtime_ns, stat.st_size)
+        return snapshot
+
+    def check_for_changes(self) -> List[str]:
+        """
+        Confronta la cartella con l'ultimo controllo: ricompila se un template
+        o un font è cambiato e applica un nuovo template attivo. Restituisce i
+        file cambiati.
+        """
+        with self._lock:
+            snapshot = self._scan()
+            changed = sorted(path for path in set(snapshot) | set(self._snapshot)
+                             if snapshot.get(path) != self._snapshot.get(path))
+            self._snapshot = snapshot
+        if not changed:
+            return []
+
+        if any(path != self.active_file for path in changed):
+            started = time.perf_counter()
+            state = self._build_state()
+            self.precompile(state.env)
+            bumped = sorted(name for name, v in state.versions.items() if self._state.versions.get(name) != v)
+            # Sostituzione atomica: i render già partiti usano ancora il vecchio stato
+            self._state = state
+            self.reloads += 1
+            self.last_reload = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            print(f"🔄 Template ricaricati in {time.perf_counter() - started:.3f}s, nuove versioni: {', '.join(bumped) or 'nessuna'}")
+        if self.active_file in changed:
+            self._apply_active_file()
+        return [os.path.relpath(path, self.templates_dir) if path != self.active_file else ACTIVE_TEMPLATE_FILE for path in changed]
+
+    def start_watching(self, interval: float = None):
+        """Avvia il watcher a polling in un thread daemon (una volta per processo)."""
+        if self._watcher and self._watcher.is_alive():
+            return
+        interval = interval or settings.image.template_poll_seconds
+        self._stop.clear()
+
+        def _watch():
+            while not self._stop.wait(interval):
+                try:
+                    self.check_for_changes()
+                except Exception as e:
+                    print(f"⚠️ [Templates] Controllo dei template fallito: {e}")
+
+        self._watcher = threading.Thread(target=_watch, name="template-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+
+    # --- Template attivo ---
+
+    @property
+    def active_template(self) -> str:
+        return os.path.basename(settings.image.template_path)
+
+    def set_active_template(self, name: str, persist: bool = True):
+        """
+        Cambia il template delle card spotted. I render in corso terminano con
+        il template precedente; con persist=True la scelta arriva anche agli
+        altri processi e sopravvive ai riavvii.
+        """
+        if name == INFO_TEMPLATE:
+            raise ValueError(f"{INFO_TEMPLATE} è riservato alle info card")
+        if name not in self._state.versions:
+            raise ValueError(f"Template sconosciuto: {name}")
+        # Solo template che compilano: un errore di sintassi non arriva in produzione
+        self.env.get_template(name)
+
+        with self._lock:
+            settings.image.template_path = os.path.join(self.templates_dir, name)
+            if persist:
+                tmp_path = f"{self.active_file}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(name)
+                os.replace(tmp_path, self.active_file)
+                stat = os.stat(self.active_file)
+                self._snapshot[self.active_file] = (stat.st_mtime_ns, stat.st_size)
+        print(f"🎨 [Templates] Template attivo: {name}")
+
+    def _apply_active_file(self):
+        """Applica il template scelto da un altro processo (o prima del riavvio)."""
+        try:
+            with open(self.active_file, encoding='utf-8') as f:
+                name = f.read().strip()
+        except OSError:
+            return
+        if name and name != self.active_template:
+            try:
+                self.set_active_template(name, persist=False)
+            except (ValueError, jinja2.TemplateError) as e:
+                print(f"⚠️ [Templates] Template attivo {name} ignorato: {e}")
+
+    def template_version(self, name: str) -> str:
+        """Versione corrente del template (cambia con il sorgente, gli include e i font)."""
+        return self._state.versions.get(name, "")
+
+    def templates(self) -> List[dict]:
+        """Template disponibili con versione e stato."""
+        return [
+            {
+                "name": name,
+                "version": version,
+                "active": name == self.active_template,
+                "info": name == INFO_TEMPLATE,
+            }
+            for name, version in sorted(self._state.versions.items())
+        ]
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active_template,
+            "reloads": self.reloads,
+            "last_reload": self.last_reload,
+            "watching": bool(self._watcher and self._watcher.is_alive() and not self._stop.is_set()),
+        }
+
+    def template_name_for(self, message_type: str) -> str:
+        """Nome del template da usare per il tipo di messaggio."""
+        if message_type == "info":
+            return INFO_TEMPLATE
+        return self.active_template
+
+    def render(self, message_text: str, message_id: int, message_type: str = "spotted", title: str = None) -> str:
+        """Renderizza l'HTML della card con il font già inline."""
+        # Una sola lettura dello stato: environment e font della stessa versione
+        state = self._state
+        template = state.env.get_template(self.template_name_for(message_type))
+        return template.render(message=message_text, id=message_id, font_url=state.font_url, title=title)
+
+
+_renderer: Optional[TemplateRenderer] = None
+_renderer_lock = threading.Lock()
+
+
+def get_template_renderer() -> TemplateRenderer:
+    """Restituisce il renderer condiviso, precompilando i template alla prima richiesta."""
+    global _renderer
+    with _renderer_lock:
+        if _renderer is None:
+            _renderer = TemplateRenderer()
+            _renderer.precompile()
+        return _renderer
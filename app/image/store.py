@@ -0,0 +1,381 @@
+"""
+Archivio delle immagini generate.
+
+Ogni immagine viene salvata con l'sha256 del contenuto come nome, in una
+struttura a due livelli (`assets/ab/cd/abcd….png`): i file identici esistono
+una volta sola e nessuna directory cresce fino a rallentare i listing. L'indice
+nel database (ImageAsset/ImageAssetRef) lega le immagini ai messaggi che le
+usano; un'immagine senza riferimenti è eliminabile.
+
+Il garbage collector applica le politiche di retention: anteprime scadute,
+card di storie pubblicate da più di N giorni, riferimenti di messaggi
+modificati, rifiutati o eliminati, file orfani e vecchi file sciolti nella
+cartella di output.
+"""
+
+import hashlib
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta
+from typing import Iterable, NamedTuple, Optional
+
+from sqlalchemy import func
+
+from config import settings
+from app.database import Base, ImageAsset, ImageAssetRef, MessageStatus, SessionLocal, SpottedMessage, engine
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+class StoredAsset(NamedTuple):
+    """Immagine archiviata: percorso, hash del contenuto e dimensione."""
+    path: str
+    sha256: str
+    size_bytes: int
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _reclaimable_size(path: str) -> int:
+    """Byte liberati eliminando il file: zero se è un hard link condiviso con la cache."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return 0
+    return stat.st_size if stat.st_nlink <= 1 else 0
+
+
+def _link_or_copy(source_path: str, path: str):
+    """Hard link (nessun byte in più su disco), copia se il filesystem non lo supporta."""
+    try:
+        os.link(source_path, path)
+    except FileExistsError:
+        pass
+    except OSError:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, path)
+
+
+class AssetStore:
+    """Archivio content-addressed con indice nel database e garbage collection."""
+
+    def __init__(self, root: str = None, session_factory=None):
+        self.root = root or os.path.join(settings.image.output_folder, "assets")
+        self.output_folder = os.path.dirname(os.path.abspath(self.root))
+        self.session_factory = session_factory or SessionLocal
+        self.last_gc: Optional[dict] = None
+        self.last_scan: Optional[dict] = None
+        self._gc_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def path_for(self, sha256: str, extension: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], f"{sha256}{extension}")
+
+    def _is_cache_file(self, path: str) -> bool:
+        cache_dir = os.path.abspath(os.path.join(settings.image.output_folder, "cache"))
+        return os.path.dirname(os.path.abspath(path)) == cache_dir
+
+    def put(self, source_path: str, kind: str, message_ids: Iterable[int] = (), role: str = None,
+            keep_source: bool = None) -> StoredAsset:
+        """
+        Archivia un'immagine appena generata e la collega ai messaggi indicati.
+
+        Il file viene spostato nell'archivio; quelli della cache dei render
+        restano al loro posto e vengono collegati con un hard link. Se lo
+        stesso contenuto è già archiviato il nuovo file viene scartato.
+        """
+        if keep_source is None:
+            keep_source = self._is_cache_file(source_path)
+        digest = file_sha256(source_path)
+        extension = os.path.splitext(source_path)[1].lower() or ".png"
+        path = self.path_for(digest, extension)
+
+        if os.path.abspath(source_path) != os.path.abspath(path):
+            if os.path.exists(path):
+                if not keep_source:
+                    os.remove(source_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if keep_source:
+                    _link_or_copy(source_path, path)
+                else:
+                    os.replace(source_path, path)
+
+        asset = StoredAsset(path, digest, os.path.getsize(path))
+        self._index(asset, kind, message_ids, role or kind)
+        return asset
+
+    def _index(self, asset: StoredAsset, kind: str, message_ids: Iterable[int], role: str):
+        db = self.session_factory()
+        try:
+            row = db.get(ImageAsset, asset.sha256)
+            if row is None:
+                row = ImageAsset(sha256=asset.sha256, path=asset.path, kind=kind, size_bytes=asset.size_bytes)
+                db.add(row)
+            else:
+                row.path = asset.path
+                row.last_used_at = datetime.utcnow()
+            existing = {(ref.message_id, ref.role) for ref in row.refs}
+            for message_id in set(message_ids):
+                if (message_id, role) not in existing:
+                    row.refs.append(ImageAssetRef(message_id=message_id, role=role))
+            db.commit()
+        except Exception as e:
+            # Il file è comunque archiviato: il GC lo reindicizza dalle card dei messaggi
+            db.rollback()
+            print(f"⚠️ [Assets] Indicizzazione di {asset.path} fallita: {e}")
+        finally:
+            db.close()
+
+    def release(self, message_id: int, role: str = None) -> int:
+        """Rimuove i riferimenti di un messaggio (es. eliminato). Restituisce quanti."""
+        db = self.session_factory()
+        try:
+            query = db.query(ImageAssetRef).filter(ImageAssetRef.message_id == message_id)
+            if role:
+                query = query.filter(ImageAssetRef.role == role)
+            count = query.delete(synchronize_session=False)
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    # --- Garbage collection ---
+
+    def gc(self, dry_run: bool = False, now: datetime = None) -> dict:
+        """
+        Applica le politiche di retention e elimina le immagini non più referenziate.
+        Con dry_run=True calcola solo cosa verrebbe eliminato (byte recuperabili).
+        """
+        with self._gc_lock:
+            report = self._collect(dry_run, now or datetime.utcnow())
+        if not dry_run:
+            self.last_gc = report
+            freed_mb = report["bytes_reclaimed"] / (1024 * 1024)
+            print(f"🧹 [Assets] GC completato: {sum(report['deleted'].values())} file eliminati, {freed_mb:.1f} MB liberati")
+        return report
+
+    def _collect(self, dry_run: bool, now: datetime) -> dict:
+        posted_cutoff = now - timedelta(days=settings.image.asset_posted_retention_days)
+        preview_cutoff = now - timedelta(hours=settings.image.asset_preview_retention_hours)
+        orphan_cutoff = now - timedelta(hours=settings.image.asset_orphan_grace_hours)
+        report = {
+            "dry_run": dry_run,
+            "at": now.strftime("%Y-%m-%d %H:%M:%S"),
+            "refs_dropped": {"stale": 0, "posted": 0, "expired": 0},
+            "deleted": {"preview": 0, "orphan": 0, "stray": 0, "legacy": 0},
+            "reindexed": 0,
+            "bytes_reclaimed": 0,
+        }
+
+        db = self.session_factory()
+        try:
+            messages = {
+                m.id: m for m in db.query(
+                    SpottedMessage.id, SpottedMessage.status, SpottedMessage.posted_at,
+                    SpottedMessage.card_hash, SpottedMessage.card_path,
+                )
+            }
+
+            # Card ancora in uso: mai eliminate, anche se l'indice non le collega
+            live_cards = {
+                m.card_hash for m in messages.values()
+                if m.card_hash and m.status != MessageStatus.REJECTED
+                and not (m.status == MessageStatus.POSTED and m.posted_at and m.posted_at < posted_cutoff)
+            }
+
+            # 1. Riferimenti: messaggi eliminati, rifiutati o con una card diversa,
+            #    storie pubblicate e collage oltre la retention
+            dropped = set()
+            for ref in db.query(ImageAssetRef):
+                message = messages.get(ref.message_id)
+                if ref.role == "card":
+                    if message is None or message.status == MessageStatus.REJECTED or message.card_hash != ref.asset_sha256:
+                        reason = "stale"
+                    elif message.status == MessageStatus.POSTED and message.posted_at and message.posted_at < posted_cutoff:
+                        reason = "posted"
+                    else:
+                        continue
+                elif ref.created_at and ref.created_at < posted_cutoff:
+                    reason = "expired"
+                else:
+                    continue
+                report["refs_dropped"][reason] += 1
+                dropped.add(ref.id)
+                if not dry_run:
+                    db.delete(ref)
+
+            # 2. Immagini senza riferimenti vivi: anteprime scadute e orfani
+            indexed = set()
+            for asset in db.query(ImageAsset):
+                indexed.add(asset.sha256)
+                if asset.sha256 in live_cards or any(ref.id not in dropped for ref in asset.refs):
+                    continue
+                last_used = asset.last_used_at or asset.created_at or now
+                if asset.kind == "preview":
+                    if last_used >= preview_cutoff:
+                        continue
+                    category = "preview"
+                elif last_used < orphan_cutoff:
+                    category = "orphan"
+                else:
+                    continue
+                report["deleted"][category] += 1
+                report["bytes_reclaimed"] += _reclaimable_size(asset.path)
+                if not dry_run:
+                    self._remove(asset.path)
+                    db.delete(asset)
+
+            # 3. File nell'archivio senza indice: reindicizzati se sono la card di
+            #    un messaggio, altrimenti eliminati dopo il periodo di grazia
+            card_owners = {m.card_hash: m.id for m in messages.values() if m.card_hash}
+            for path in self._walk(self.root):
+                digest = os.path.splitext(os.path.basename(path))[0]
+                if digest in indexed:
+                    continue
+                if digest in card_owners:
+                    report["reindexed"] += 1
+                    if not dry_run:
+                        asset = ImageAsset(sha256=digest, path=path, kind="card", size_bytes=os.path.getsize(path))
+                        asset.refs.append(ImageAssetRef(message_id=card_owners[digest], role="card"))
+                        db.add(asset)
+                    continue
+                if self._mtime(path) < orphan_cutoff:
+                    report["deleted"]["stray"] += 1
+                    report["bytes_reclaimed"] += _reclaimable_size(path)
+                    if not dry_run:
+                        self._remove(path)
+
+            # 4. File sciolti nella cartella di output (render precedenti all'archivio)
+            card_paths = {os.path.abspath(m.card_path) for m in messages.values() if m.card_path}
+            for path in self._legacy_files():
+                if os.path.abspath(path) in card_paths or self._mtime(path) >= orphan_cutoff:
+                    continue
+                report["deleted"]["legacy"] += 1
+                report["bytes_reclaimed"] += _reclaimable_size(path)
+                if not dry_run:
+                    self._remove(path)
+
+            if not dry_run:
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        return report
+
+    @staticmethod
+    def _walk(root: str):
+        for directory, _, files in os.walk(root):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(directory, name)
+
+    def _legacy_files(self):
+        try:
+            entries = list(os.scandir(self.output_folder))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                yield entry.path
+
+    @staticmethod
+    def _mtime(path: str) -> datetime:
+        try:
+            return datetime.utcfromtimestamp(os.path.getmtime(path))
+        except OSError:
+            return datetime.utcnow()
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    # --- Statistiche ---
+
+    def stats(self, scan: bool = False) -> dict:
+        """
+        Spazio occupato per tipo e riferimenti, con query sugli indici. Lo spazio
+        su disco e i byte recuperabili richiedono una scansione completa (un GC
+        simulato): si calcolano solo con scan=True, altrimenti si riporta
+        l'ultima scansione.
+        """
+        db = self.session_factory()
+        try:
+            by_kind, total_bytes, assets = {}, 0, 0
+            for kind, count, size in db.query(
+                ImageAsset.kind, func.count(ImageAsset.sha256), func.coalesce(func.sum(ImageAsset.size_bytes), 0)
+            ).group_by(ImageAsset.kind):
+                by_kind[kind] = {"assets": count, "bytes": size}
+                total_bytes += size
+                assets += count
+            referenced = db.query(func.count(func.distinct(ImageAssetRef.asset_sha256))).scalar()
+            refs = db.query(func.count(ImageAssetRef.id)).scalar()
+        finally:
+            db.close()
+
+        if scan:
+            self.last_scan = self._scan()
+        return {
+            "root": self.root,
+            "assets": assets,
+            "bytes": total_bytes,
+            "by_kind": by_kind,
+            "referenced": referenced,
+            "unreferenced": assets - referenced,
+            "refs": refs,
+            "last_scan": self.last_scan,
+            "last_gc": self.last_gc,
+        }
+
+    def _scan(self) -> dict:
+        """Spazio reale della cartella di output e cosa eliminerebbe un GC adesso."""
+        # Gli hard link si contano una volta
+        seen, disk_bytes, files = set(), 0, 0
+        for directory, _, names in os.walk(self.output_folder):
+            for name in names:
+                try:
+                    stat = os.stat(os.path.join(directory, name))
+                except OSError:
+                    continue
+                files += 1
+                if (stat.st_dev, stat.st_ino) not in seen:
+                    seen.add((stat.st_dev, stat.st_ino))
+                    disk_bytes += stat.st_size
+
+        pending = self.gc(dry_run=True)
+        return {
+            "at": datetime.utcnow().isoformat(),
+            "disk_bytes": disk_bytes,
+            "files_on_disk": files,
+            "reclaimable_bytes": pending["bytes_reclaimed"],
+            "reclaimable_files": pending["deleted"],
+        }
+
+
+_store: Optional[AssetStore] = None
+_store_lock = threading.Lock()
+
+
+def get_asset_store() -> AssetStore:
+    """Restituisce l'archivio delle immagini condiviso dal processo."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            # Le tabelle dell'indice esistono anche se il processo (es. worker.py)
+            # non passa da create_db_and_tables
+            Base.metadata.create_all(bind=engine, tables=[ImageAsset.__table__, ImageAssetRef.__table__])
+            _store = AssetStore()
+        return _store
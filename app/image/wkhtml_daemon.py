@@ -0,0 +1,263 @@
+"""
+Demone di rendering wkhtmltoimage.
+
+Invece di chiamare `imgkit.from_string` (un fork bloccante per card, con
+errori riconosciuti cercando "glibc" nel messaggio), il demone possiede un
+piccolo insieme di worker di lunga durata alimentati da una coda limitata.
+Ogni worker passa l'HTML al renderer tramite pipe (stdin → PNG su stdout),
+lo uccide se supera il timeout del job e viene riavviato se muore. Il binario
+viene verificato una volta all'avvio: se non parte, il demone lo segnala con
+`WkhtmlUnavailable` senza dover interpretare il testo degli errori.
+"""
+
+import atexit
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Optional
+
+from config import settings
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+COMMON_PATHS = [
+    '/usr/bin/wkhtmltoimage',
+    '/usr/local/bin/wkhtmltoimage',
+    '/bin/wkhtmltoimage'
+]
+
+
+class WkhtmlRenderError(RuntimeError):
+    """Il renderer non ha prodotto un PNG valido."""
+
+
+class WkhtmlTimeout(WkhtmlRenderError):
+    """Il renderer ha superato il timeout del job ed è stato terminato."""
+
+
+class WkhtmlUnavailable(WkhtmlRenderError):
+    """Il binario wkhtmltoimage non esiste o non si avvia su questo sistema."""
+
+
+def find_wkhtmltoimage() -> Optional[str]:
+    """Cerca il binario wkhtmltoimage (Windows, PATH e percorsi comuni)."""
+    if os.name == 'nt':
+        path = r'C:\Program Files\wkhtmltopdf\bin\wkhtmltoimage.exe'
+        return path if os.path.exists(path) else None
+    path = shutil.which('wkhtmltoimage')
+    if path:
+        return path
+    for path in COMMON_PATHS:
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _options_to_args(options: dict) -> list:
+    """Converte le opzioni in stile imgkit in argomenti della riga di comando."""
+    args = []
+    for name, value in (options or {}).items():
+        args.append(f"--{name}")
+        if value not in (None, ''):
+            args.append(str(value))
+    return args
+
+
+class _WkhtmlWorker(threading.Thread):
+    """Worker che esegue i job del demone, un renderer alla volta."""
+
+    def __init__(self, daemon: "WkhtmlDaemon", index: int):
+        super().__init__(name=f"wkhtml-worker-{index}", daemon=True)
+        self.owner = daemon
+        self.index = index
+        self.process: Optional[subprocess.Popen] = None
+        self.renders = 0
+
+    def run(self):
+        while not self.owner._stopping.is_set():
+            try:
+                job = self.owner._jobs.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if job is None:
+                break
+
+            html, options, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._render(html, options))
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                self.renders += 1
+
+    def _render(self, html: str, options: dict) -> bytes:
+        args = [self.owner.binary] + _options_to_args(options) + ['--format', 'png', '-', '-']
+        started = time.perf_counter()
+        self.process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            output, errors = self.process.communicate(html.encode('utf-8'), timeout=self.owner.job_timeout)
+        except subprocess.TimeoutExpired:
+            # Renderer bloccato: lo terminiamo, il worker resta libero per il job successivo
+            self.process.kill()
+            self.process.communicate()
+            self.owner._record('timeouts')
+            raise WkhtmlTimeout(f"wkhtmltoimage oltre {self.owner.job_timeout}s, terminato")
+        finally:
+            returncode = self.process.returncode
+            self.process = None
+
+        if returncode is not None and returncode < 0:
+            self.owner._record('crashes')
+        # wkhtmltoimage può uscire con 1 per risorse secondarie mancanti pur
+        # avendo prodotto l'immagine: conta solo la presenza di un PNG valido
+        if not output.startswith(PNG_SIGNATURE):
+            self.owner._record('failures')
+            detail = errors.decode('utf-8', 'replace').strip()[-300:]
+            raise WkhtmlRenderError(f"wkhtmltoimage exit {returncode}: {detail}")
+        self.owner._record_latency(time.perf_counter() - started)
+        return output
+
+    def kill(self):
+        process = self.process
+        if process is not None:
+            try:
+                process.kill()
+            except Exception:
+                pass
+
+
+class WkhtmlDaemon:
+    """
+    Server di rendering con N worker di lunga durata, coda limitata,
+    timeout per job e riavvio automatico dei worker morti.
+    """
+
+    def __init__(self, binary: str = None, workers: int = None, job_timeout: float = None,
+                 queue_size: int = None):
+        self.binary = binary or find_wkhtmltoimage()
+        self.size = workers or settings.image.wkhtml_workers
+        self.job_timeout = job_timeout or settings.image.wkhtml_job_timeout
+        self._jobs: "queue.Queue" = queue.Queue(maxsize=queue_size or settings.image.wkhtml_queue_size)
+        self._stopping = threading.Event()
+        self._workers = []
+        self._lock = threading.Lock()
+        self.available: Optional[bool] = None
+        self.unavailable_reason: Optional[str] = None
+        self.counters = {'renders': 0, 'failures': 0, 'timeouts': 0, 'crashes': 0, 'restarts': 0}
+        self._total_seconds = 0.0
+
+    def _probe(self):
+        """Verifica una volta che il binario si avvii (librerie, architettura, permessi)."""
+        if not self.binary:
+            self.available, self.unavailable_reason = False, "binario non trovato"
+            return
+        try:
+            result = subprocess.run([self.binary, '--version'], capture_output=True, timeout=15)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            self.available, self.unavailable_reason = False, str(e)
+            return
+        if result.returncode != 0:
+            self.available = False
+            self.unavailable_reason = result.stderr.decode('utf-8', 'replace').strip()[-300:] or f"exit {result.returncode}"
+            return
+        self.available = True
+
+    def start(self):
+        """Verifica il binario e avvia (o riavvia) i worker mancanti."""
+        with self._lock:
+            if self.available is None:
+                self._probe()
+                if self.available:
+                    print(f"🖨️ [WkhtmlDaemon] {self.binary} pronto con {self.size} worker")
+                else:
+                    print(f"⚠️ [WkhtmlDaemon] wkhtmltoimage non utilizzabile: {self.unavailable_reason}")
+            if not self.available:
+                return
+            self._stopping.clear()
+            for index in range(self.size):
+                if index < len(self._workers):
+                    if self._workers[index].is_alive():
+                        continue
+                    self.counters['restarts'] += 1
+                    print(f"🔁 [WkhtmlDaemon] Worker {index} riavviato")
+                    worker = _WkhtmlWorker(self, index)
+                    self._workers[index] = worker
+                else:
+                    worker = _WkhtmlWorker(self, index)
+                    self._workers.append(worker)
+                worker.start()
+
+    def _record(self, counter: str):
+        with self._lock:
+            self.counters[counter] += 1
+
+    def _record_latency(self, seconds: float):
+        with self._lock:
+            self.counters['renders'] += 1
+            self._total_seconds += seconds
+
+    def submit(self, html: str, options: dict = None) -> Future:
+        """Accoda un render e restituisce un Future con i byte PNG."""
+        self.start()
+        if not self.available:
+            raise WkhtmlUnavailable(self.unavailable_reason or "wkhtmltoimage non disponibile")
+        future: Future = Future()
+        try:
+            self._jobs.put((html, options or {}, future), timeout=5.0)
+        except queue.Full:
+            raise WkhtmlRenderError(f"Coda del demone wkhtmltoimage piena ({self._jobs.maxsize} job)")
+        return future
+
+    def render(self, html: str, options: dict = None, timeout: float = None) -> bytes:
+        """Renderizza l'HTML in PNG senza bloccare il chiamante oltre il timeout."""
+        future = self.submit(html, options)
+        try:
+            # Margine per l'attesa in coda oltre al timeout del renderer
+            return future.result(timeout=timeout or self.job_timeout * 2)
+        except FutureTimeout:
+            future.cancel()
+            raise WkhtmlTimeout("Render wkhtmltoimage non completato in tempo")
+
+    def stats(self) -> dict:
+        """Statistiche del demone per dashboard e log."""
+        renders = self.counters['renders']
+        return {
+            "binary": self.binary,
+            "available": self.available,
+            "unavailable_reason": self.unavailable_reason,
+            "workers": self.size,
+            "alive": sum(1 for worker in self._workers if worker.is_alive()),
+            "queued": self._jobs.qsize(),
+            **self.counters,
+            "avg_render_ms": round(self._total_seconds / renders * 1000, 1) if renders else 0.0,
+        }
+
+    def shutdown(self):
+        """Ferma i worker e termina eventuali renderer ancora in esecuzione."""
+        self._stopping.set()
+        for worker in self._workers:
+            worker.kill()
+        for worker in self._workers:
+            worker.join(timeout=5)
+        with self._lock:
+            self._workers = []
+
+
+_daemon: Optional[WkhtmlDaemon] = None
+_daemon_lock = threading.Lock()
+
+
+def get_wkhtml_daemon() -> WkhtmlDaemon:
+    """Restituisce il demone wkhtmltoimage condiviso dal processo."""
+    global _daemon
+    with _daemon_lock:
+        if _daemon is None:
+            _daemon = WkhtmlDaemon()
+            atexit.register(_daemon.shutdown)
+        return _daemon
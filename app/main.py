@@ -202,6 +202,23 @@ async def daily_post_scheduler():
         # Controlla ogni minuto
         await asyncio.sleep(60)
 
+async def asset_gc_scheduler():
+    """Task in background che applica periodicamente la retention delle immagini generate."""
+    from config import settings
+    from app.image.store import get_asset_store
+
+    await asyncio.sleep(300)  # Attendi 5 minuti dopo l'avvio
+    interval = settings.image.asset_gc_interval_minutes * 60
+
+    while True:
+        try:
+            report = await asyncio.get_event_loop().run_in_executor(None, get_asset_store().gc)
+            logger.info(f"🧹 GC immagini: {report['deleted']}, {report['bytes_reclaimed']} byte liberati")
+        except Exception as e:
+            logger.error(f"❌ Errore nel GC delle immagini: {e}")
+
+        await asyncio.sleep(interval)
+
 # --- Eventi di Avvio e Spegnimento ---
 
 def check_and_install_wkhtmltopdf():
@@ -261,6 +278,26 @@ async def on_startup():
     
     # Verifica e installa wkhtmltopdf se necessario
     check_and_install_wkhtmltopdf()
+
+    # Precompila i template delle card (con font inline) una volta sola e
+    # ricompila solo quelli modificati su disco
+    from app.image.renderer import get_template_renderer
+    get_template_renderer().start_watching()
+
+    from app.image.jobs import get_render_queue, renders_inline
+    if renders_inline():
+        # Verifica i backend di rendering con un render canary (in background):
+        # avvia il demone wkhtmltoimage e, solo se serve, il pool Chromium
+        from app.image.backends import probe_render_backends
+        probe_render_backends()
+        logger.info("🧭 Verifica dei backend di rendering avviata")
+    else:
+        # Le card le genera render_service.py: qui si accodano soltanto i job
+        queue = get_render_queue()
+        if not queue.live_workers():
+            logger.warning(f"⚠ Nessun servizio di rendering attivo: {queue.depth()} job in coda attendono render_service.py")
+        else:
+            logger.info("🖼️ Servizio di rendering attivo")
     
     # Avvia i task in background
     asyncio.create_task(keep_alive_task())
@@ -269,6 +306,15 @@ async def on_startup():
     asyncio.create_task(daily_post_scheduler())
     logger.info("📅 Daily post scheduler avviato - controlla ogni minuto")
 
+    asyncio.create_task(asset_gc_scheduler())
+    logger.info("🧹 GC delle immagini generate avviato")
+
+    from config import settings
+    if settings.moderation.service_enabled:
+        from app.ai.service import get_moderation_service
+        asyncio.create_task(get_moderation_service().run())
+        logger.info(f"🛡️ Servizio di moderazione AI avviato ({settings.moderation.gemini_rpm} richieste/min)")
+
 # --- Inclusione delle Rotte ---
 
 app.include_router(web_routes.router)
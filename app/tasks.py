@@ -1,8 +1,20 @@
-from app.ai.gemini_moderator import GeminiModerator, ModerationResult
+import json
+from app.ai.batching import get_moderation_batcher
+from app.ai.cache import CACHE_MARKER, get_moderation_cache
+from app.ai.gemini_moderator import ModerationResult, is_quota_error
+from app.ai.prefilter import get_prefilter
+from app.ai.service import QUEUED_ANALYSIS, get_moderation_service
 from sqlalchemy.orm import Session
 from datetime import datetime
-from app.database import SessionLocal, SpottedMessage, MessageStatus, get_daily_post_settings, get_todays_messages, mark_daily_post_run
+from typing import List, Optional
+from app.database import SessionLocal, SpottedMessage, MessageStatus, DailyPostStyle, get_daily_post_settings, get_todays_messages, mark_daily_post_run
+from app.image.dedup import HASH_SIZE, DuplicateIndex, get_duplicate_index, image_phash
 from app.image.generator import ImageGenerator
+from app.image.jobs import PRIORITY_INTERACTIVE, RenderJobError, RenderQueueFull, get_render_queue, renders_inline
+from app.image.renderer import get_template_renderer
+from app.image.store import file_sha256, get_asset_store
+from app.text_fingerprint import TEXT_BITS, from_hex, text_fingerprint, to_hex
+from config import settings
 
 # Import InstagramBot come condizionale
 try:
@@ -12,13 +24,307 @@ except ImportError:
     INSTAGRAM_BOT_AVAILABLE = False
     InstagramBot = None
 
+# --- Pre-render delle card ---
+
+def _card_message_type(message: SpottedMessage) -> str:
+    return message.message_type.value if message.message_type else "spotted"
+
+def _current_template_version(message: SpottedMessage) -> str:
+    """Versione del template con cui la card del messaggio verrebbe generata ora."""
+    renderer = get_template_renderer()
+    return renderer.template_version(renderer.template_name_for(_card_message_type(message)))
+
+def _card_phash(path: str) -> Optional[str]:
+    """Hash percettivo della card appena generata (None se il file non è un'immagine leggibile)."""
+    try:
+        return to_hex(image_phash(path), HASH_SIZE * HASH_SIZE)
+    except Exception as e:
+        print(f"--- [CARD] Hash percettivo non calcolabile per {path}: {e} ---")
+        return None
+
+def _record_card(message: SpottedMessage, path: str, sha256: str, template_version: str, phash: Optional[str] = None,
+                 frames: Optional[list] = None):
+    message.card_path = path
+    message.card_hash = sha256
+    message.card_frames = json.dumps(frames) if frames else None
+    message.card_template_version = template_version
+    message.card_rendered_at = datetime.utcnow()
+    message.card_phash = phash
+    message.text_fingerprint = to_hex(text_fingerprint(message.text), TEXT_BITS)
+
+def invalidate_card(message: SpottedMessage):
+    """Dimentica la card pre-renderizzata (es. dopo una modifica del testo). Il commit spetta al chiamante."""
+    message.card_path = None
+    message.card_hash = None
+    message.card_frames = None
+    message.card_template_version = None
+    message.card_rendered_at = None
+    message.card_phash = None
+    message.text_fingerprint = None
+    # Testo nuovo: il controllo dei duplicati va rifatto
+    message.duplicate_of_id = None
+
+def get_prerendered_card(message: SpottedMessage) -> Optional[str]:
+    """Percorso della card pre-renderizzata se il file esiste ancora, è integro e il template non è cambiato."""
+    if not message.card_path or not message.card_hash:
+        return None
+    if message.card_template_version != _current_template_version(message):
+        # Template modificato o cambiato dall'admin: la card va rigenerata
+        return None
+    frames = _card_frames(message) or [(message.card_path, message.card_hash)]
+    try:
+        if all(file_sha256(path) == sha256 for path, sha256 in frames):
+            return message.card_path
+    except OSError:
+        pass
+    # File rimosso (es. eviction della cache) o alterato: va rigenerato
+    return None
+
+def _card_frames(message: SpottedMessage) -> Optional[list]:
+    return json.loads(message.card_frames) if message.card_frames else None
+
+def story_frames(message: SpottedMessage) -> List[str]:
+    """Immagini da pubblicare come storie consecutive: i fotogrammi di un messaggio lungo, altrimenti la sola card."""
+    frames = _card_frames(message)
+    return [path for path, _ in frames] if frames else [message.card_path]
+
+def card_for_message(message: SpottedMessage, generator: ImageGenerator = None) -> str:
+    """
+    Restituisce la card da pubblicare: quella pre-renderizzata se valida,
+    altrimenti la genera ora e la registra sul messaggio. Per un messaggio
+    lungo è il primo fotogramma: la sequenza completa la restituisce
+    story_frames. Il commit spetta al chiamante.
+    """
+    path = get_prerendered_card(message)
+    if path:
+        print(f"--- [CARD] Uso la card pre-renderizzata per ID {message.id}: {path} ---")
+        return path
+    generator = generator or ImageGenerator()
+    template_version = _current_template_version(message)
+    # Un messaggio troppo lungo per una card diventa una sequenza di fotogrammi
+    paths = generator.render_frames(
+        message.text,
+        f"spotted_{message.id}",
+        message.id,
+        message_type=_card_message_type(message),
+        title=message.title
+    )
+    if not paths or not all(paths):
+        raise Exception("Generazione immagine fallita")
+    assets = [get_asset_store().put(path, "card", [message.id]) for path in paths]
+    frames = [[asset.path, asset.sha256] for asset in assets] if len(assets) > 1 else None
+    _record_card(message, assets[0].path, assets[0].sha256, template_version, _card_phash(assets[0].path), frames)
+    return assets[0].path
+
+def request_card(message: SpottedMessage, db: Session) -> str:
+    """
+    Come card_for_message, per i processi che non renderizzano (l'app web):
+    se la card manca la genera il servizio di rendering e se ne attende l'esito.
+    """
+    if renders_inline():
+        return card_for_message(message)
+    path = get_prerendered_card(message)
+    if path:
+        print(f"--- [CARD] Uso la card pre-renderizzata per ID {message.id}: {path} ---")
+        return path
+    get_render_queue().run("card", {"message_id": message.id}, priority=PRIORITY_INTERACTIVE)
+    db.refresh(message)
+    path = get_prerendered_card(message)
+    if not path:
+        raise Exception("Generazione immagine fallita")
+    return path
+
+def render_card(message_id: int, only_approved: bool = False) -> Optional[str]:
+    """
+    Genera la card del messaggio e la registra con una propria sessione.
+    Restituisce None se non va generata (messaggio assente o non approvato,
+    testo cambiato durante il render); gli errori di render vengono propagati.
+    """
+    db = SessionLocal()
+    try:
+        message = db.query(SpottedMessage).filter(SpottedMessage.id == message_id).first()
+        if not message or (only_approved and message.status != MessageStatus.APPROVED):
+            return None
+        path = get_prerendered_card(message)
+        if path:
+            return path
+        text = message.text
+        path = card_for_message(message)
+        card = (message.card_path, message.card_hash, message.card_template_version, message.card_phash, _card_frames(message))
+        db.refresh(message)
+        if message.text != text:
+            # Testo modificato durante il render: la card non è più valida
+            print(f"--- [CARD] Testo di ID {message_id} cambiato durante il pre-render, card scartata ---")
+            return None
+        _record_card(message, *card)
+        db.commit()
+        print(f"--- [CARD] Card pre-renderizzata per ID {message_id}: {path} ---")
+        return path
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def prerender_card_task(message_id: int):
+    """
+    Task in background: appena un messaggio diventa APPROVED ne genera la card,
+    così la pubblicazione deve solo caricare un file già pronto. Dall'app web
+    il render viene solo accodato al servizio di rendering.
+    """
+    if settings.image.dedup_action != "off" and get_duplicate_index().check(text_fingerprint(_message_text(message_id)), exclude_id=message_id):
+        # Testo già pubblicato: niente render, la pubblicazione lo segnalerà come duplicato
+        print(f"--- [CARD] Pre-render di ID {message_id} saltato: testo già pubblicato di recente ---")
+        return
+    if not renders_inline():
+        try:
+            get_render_queue().submit(
+                "card", {"message_id": message_id, "only_approved": True},
+                dedup_key=f"prerender:{message_id}", block_seconds=0
+            )
+        except RenderQueueFull as e:
+            # La card verrà generata alla pubblicazione
+            print(f"--- [CARD] Pre-render di ID {message_id} saltato: {e} ---")
+        return
+    try:
+        render_card(message_id, only_approved=True)
+    except Exception as e:
+        print(f"--- [CARD] Pre-render fallito per ID {message_id}: {e} ---")
+
+def _message_text(message_id: int) -> Optional[str]:
+    db = SessionLocal()
+    try:
+        row = db.query(SpottedMessage.text).filter(SpottedMessage.id == message_id).first()
+        return row.text if row else None
+    finally:
+        db.close()
+
+# --- Duplicati ---
+
+def check_duplicate(message: SpottedMessage, image_path: Optional[str] = None, batch: DuplicateIndex = None) -> bool:
+    """
+    Da chiamare prima della pubblicazione: se il messaggio è quasi uguale a una
+    storia pubblicata di recente (o a una già scelta per lo stesso `batch`) lo
+    mette in revisione, o lo rifiuta con DEDUP_ACTION=skip, e restituisce True.
+    Un duplicato già segnalato e riapprovato dall'admin passa. Il commit spetta al chiamante.
+    """
+    action = settings.image.dedup_action
+    if action == "off" or message.duplicate_of_id:
+        return False
+    if image_path and not message.card_phash:
+        # Card generata prima del rilevamento dei duplicati
+        message.card_phash = _card_phash(image_path)
+    if not message.text_fingerprint:
+        message.text_fingerprint = to_hex(text_fingerprint(message.text), TEXT_BITS)
+    text_fp, phash = from_hex(message.text_fingerprint), from_hex(message.card_phash)
+    match = get_duplicate_index().check(text_fp, phash, exclude_id=message.id)
+    if match is None and batch is not None:
+        match = batch.check(text_fp, phash, exclude_id=message.id)
+    if match is None:
+        if batch is not None:
+            batch.add(message.id, text_fp, phash)
+        return False
+    message.duplicate_of_id = match.message_id
+    message.status = MessageStatus.REJECTED if action == "skip" else MessageStatus.REVIEW
+    message.error_message = f"Quasi duplicato della storia #{match.message_id} ({match.reason}, distanza {match.distance})"
+    print(f"--- [DEDUP] ⚠️ Messaggio ID {message.id} non pubblicato: {message.error_message} ---")
+    return True
+
+def record_posted(message: SpottedMessage):
+    """Aggiunge all'indice dei duplicati una storia appena pubblicata."""
+    get_duplicate_index().add_message(message)
+
+def _request_cards(db: Session, messages: list) -> list:
+    """
+    Fa generare al servizio di rendering le card mancanti; restituisce (messaggio, percorso, errore).
+    Un album più grande della coda viene accodato a gruppi: quando la coda è piena si
+    attendono le card già accodate prima di accodarne altre.
+    """
+    queue = get_render_queue()
+    outcomes, submitted = [], []
+    for msg in messages:
+        payload = {"message_id": msg.id}
+        try:
+            job_id = queue.submit("card", payload, priority=PRIORITY_INTERACTIVE, block_seconds=0)
+        except RenderQueueFull:
+            outcomes += _wait_cards(db, queue, submitted)
+            submitted = []
+            try:
+                job_id = queue.submit("card", payload, priority=PRIORITY_INTERACTIVE)
+            except RenderQueueFull as e:
+                # Coda piena anche dopo l'attesa: fallisce solo la card di questo messaggio
+                outcomes.append((msg, None, str(e)))
+                continue
+        submitted.append((msg, job_id))
+    return outcomes + _wait_cards(db, queue, submitted)
+
+def _wait_cards(db: Session, queue, submitted: list) -> list:
+    outcomes = []
+    for msg, job_id in submitted:
+        try:
+            queue.wait(job_id)
+            db.refresh(msg)
+            path = get_prerendered_card(msg)
+            outcomes.append((msg, path, None if path else "card non registrata"))
+        except RenderJobError as e:
+            outcomes.append((msg, None, str(e)))
+    return outcomes
+
+# --- Job del servizio di rendering (render_service.py) ---
+
+def _card_job(payload: dict) -> dict:
+    return {"path": render_card(payload["message_id"], only_approved=payload.get("only_approved", False))}
+
+def _collage_job(payload: dict) -> dict:
+    db = SessionLocal()
+    try:
+        by_id = {msg.id: msg for msg in db.query(SpottedMessage).filter(SpottedMessage.id.in_(payload["message_ids"]))}
+        messages = [by_id[message_id] for message_id in payload["message_ids"] if message_id in by_id]
+        return {"paths": render_daily_images(messages, payload["base_filename"], payload["title"], payload["style"])}
+    finally:
+        db.close()
+
+def _preview_job(payload: dict):
+    preview = ImageGenerator().render_preview(payload["text"], 0, payload["message_type"], payload["title"])
+    return {"backend": preview.backend, "width": preview.width, "height": preview.height, "ms": preview.ms}, preview.data
+
+RENDER_JOB_HANDLERS = {
+    "card": _card_job,
+    "collage": _collage_job,
+    "preview": _preview_job,
+}
+
 # --- Tasks di Moderazione ---
 
+def _cached_moderation(text: str):
+    if not settings.moderation.cache_enabled:
+        return None
+    try:
+        return get_moderation_cache().get(text)
+    except Exception as e:
+        print(f"--- [TASK] Cache di moderazione non disponibile: {e} ---")
+        return None
+
+def _store_moderation(text: str, result: ModerationResult):
+    # Gli esiti di ripiego per errori tecnici non vanno riusati
+    if not settings.moderation.cache_enabled or result.category == "Error":
+        return
+    try:
+        get_moderation_cache().put(text, result)
+    except Exception as e:
+        print(f"--- [TASK] Esito di moderazione non salvato in cache: {e} ---")
+
 def moderate_message_task(message_id: int):
     """
     Task in background per analizzare un messaggio con l'IA, salvare il risultato
-    e aggiornare lo stato del messaggio in base alla decisione.
+    e aggiornare lo stato del messaggio in base alla decisione. Se il messaggio
+    risulta approvato, la sua card viene pre-renderizzata subito.
     """
+    if _moderate_message(message_id) == MessageStatus.APPROVED:
+        prerender_card_task(message_id)
+
+def _moderate_message(message_id: int) -> Optional[MessageStatus]:
+    """Analisi IA del messaggio e aggiornamento dello stato; restituisce lo stato finale (None se il messaggio non esiste)."""
     import time
     print(f"--- [TASK] [{time.time()}] Avvio moderazione AI per messaggio ID: {message_id} ---")
 
@@ -29,47 +335,83 @@ def moderate_message_task(message_id: int):
 
         if not message:
             print(f"--- [TASK] [{time.time()}] ERRORE: Messaggio ID {message_id} non trovato nel database ---")
-            return
+            return None
 
         print(f"--- [TASK] [{time.time()}] Messaggio ID {message_id} trovato. Stato attuale: {message.status.name} ---")
         print(f"--- [TASK] [{time.time()}] Testo messaggio: '{message.text[:50]}...' ---")
 
+        # Le violazioni certe (link, pubblicità, spam) vengono rifiutate in locale, senza chiamare Gemini
+        result = get_prefilter().check(message.text)
+        if result is not None:
+            print(f"--- [TASK] Messaggio ID {message_id} rifiutato dal filtro locale: {result.reason} ---")
+            message.gemini_analysis = result.reason
+            message.status = MessageStatus.REJECTED
+            db.commit()
+            return message.status
+
+        # Testo già moderato (anche con maiuscole, emoji o spazi diversi): nessuna chiamata a Gemini
+        cached = _cached_moderation(message.text)
+        if cached is not None:
+            print(f"--- [TASK] Esito di ID {message_id} dalla cache di moderazione ({cached.match}, distanza {cached.distance}) ---")
+        elif settings.moderation.service_enabled:
+            # Gemini lo analizza il servizio di moderazione, nei limiti della quota
+            message.gemini_analysis = QUEUED_ANALYSIS
+            message.status = MessageStatus.PENDING
+            db.commit()
+            get_moderation_service().submit(message.id)
+            print(f"--- [TASK] Messaggio ID {message_id} in coda per la moderazione AI ---")
+            return message.status
+
         # Esegui l'analisi con il nuovo moderatore
         try:
-            moderator = GeminiModerator()
-            result: ModerationResult = moderator.moderate_message(message.text)
+            # Il messaggio viene analizzato insieme a quelli arrivati negli stessi istanti
+            result: ModerationResult = cached.result if cached else get_moderation_batcher().moderate(message.id, message.text)
         except (ValueError, ImportError) as e:
             # GEMINI_API_KEY non configurata, pacchetto non installato, o modelli non disponibili
             error_msg = str(e)
+            if is_quota_error(e):
+                # Quota esaurita: il messaggio attende invece di essere approvato alla cieca
+                print(f"--- [TASK] Quota API Gemini esaurita. Messaggio ID {message_id} rimane in PENDING. ---")
+                message.gemini_analysis = "Quota API esaurita - richiede approvazione manuale"
+                message.status = MessageStatus.PENDING
+                db.commit()
+                return message.status
             if any(keyword in error_msg for keyword in ["GEMINI_API_KEY", "google-generativeai", "non disponibili", "404", "not found"]):
                 print(f"--- [TASK] Moderazione AI non disponibile: {error_msg[:200]}. Messaggio ID {message_id} rimane in PENDING per approvazione manuale. ---")
                 message.gemini_analysis = "Moderazione AI non disponibile - richiede approvazione manuale"
                 message.status = MessageStatus.PENDING
                 db.commit()
-                return
+                return message.status
             else:
                 raise
+        except TimeoutError as e:
+            # Batcher in arretrato: il messaggio attende invece di essere approvato senza moderazione
+            print(f"--- [TASK] {e}. Messaggio ID {message_id} rimane in PENDING. ---")
+            message.gemini_analysis = "Moderazione AI non completata in tempo - richiede approvazione manuale"
+            message.status = MessageStatus.PENDING
+            db.commit()
+            return message.status
         except Exception as e:
             # Qualsiasi altro errore - controlla se è un errore di quota
             import time
             error_msg = str(e)
             print(f"--- [TASK] [{time.time()}] ECCEZIONE in moderazione ID {message_id}: {error_msg[:300]} ---")
 
-            is_quota_error = "429" in error_msg and ("quota" in error_msg.lower() or "exceeded" in error_msg.lower())
+            quota_exhausted = is_quota_error(e)
             is_api_error = "403" in error_msg or "401" in error_msg or "api" in error_msg.lower()
 
-            if is_quota_error:
-                # Errore di quota API - approva automaticamente per non bloccare i messaggi
-                print(f"--- [TASK] [{time.time()}] Quota API Gemini esaurita. Approvo automaticamente messaggio ID {message_id}. ---")
-                message.gemini_analysis = "Quota API esaurita - approvato automaticamente per evitare blocco"
-                message.status = MessageStatus.APPROVED
+            if quota_exhausted:
+                # Errore di quota API - il messaggio attende l'approvazione manuale
+                print(f"--- [TASK] [{time.time()}] Quota API Gemini esaurita. Messaggio ID {message_id} rimane in PENDING. ---")
+                message.gemini_analysis = "Quota API esaurita - richiede approvazione manuale"
+                message.status = MessageStatus.PENDING
                 try:
                     db.commit()
                     print(f"--- [TASK] [{time.time()}] Database commit riuscito per ID {message_id} ---")
                 except Exception as db_error:
                     print(f"--- [TASK] [{time.time()}] ERRORE database commit: {db_error} ---")
                     db.rollback()
-                return
+                return message.status
             elif is_api_error:
                 # Errore API - approva automaticamente
                 print(f"--- [TASK] [{time.time()}] Errore API Gemini. Approvo automaticamente messaggio ID {message_id}. ---")
@@ -81,7 +423,7 @@ def moderate_message_task(message_id: int):
                 except Exception as db_error:
                     print(f"--- [TASK] [{time.time()}] ERRORE database commit: {db_error} ---")
                     db.rollback()
-                return
+                return message.status
             else:
                 # Altro errore tecnico - approva comunque per non bloccare
                 print(f"--- [TASK] [{time.time()}] Errore tecnico AI ({error_msg[:100]}...). Approvo automaticamente ID {message_id}. ---")
@@ -93,12 +435,15 @@ def moderate_message_task(message_id: int):
                 except Exception as db_error:
                     print(f"--- [TASK] [{time.time()}] ERRORE database commit: {db_error} ---")
                     db.rollback()
-                return
+                return message.status
         
         print(f"--- [TASK] Risultato moderazione AI per ID {message_id}: {result} ---")
 
+        if cached is None:
+            _store_moderation(message.text, result)
+
         # Salva la motivazione dell'IA nel campo di analisi
-        message.gemini_analysis = result.reason
+        message.gemini_analysis = f"{CACHE_MARKER} {result.reason}" if cached else result.reason
         
         # Aggiorna lo stato del messaggio in base alla decisione dell'IA
         if result.decision == "APPROVE":
@@ -110,6 +455,7 @@ def moderate_message_task(message_id: int):
 
         db.commit()
         print(f"--- [TASK] Moderazione AI per ID {message_id} completata. Decisione: {result.decision}, Stato: {message.status.name} ---")
+        return message.status
 
     except Exception as e:
         import time
@@ -123,6 +469,7 @@ def moderate_message_task(message_id: int):
                 message.gemini_analysis = "Errore critico - approvato automaticamente per sicurezza"
                 db.commit()
                 print(f"--- [TASK] [{time.time()}] Messaggio ID {message_id} approvato automaticamente dopo errore critico ---")
+                return MessageStatus.APPROVED
         except Exception as rollback_error:
             print(f"--- [TASK] [{time.time()}] Anche il rollback è fallito: {rollback_error} ---")
     finally:
@@ -143,24 +490,55 @@ def post_daily_compilation(db: Session):
 
         print(f"--- DEBUG [TASK]: Trovati {len(messages_to_post)} messaggi approvati. ---")
         image_paths = []
+        rendered_ids = set()
         image_generator = ImageGenerator()
-        
-        for msg in messages_to_post:
-            print(f"--- DEBUG [TASK]: Processo messaggio ID {msg.id}. ---")
-            try:
-                output_filename = f"spotted_{msg.id}_{int(datetime.now().timestamp())}.png"
-                print(f"--- DEBUG [TASK]: Generazione immagine: {output_filename} ---")
-                path = image_generator.from_text(msg.text, output_filename)
+
+        # Le card pre-renderizzate all'approvazione si riusano; solo le altre
+        # vengono generate, in parallelo
+        card_paths = {msg.id: get_prerendered_card(msg) for msg in messages_to_post}
+        to_render = [msg for msg in messages_to_post if not card_paths[msg.id]]
+        template_versions = {msg.id: _current_template_version(msg) for msg in to_render}
+        base_filename = f"album_{int(datetime.now().timestamp())}"
+        if to_render and not renders_inline():
+            # Le genera il servizio di rendering, che registra le card sui messaggi
+            outcomes = _request_cards(db, to_render)
+            to_render, results = [], []
+            for msg, path, error in outcomes:
                 if path:
-                    print(f"--- DEBUG [TASK]: Immagine generata con successo: {path} ---")
-                    image_paths.append(path)
+                    card_paths[msg.id] = path
                 else:
-                    raise Exception("Image generator returned None.")
-            except Exception as e:
-                print(f"--- DEBUG [TASK]: ERRORE generazione immagine per ID {msg.id}: {e} ---")
+                    print(f"--- DEBUG [TASK]: ERRORE generazione immagine per ID {msg.id}: {error} ---")
+                    msg.status = MessageStatus.FAILED
+                    msg.error_message = f"Errore generazione per album: {error}"
+        else:
+            # Come card_for_message: i messaggi lunghi diventano fotogrammi, nell'album
+            # va il primo e sul messaggio si registra la sequenza completa per le storie
+            results = image_generator.render_batch(to_render, base_filename, frames=True) if to_render else []
+
+        for msg, result in zip(to_render, results):
+            if result.path:
+                print(f"--- DEBUG [TASK]: Immagine generata per ID {msg.id} in {result.seconds:.2f}s: {result.path} ---")
+                assets = [get_asset_store().put(path, "card", [msg.id]) for path in result.frames or [result.path]]
+                frames = [[asset.path, asset.sha256] for asset in assets] if len(assets) > 1 else None
+                card_paths[msg.id] = assets[0].path
+                _record_card(msg, assets[0].path, assets[0].sha256, template_versions[msg.id],
+                             _card_phash(assets[0].path), frames)
+            else:
+                print(f"--- DEBUG [TASK]: ERRORE generazione immagine per ID {msg.id}: {result.error} ---")
                 msg.status = MessageStatus.FAILED
-                msg.error_message = f"Errore generazione per album: {e}"
-                db.commit()
+                msg.error_message = f"Errore generazione per album: {result.error}"
+        db.commit()
+
+        # L'ordine dell'album resta quello dei messaggi; i quasi duplicati
+        # (anche tra messaggi dello stesso album) restano fuori
+        batch = DuplicateIndex()
+        for msg in messages_to_post:
+            if card_paths[msg.id] and check_duplicate(msg, card_paths[msg.id], batch):
+                card_paths[msg.id] = None
+            if card_paths[msg.id]:
+                image_paths.append(card_paths[msg.id])
+                rendered_ids.add(msg.id)
+        db.commit()
 
         if not image_paths:
             print("--- DEBUG [TASK]: Generazione immagini fallita per tutti i messaggi. Uscita. ---")
@@ -173,6 +551,8 @@ def post_daily_compilation(db: Session):
             print("--- DEBUG [TASK]: ⚠️ Instagram bot non disponibile (instagrapi non installato). Pubblicazione saltata. ---")
             # Aggiorna comunque lo stato dei messaggi come pubblicati (per non bloccarli)
             for msg in messages_to_post:
+                if msg.id not in rendered_ids:
+                    continue
                 msg.status = MessageStatus.POSTED
                 msg.media_pk = "instagram_bot_unavailable"
             db.commit()
@@ -190,11 +570,12 @@ def post_daily_compilation(db: Session):
         # Aggiorna lo stato di tutti i messaggi pubblicati con successo
         for msg in messages_to_post:
             # Controlla se l'immagine corrispondente è stata generata
-            if any(f"spotted_{msg.id}_" in path for path in image_paths):
+            if msg.id in rendered_ids:
                 msg.status = MessageStatus.POSTED
                 msg.posted_at = datetime.utcnow()
                 msg.error_message = None
                 msg.media_pk = str(media_pk) # Salva il PK dell'album per ogni messaggio
+                record_posted(msg)
         db.commit()
         print("--- DEBUG [TASK]: Task completato con successo. ---")
         return {"status": "success", "message": f"Album con {len(image_paths)} immagini pubblicato."}
@@ -205,6 +586,20 @@ def post_daily_compilation(db: Session):
 
 # --- Daily Post Task ---
 
+def render_daily_images(messages: list, base_filename: str, title: str, style: str) -> list:
+    """Genera le immagini del riepilogo giornaliero e le registra nell'archivio legate ai messaggi."""
+    generator = ImageGenerator()
+    if style == DailyPostStyle.CAROUSEL.value:
+        image_paths = generator.create_daily_carousel(messages, base_filename, title)
+    else:
+        image_paths = generator.create_daily_collage(messages, f"{base_filename}.png", title, style=style)
+    if not image_paths:
+        return []
+    # Le immagini del riepilogo restano legate ai messaggi fino alla retention
+    store = get_asset_store()
+    message_ids = [msg.id for msg in messages]
+    return [store.put(path, "collage", message_ids).path for path in image_paths]
+
 def daily_post_task():
     """
     Task giornaliero che pubblica un riepilogo di tutti gli spotted della giornata.
@@ -235,16 +630,24 @@ def daily_post_task():
 
             print(f"--- DEBUG [DAILY POST]: Trovati {len(messages)} messaggi per il post giornaliero ---")
 
-            # Genera carousel giornaliero
-            generator = ImageGenerator()
             today = datetime.utcnow().strftime("%d/%m/%Y")
 
             # Prepara titolo
             title = settings.title_template.format(date=today)
 
-            # Genera carousel con immagini individuali
+            # Carousel con una card per messaggio, oppure collage nello stile scelto
             base_filename = f"daily_recap_{datetime.utcnow().strftime('%Y%m%d')}"
-            image_paths = generator.create_daily_carousel(messages, base_filename, title)
+            style = settings.style.value if settings.style else DailyPostStyle.CAROUSEL.value
+            if renders_inline():
+                image_paths = render_daily_images(messages, base_filename, title, style)
+            else:
+                job = get_render_queue().run("collage", {
+                    "message_ids": [msg.id for msg in messages],
+                    "base_filename": base_filename,
+                    "title": title,
+                    "style": style,
+                })
+                image_paths = job.result["paths"]
 
             if not image_paths:
                 print("--- DEBUG [DAILY POST]: ERRORE nella generazione del collage ---")
@@ -323,17 +726,11 @@ def publish_info_card_task(card_id: int):
             print(f"--- DEBUG [INFO CARD]: Pubblicando '{info_card.title}' ---")
 
             # Genera immagine con template info
-            generator = ImageGenerator()
-            image_path = generator.from_text(
-                info_card.text,
-                f"info_card_{card_id}_{int(time.time())}.png",
-                card_id,
-                message_type="info",
-                title=info_card.title
-            )
-
-            if not image_path:
-                print("--- DEBUG [INFO CARD]: ERRORE generazione immagine ---")
+            try:
+                image_path = request_card(info_card, db)
+                db.commit()
+            except Exception as e:
+                print(f"--- DEBUG [INFO CARD]: ERRORE generazione immagine: {e} ---")
                 return {"status": "error", "message": "Errore generazione immagine"}
 
             print(f"--- DEBUG [INFO CARD]: Immagine generata: {image_path} ---")
@@ -345,7 +742,7 @@ def publish_info_card_task(card_id: int):
 
             try:
                 bot = InstagramBot()
-                media_pk = bot.post_story(image_path, f"📢 {info_card.title}")
+                media_pk = bot.post_story_sequence(story_frames(info_card))
 
                 if media_pk:
                     print(f"--- DEBUG [INFO CARD]: Info card pubblicata con successo! Media PK: {media_pk} ---")
@@ -0,0 +1,53 @@
+"""
+Impronte del testo dei messaggi, senza dipendenze esterne.
+
+Normalizzazione (minuscole, senza accenti, punteggiatura ed emoji) e SimHash
+a 64 bit dei 4-grammi di caratteri, con la distanza di Hamming per
+confrontarli. Le usano sia il rilevamento dei duplicati (app.image.dedup)
+sia il pre-filtro e la cache della moderazione AI, che così non importano PIL.
+"""
+
+import hashlib
+import re
+import unicodedata
+from typing import Optional
+
+TEXT_BITS = 64
+SHINGLE = 4  # Caratteri per shingle del SimHash
+
+
+if hasattr(int, "bit_count"):
+    def hamming(a: int, b: int) -> int:
+        return (a ^ b).bit_count()
+else:  # Python < 3.10
+    def hamming(a: int, b: int) -> int:
+        return bin(a ^ b).count("1")
+
+
+def normalize_text(text: str) -> str:
+    """Testo ridotto al contenuto: minuscole, senza accenti, punteggiatura, emoji e spazi doppi."""
+    text = unicodedata.normalize("NFKD", text or "").lower()
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(re.sub(r"[^\w\s]|_", " ", text).split())
+
+
+def text_fingerprint(text: str) -> Optional[int]:
+    """SimHash a 64 bit dei 4-grammi di caratteri; None se il testo normalizzato è vuoto."""
+    normalized = normalize_text(text)
+    if not normalized:
+        return None
+    padded = f" {normalized} "
+    weights = [0] * TEXT_BITS
+    for i in range(max(1, len(padded) - SHINGLE + 1)):
+        value = int.from_bytes(hashlib.blake2b(padded[i:i + SHINGLE].encode(), digest_size=8).digest(), "big")
+        for bit in range(TEXT_BITS):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(TEXT_BITS) if weights[bit] > 0)
+
+
+def to_hex(value: Optional[int], bits: int) -> Optional[str]:
+    return None if value is None else f"{value:0{bits // 4}x}"
+
+
+def from_hex(value: Optional[str]) -> Optional[int]:
+    return int(value, 16) if value else None
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Benchmark e regressione "golden image" del generatore di card.
+
+Per ogni backend (wkhtmltoimage, Playwright, PIL) e ogni template in
+app/image/templates renderizza un corpus di messaggi (breve, lungo, pieno di
+emoji, accentato) e misura latenza p50/p95, picco di memoria (RSS) e
+dimensione dei file. Ogni card viene confrontata con l'immagine di riferimento
+in tests/golden/ con una differenza percettiva: un'ottimizzazione del
+renderer che cambia l'aspetto delle card fa fallire il benchmark.
+
+Ogni combinazione backend/template gira in un processo separato, così il
+picco di RSS è quello della singola combinazione e non dell'intera esecuzione.
+
+Esegui:
+    python benchmark_cards.py                          # tutto, JSON su stdout
+    python benchmark_cards.py --output bench.json      # JSON su file
+    python benchmark_cards.py --backend pil -n 10      # solo PIL, 10 render per messaggio
+    python benchmark_cards.py --update-golden          # rigenera le immagini di riferimento
+    python benchmark_cards.py --encoders               # tempo e dimensione di PNG/JPEG/WebP, con e senza budget
+
+Esce con codice 1 se almeno una card supera la soglia percettiva.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+# Aggiungi il percorso del progetto al PYTHONPATH
+project_root = Path(__file__).parent
+sys.path.insert(0, str(project_root))
+
+from PIL import Image, ImageFilter
+import numpy as np
+
+TEMPLATES_DIR = project_root / "app" / "image" / "templates"
+GOLDEN_DIR = project_root / "tests" / "golden"
+
+BACKENDS = ("wkhtmltoimage", "playwright", "pil")
+
+# Corpus di messaggi: ogni caso stressa una parte diversa del layout
+CORPUS = {
+    "short": "Messaggio breve.",
+    "long": (
+        "Spotto la ragazza con il cappotto verde che ogni mattina prende il treno delle 7:42 "
+        "e legge sempre un libro diverso. Oggi era un romanzo di Calvino e sorrideva a ogni "
+        "pagina: vorrei sapere quale capitolo ti ha fatto ridere così tanto, magari ne "
+        "parliamo davanti a un caffè in stazione prima che il treno arrivi in ritardo come al solito."
+    ),
+    "emoji": "Oggi festa in aula studio 🎉🎂🥳 grazie a tutti 💖✨🔥🚀 ci vediamo stasera 🍕🍻😂😂",
+    "accented": "Perché è così difficile trovare un posto libero in biblioteca? àèéìòù ÀÈÉÌÒÙ €$£ @#!? «ciao»",
+}
+INFO_TITLE = "Avviso importante"
+
+# Le immagini di riferimento sono miniature in scala di grigi: bastano per la
+# differenza percettiva e restano piccole nel repository
+GOLDEN_SIZE = (270, 480)
+# Media della differenza assoluta (0-255) oltre la quale la card è "cambiata"
+MAX_MEAN_DIFF = 3.0
+# Percentuale massima di pixel che cambiano in modo visibile (> PIXEL_THRESHOLD)
+MAX_CHANGED_PCT = 1.0
+PIXEL_THRESHOLD = 32
+
+# Encoder confrontati da --encoders: (formato, budget in KB, 0 = nessun budget)
+ENCODER_CONFIGS = (("png", 0), ("jpeg", 0), ("webp", 0), ("png", 800), ("jpeg", 400), ("webp", 250))
+
+
+def list_templates():
+    """Nomi dei template HTML disponibili."""
+    return sorted(p.name for p in TEMPLATES_DIR.glob("*.html"))
+
+
+def golden_path(backend: str, template: str, case: str) -> Path:
+    """Percorso dell'immagine di riferimento. PIL non usa i template HTML."""
+    if backend == "pil":
+        return GOLDEN_DIR / "pil" / f"{case}.png"
+    return GOLDEN_DIR / backend / Path(template).stem / f"{case}.png"
+
+
+def _perceptual_array(image: Image.Image) -> np.ndarray:
+    """Miniatura in scala di grigi leggermente sfocata: ignora l'antialiasing."""
+    thumb = image.convert("L").resize(GOLDEN_SIZE, Image.BOX)
+    return np.asarray(thumb.filter(ImageFilter.GaussianBlur(1)), dtype=np.int16)
+
+
+def perceptual_diff(image: Image.Image, golden: Image.Image) -> dict:
+    """Confronta una card con il riferimento e dice se supera le soglie."""
+    diff = np.abs(_perceptual_array(image) - _perceptual_array(golden))
+    mean_diff = float(diff.mean())
+    changed_pct = float((diff > PIXEL_THRESHOLD).mean() * 100)
+    return {
+        "mean_diff": round(mean_diff, 3),
+        "changed_pct": round(changed_pct, 3),
+        "passed": mean_diff <= MAX_MEAN_DIFF and changed_pct <= MAX_CHANGED_PCT,
+    }
+
+
+def save_golden(image: Image.Image, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    image.convert("L").resize(GOLDEN_SIZE, Image.BOX).save(path, optimize=True)
+
+
+def compare_with_golden(image_path: str, backend: str, template: str, case: str, update: bool = False) -> dict:
+    """Stato del confronto: "passed", "changed", "missing" o "updated"."""
+    path = golden_path(backend, template, case)
+    with Image.open(image_path) as image:
+        image.load()
+        if update:
+            save_golden(image, path)
+            return {"status": "updated"}
+        if not path.exists():
+            return {"status": "missing"}
+        with Image.open(path) as golden:
+            result = perceptual_diff(image, golden)
+    result["status"] = "passed" if result.pop("passed") else "changed"
+    return result
+
+
+def percentile(samples, pct: float) -> float:
+    """Percentile nearest-rank (sufficiente per poche decine di campioni)."""
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _peak_rss_mb() -> float:
+    """Picco di RSS del processo e dei figli terminati (es. wkhtmltoimage), in MB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss è in KB su Linux e in byte su macOS
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(max(own, children) / divisor, 1)
+
+
+def run_combination(backend: str, template: str, iterations: int, update_golden: bool = False) -> dict:
+    """
+    Esegue il benchmark di una combinazione backend/template nel processo corrente.
+
+    Il primo render di ogni messaggio (avvio del browser, caricamento font) è
+    riportato a parte come "cold_ms" e non entra nei percentili.
+    """
+    from config import settings
+    from app.image.backends import get_backend_registry
+    from app.image.generator import ImageGenerator
+
+    result = {"backend": backend, "template": template}
+    message_type = "info" if template == "card_info.html" else "spotted"
+    if message_type == "spotted":
+        settings.image.template_path = str(TEMPLATES_DIR / template)
+
+    registry = get_backend_registry()
+    state = registry.states[backend]
+    if not state.available:
+        return dict(result, status="unavailable", reason=state.reason)
+    if not registry.supports(backend, template):
+        return dict(result, status="unsupported", reason="il template richiede Chromium")
+    if backend == "playwright":
+        from app.image.browser_pool import get_browser_pool
+        try:
+            # Avvio del pool fuori dalle misure: conta solo il render
+            get_browser_pool().start()
+        except Exception as e:
+            return dict(result, status="unavailable", reason=str(e)[:300])
+
+    generator = ImageGenerator()
+    from app.image.encoder import EXTENSIONS, resolve_format
+    extension = EXTENSIONS[resolve_format()]
+    samples, cold, sizes, golden = [], {}, {}, {}
+    with tempfile.TemporaryDirectory() as tmp:
+        try:
+            for case, text in CORPUS.items():
+                title = INFO_TITLE if message_type == "info" else None
+                for i in range(iterations + 1):
+                    output_path = os.path.join(tmp, f"{case}_{i}{extension}")
+                    started = time.perf_counter()
+                    path = generator.render_with_backend(backend, text, output_path, 42, message_type, title)
+                    elapsed_ms = (time.perf_counter() - started) * 1000
+                    if i == 0:
+                        cold[case] = round(elapsed_ms, 1)
+                        sizes[case] = os.path.getsize(path)
+                        golden[case] = compare_with_golden(path, backend, template, case, update_golden)
+                    else:
+                        samples.append(elapsed_ms)
+                    os.remove(path)
+        except Exception as e:
+            return dict(result, status="error", reason=str(e)[:300])
+        finally:
+            if backend == "playwright":
+                get_browser_pool().shutdown()
+
+    return dict(
+        result,
+        status="ok",
+        samples=len(samples),
+        p50_ms=round(percentile(samples, 50), 1),
+        p95_ms=round(percentile(samples, 95), 1),
+        mean_ms=round(sum(samples) / len(samples), 1),
+        cold_ms=cold,
+        peak_rss_mb=_peak_rss_mb(),
+        output_bytes=sizes,
+        golden=golden,
+    )
+
+
+def run_encoders(iterations: int) -> list:
+    """
+    Codifica le card PIL del corpus con ogni encoder di ENCODER_CONFIGS.
+
+    La prima codifica di ogni configurazione include la ricerca dei parametri
+    ("cold_ms"); le successive partono dai parametri ricordati per il profilo.
+    """
+    from app.image.encoder import encode_image, resolve_format
+    from app.image.generator import ImageGenerator
+
+    generator = ImageGenerator()
+    cards = {case: generator._draw_pil_card(text, 42)[0] for case, text in CORPUS.items()}
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt, target_kb in ENCODER_CONFIGS:
+            samples, cold, sizes, attempts = [], [], [], []
+            for case, img in cards.items():
+                for i in range(iterations + 1):
+                    result = encode_image(img, os.path.join(tmp, f"{case}_{i}"), fmt=fmt,
+                                          profile=f"benchmark:{case}", target_bytes=target_kb * 1024)
+                    elapsed_ms = result.seconds * 1000
+                    if i == 0:
+                        cold.append(elapsed_ms)
+                    else:
+                        samples.append(elapsed_ms)
+                        attempts.append(result.attempts)
+                    sizes.append(result.bytes_written)
+                    os.remove(result.path)
+            results.append({
+                "format": resolve_format(fmt),
+                "target_kb": target_kb,
+                "cold_ms": round(sum(cold) / len(cold), 1),
+                "p50_ms": round(percentile(samples, 50), 1),
+                "mean_kb": round(sum(sizes) / len(sizes) / 1024, 1),
+                "max_kb": round(max(sizes) / 1024, 1),
+                "avg_attempts": round(sum(attempts) / len(attempts), 2),
+            })
+    return results
+
+
+def _run_isolated(backend: str, template: str, iterations: int, update_golden: bool) -> dict:
+    """Lancia la combinazione in un processo figlio e ne legge il JSON."""
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--worker", backend, template, "-n", str(iterations)]
+    if update_golden:
+        cmd.append("--update-golden")
+    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=str(project_root))
+    try:
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+    except (IndexError, ValueError):
+        return {"backend": backend, "template": template, "status": "error",
+                "reason": (proc.stderr.strip().splitlines() or ["worker senza output"])[-1][:300]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark e golden test delle card")
+    parser.add_argument("--backend", action="append", choices=BACKENDS, help="limita ai backend indicati")
+    parser.add_argument("--template", action="append", help="limita ai template indicati")
+    parser.add_argument("-n", "--iterations", type=int, default=5, help="render misurati per messaggio")
+    parser.add_argument("--output", help="file JSON dei risultati (default: stdout)")
+    parser.add_argument("--update-golden", action="store_true", help="rigenera le immagini di riferimento")
+    parser.add_argument("--encoders", action="store_true", help="confronta solo gli encoder (PNG/JPEG/WebP, budget di byte)")
+    parser.add_argument("--worker", nargs=2, metavar=("BACKEND", "TEMPLATE"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # I log del generatore vanno su stderr: stdout è riservato al JSON
+        with contextlib.redirect_stdout(sys.stderr):
+            result = run_combination(args.worker[0], args.worker[1], args.iterations, args.update_golden)
+        print(json.dumps(result))
+        return
+
+    if args.encoders:
+        with contextlib.redirect_stdout(sys.stderr):
+            results = run_encoders(args.iterations)
+        for r in results:
+            budget = f"≤{r['target_kb']}KB" if r["target_kb"] else "senza budget"
+            print(f"   {r['format']} {budget}: p50 {r['p50_ms']}ms (prima {r['cold_ms']}ms), "
+                  f"media {r['mean_kb']}KB, max {r['max_kb']}KB", file=sys.stderr)
+        payload = json.dumps({"generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "encoders": results}, indent=2)
+        if args.output:
+            Path(args.output).write_text(payload, encoding="utf-8")
+        else:
+            print(payload)
+        return
+
+    from config import settings
+
+    templates = args.template or list_templates()
+    combinations = []
+    for backend in args.backend or BACKENDS:
+        if backend == "pil":
+            # PIL disegna sempre lo stesso layout: una sola misura
+            combinations.append((backend, os.path.basename(settings.image.template_path)))
+        else:
+            combinations.extend((backend, template) for template in templates)
+
+    results = []
+    for backend, template in combinations:
+        print(f"⏱️ {backend} / {template}...", file=sys.stderr)
+        result = _run_isolated(backend, template, args.iterations, args.update_golden)
+        if result["status"] == "ok":
+            print(f"   p50 {result['p50_ms']}ms, p95 {result['p95_ms']}ms, RSS {result['peak_rss_mb']}MB", file=sys.stderr)
+        else:
+            print(f"   ⚠️ {result['status']}: {result.get('reason')}", file=sys.stderr)
+        results.append(result)
+
+    regressions = [
+        {"backend": r["backend"], "template": r["template"], "case": case, **check}
+        for r in results for case, check in r.get("golden", {}).items()
+        if check["status"] == "changed"
+    ]
+    report = {
+        "generated_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "config": {
+            "iterations": args.iterations,
+            "output_format": settings.image.output_format,
+            "max_mean_diff": MAX_MEAN_DIFF,
+            "max_changed_pct": MAX_CHANGED_PCT,
+        },
+        "results": results,
+        "regressions": regressions,
+    }
+
+    payload = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        Path(args.output).write_text(payload, encoding="utf-8")
+        print(f"📄 Risultati salvati in {args.output}", file=sys.stderr)
+    else:
+        print(payload)
+
+    if regressions:
+        print(f"❌ {len(regressions)} card diverse dalle immagini di riferimento", file=sys.stderr)
+        sys.exit(1)
+    print("✅ Nessuna regressione visiva", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from dotenv import load_dotenv
 from pydantic import BaseModel
 
@@ -32,14 +33,99 @@ class ImageSettings(BaseModel):
     """Configurazioni per la generazione delle immagini."""
     template_path: str = "app/image/templates/card_v5_fixed.html"  # FORZATO: usa sempre card_v5.html
     output_folder: str = "data/generated_images"
+    template_poll_seconds: float = 2.0  # Controllo dei template modificati (hot-reload)
     width: int = 1080
     height: int = 1920
+    # Pool persistente di Chromium per i template renderizzati con Playwright
+    browser_pool_size: int = int(os.getenv("BROWSER_POOL_SIZE", "2"))
+    browser_recycle_after: int = 50  # Riavvia il browser dopo N render
+    browser_queue_size: int = 32  # Job massimi in coda prima del backpressure
+    browser_job_timeout: int = 30  # Secondi massimi per un singolo render
+    render_ready_timeout_ms: int = 5000  # Attesa massima dei segnali di readiness della card
+    # Cache content-addressed delle card già generate
+    render_cache_enabled: bool = True
+    render_cache_max_bytes: int = 512 * 1024 * 1024  # 512 MB
+    render_batch_workers: int = int(os.getenv("RENDER_BATCH_WORKERS", "4"))  # Card renderizzate in parallelo
+    # Demone wkhtmltoimage: worker di lunga durata con timeout per job
+    wkhtml_workers: int = int(os.getenv("WKHTML_WORKERS", "2"))
+    wkhtml_job_timeout: int = 20  # Secondi prima di terminare un renderer bloccato
+    wkhtml_queue_size: int = 32
+    # Registro dei backend: circuit breaker dopo N errori consecutivi
+    backend_failure_threshold: int = 3
+    backend_cooldown_seconds: int = 300
+    # Codifica finale delle card: una sola scrittura su disco
+    output_format: str = os.getenv("IMAGE_OUTPUT_FORMAT", "png")  # png | jpeg | webp
+    png_compress_level: int = 3  # zlib veloce invece di optimize=True
+    jpeg_quality: int = 92
+    webp_quality: int = 90
+    webp_method: int = 4  # 0 = veloce ... 6 = file più piccoli
+    # Budget di byte per card (0 = nessuno): la qualità viene cercata per stare sotto il limite
+    encode_target_kb: int = int(os.getenv("IMAGE_TARGET_KB", "0"))
+    encode_min_quality: int = 60  # Qualità minima accettata da JPEG/WebP nella ricerca
+    # Anteprime dell'admin: scala ridotta, JPEG in memoria, richieste raggruppate
+    preview_scale: float = 0.33
+    preview_jpeg_quality: int = 80
+    preview_ready_timeout_ms: int = 1500
+    preview_debounce_ms: int = 120
+    # Archivio delle immagini generate: retention e garbage collection
+    asset_preview_retention_hours: int = 24
+    asset_posted_retention_days: int = int(os.getenv("ASSET_POSTED_RETENTION_DAYS", "30"))
+    asset_orphan_grace_hours: int = 6  # Età minima prima di eliminare un file non referenziato
+    asset_gc_interval_minutes: int = 60
+
+    # Servizio di rendering separato (render_service.py): il processo web accoda i job invece di renderizzare.
+    # RENDER_SERVICE=1 lo impone, RENDER_SERVICE=0 lo esclude; se non è impostato la coda si usa
+    # solo quando un servizio di rendering è attivo, altrimenti il processo web renderizza da sé
+    render_service_enabled: Optional[bool] = {"1": True, "0": False}.get(os.getenv("RENDER_SERVICE", ""))
+    render_service_concurrency: int = int(os.getenv("RENDER_SERVICE_CONCURRENCY", "2"))
+    render_service_heartbeat_seconds: int = 5
+    render_queue_max_depth: int = 64  # Job in attesa oltre i quali i chiamanti vengono frenati
+    render_queue_block_seconds: float = 5.0  # Attesa massima di un posto libero in coda
+    render_job_deadline_seconds: int = 120  # Tempo massimo di un job, attesa in coda inclusa
+    render_preview_deadline_seconds: int = 5
+    render_job_retention_hours: int = 24
+
+    # Duplicati: le storie quasi uguali a una pubblicata di recente non vengono ricaricate
+    dedup_action: str = os.getenv("DEDUP_ACTION", "flag")  # flag (in revisione) | skip (rifiutate) | off
+    dedup_window_days: int = 30
+    dedup_text_max_distance: int = 3  # Bit diversi su 64 dell'impronta del testo
+    dedup_image_max_distance: int = 6  # Bit diversi su 256 dell'hash percettivo della card
+
+    # Messaggi lunghi: divisi in più fotogrammi pubblicati come storie consecutive
+    frame_min_font_size: int = 44  # Sotto questa dimensione il testo non sta più in una card
+    frame_font_size: int = 52  # Dimensione del testo nei fotogrammi
+    max_frames: int = 10
 
 class WebSettings(BaseModel):
     """Configurazioni per l'interfaccia web."""
     host: str = "127.0.0.1"
     port: int = 8000
 
+class ModerationSettings(BaseModel):
+    """Configurazioni della moderazione AI."""
+    # Micro-batch: i messaggi in arrivo vengono raccolti per al massimo
+    # batch_max_wait_ms (o batch_max_items) e analizzati con una sola richiesta
+    batch_max_items: int = int(os.getenv("MODERATION_BATCH_SIZE", "20"))
+    batch_max_wait_ms: int = int(os.getenv("MODERATION_BATCH_WAIT_MS", "250"))
+    batch_timeout_seconds: int = 120  # Attesa massima dell'esito da parte di un task
+    # Cache degli esiti nel database, condivisa tra app web e worker
+    cache_enabled: bool = os.getenv("MODERATION_CACHE", "1") == "1"
+    cache_ttl_hours: int = 168
+    cache_max_entries: int = 10000
+    cache_max_distance: int = 6  # Bit diversi su 64 del SimHash per un quasi duplicato (massimo 7)
+    cache_min_near_chars: int = 24  # Sotto questa lunghezza vale solo il testo identico
+    # Servizio asincrono: i messaggi attendono in una coda nel database e le
+    # richieste a Gemini rispettano i limiti di richieste e token al minuto
+    service_enabled: bool = os.getenv("MODERATION_SERVICE", "1") == "1"
+    gemini_rpm: int = int(os.getenv("GEMINI_RPM", "15"))
+    gemini_tpm: int = int(os.getenv("GEMINI_TPM", "1000000"))
+    service_concurrency: int = 2  # Richieste a Gemini in volo contemporaneamente
+    service_poll_seconds: float = 1.0  # Controllo della coda per i job accodati da altri processi
+    max_attempts: int = 5  # Oltre, il messaggio resta in PENDING per l'approvazione manuale
+    backoff_base_seconds: float = 5.0
+    backoff_max_seconds: float = 300.0
+    job_stale_seconds: int = 300  # Un job in esecuzione da più di così torna in coda (processo terminato)
+
 class DatabaseSettings(BaseModel):
     """Configurazioni per il database."""
     # Usa DATABASE_URL se disponibile (per Render), altrimenti usa SQLite locale.
@@ -54,6 +140,7 @@ class Settings(BaseModel):
     image: ImageSettings = ImageSettings()
     web: WebSettings = WebSettings()
     database: DatabaseSettings = DatabaseSettings()
+    moderation: ModerationSettings = ModerationSettings()
     gemini_api_key: str = os.getenv("GEMINI_API_KEY", "") # New: Gemini API Key
 
 # Istanza globale delle impostazioni, da importare negli altri file
@@ -111,6 +111,44 @@ def run_migration():
                 print(f"❌ Errore tabella 'daily_post_settings': {e}")
             connection.rollback()
 
+        # Add pre-rendered card columns
+        for column, column_type in (("card_path", "VARCHAR"), ("card_hash", "VARCHAR"), ("card_template_version", "VARCHAR"), ("card_rendered_at", "TIMESTAMP")):
+            try:
+                connection.execute(text(f'ALTER TABLE spotted_messages ADD COLUMN {column} {column_type}'))
+                connection.commit()
+                print(f"✅ Colonna '{column}' aggiunta con successo.")
+            except Exception as e:
+                if "duplicate column name" in str(e) or "already exists" in str(e):
+                    print(f"ℹ️  Colonna '{column}' già esistente.")
+                else:
+                    print(f"❌ Errore colonna '{column}': {e}")
+                connection.rollback()
+
+        # Add duplicate detection columns
+        for column, column_type in (("card_phash", "VARCHAR"), ("text_fingerprint", "VARCHAR"), ("duplicate_of_id", "INTEGER")):
+            try:
+                connection.execute(text(f'ALTER TABLE spotted_messages ADD COLUMN {column} {column_type}'))
+                connection.commit()
+                print(f"✅ Colonna '{column}' aggiunta con successo.")
+            except Exception as e:
+                if "duplicate column name" in str(e) or "already exists" in str(e):
+                    print(f"ℹ️  Colonna '{column}' già esistente.")
+                else:
+                    print(f"❌ Errore colonna '{column}': {e}")
+                connection.rollback()
+
+        # Add multi-frame card column (messaggi lunghi)
+        try:
+            connection.execute(text('ALTER TABLE spotted_messages ADD COLUMN card_frames TEXT'))
+            connection.commit()
+            print("✅ Colonna 'card_frames' aggiunta con successo.")
+        except Exception as e:
+            if "duplicate column name" in str(e) or "already exists" in str(e):
+                print("ℹ️  Colonna 'card_frames' già esistente.")
+            else:
+                print(f"❌ Errore colonna 'card_frames': {e}")
+            connection.rollback()
+
         # Correggi valori message_type errati (enum aspetta 'SPOTTED' maiuscolo, non 'spotted' minuscolo)
         try:
             # Aggiorna tutti i valori al formato corretto maiuscolo
@@ -0,0 +1,36 @@
+import signal
+import sys
+
+from app.database import create_db_and_tables
+from app.image.backends import probe_render_backends
+from app.image.jobs import RenderService, get_render_queue, set_inline_rendering
+from app.image.renderer import get_template_renderer
+from app.tasks import RENDER_JOB_HANDLERS
+from config import settings
+
+def main():
+    """Avvia il servizio di rendering: esegue i job accodati dall'app web."""
+    print("--- Avvio del Servizio di Rendering di InstaSpotter ---", flush=True)
+    create_db_and_tables()
+    set_inline_rendering(True)
+
+    # Template precompilati e backend verificati qui, non nel processo web
+    get_template_renderer().start_watching()
+    probe_render_backends()
+
+    service = RenderService(RENDER_JOB_HANDLERS, queue=get_render_queue())
+
+    def shutdown(signum, frame):
+        print("--- Arresto del Servizio di Rendering ---", flush=True)
+        service.stop()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+    print(f"--- Servizio di rendering in esecuzione: {service.concurrency} job in parallelo, "
+          f"coda massima {settings.image.render_queue_max_depth} ---", flush=True)
+    service.run_forever()
+
+if __name__ == "__main__":
+    main()
@@ -159,6 +159,12 @@ $PYTHON_CMD -c "import playwright; print('✅ Playwright OK')" 2>/dev/null || ec
 echo "🗄️ Running database migrations..."
 $PYTHON_CMD migrate.py
 
+# Start the render service (the web server only queues render jobs)
+echo "🖼️ Starting render service..."
+# This deployment runs the render service, so the web server always queues renders
+export RENDER_SERVICE=1
+$PYTHON_CMD render_service.py &
+
 # Start the web server
 echo "🌐 Starting web server..."
 uvicorn app.main:app --host 0.0.0.0 --port $PORT
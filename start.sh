@@ -88,5 +88,10 @@ else
     echo "⚠️ migrate.py not found, skipping migrations"
 fi
 
+echo "🖼️ Starting render service..."
+# This deployment runs the render service, so the web server always queues renders
+export RENDER_SERVICE=1
+"$PYTHON_CMD" render_service.py &
+
 echo "🌐 Starting InstaSpotter..."
 "$PYTHON_CMD" -m uvicorn app.main:app --host 0.0.0.0 --port $PORT
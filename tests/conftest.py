@@ -0,0 +1,22 @@
+"""
+Fixture comuni: i test non scrivono nella cartella delle immagini generate del progetto.
+"""
+
+import pytest
+
+import app.image.cache as render_cache
+import app.image.preview as preview
+import app.image.renderer as renderer
+import app.image.store as store
+from config import settings
+
+
+@pytest.fixture(autouse=True)
+def generated_images(tmp_path, monkeypatch):
+    """Immagini, archivio, cache di render e bytecode dei template vanno in tmp_path invece che in data/."""
+    folder = tmp_path / "generated_images"
+    monkeypatch.setattr(settings.image, "output_folder", str(folder))
+    # I singleton costruiti con la cartella precedente vengono ricreati alla prima richiesta
+    for module, name in ((renderer, "_renderer"), (render_cache, "_cache"), (store, "_store"), (preview, "_service")):
+        monkeypatch.setattr(module, name, None)
+    return folder
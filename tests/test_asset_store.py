@@ -0,0 +1,110 @@
+"""
+Test dell'archivio delle immagini generate (deduplicazione, riferimenti, GC).
+RUN: pytest tests/test_asset_store.py -v
+"""
+
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, ImageAsset, MessageStatus, SpottedMessage
+from app.image.store import AssetStore
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'assets.db'}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+@pytest.fixture
+def store(tmp_path, session_factory):
+    return AssetStore(root=str(tmp_path / "out" / "assets"), session_factory=session_factory)
+
+
+def _render(tmp_path, name, content):
+    path = tmp_path / name
+    path.write_bytes(content)
+    return str(path)
+
+
+def _add_message(session_factory, **fields):
+    db = session_factory()
+    message = SpottedMessage(text="Ciao", **fields)
+    db.add(message)
+    db.commit()
+    message_id = message.id
+    db.close()
+    return message_id
+
+
+def test_identical_content_is_stored_once(tmp_path, store):
+    """Due render identici diventano un solo file, nominato con l'hash e in una sottocartella."""
+    first = store.put(_render(tmp_path, "a.png", b"card"), "card", [1])
+    second = store.put(_render(tmp_path, "b.png", b"card"), "card", [2])
+
+    assert first.path == second.path
+    assert os.path.basename(first.path) == f"{first.sha256}.png"
+    assert os.path.relpath(first.path, store.root).split(os.sep)[:2] == [first.sha256[:2], first.sha256[2:4]]
+    assert not os.path.exists(tmp_path / "a.png") and not os.path.exists(tmp_path / "b.png")
+    stats = store.stats()
+    assert stats["refs"] == 2
+    assert stats["assets"] == 1 and stats["referenced"] == 1 and stats["by_kind"]["card"]["assets"] == 1
+
+
+def test_stats_do_not_scan_unless_asked(tmp_path, store, monkeypatch):
+    """Le statistiche non eseguono il GC simulato: solo scan=True lo calcola, poi viene riportato."""
+    store.put(_render(tmp_path, "a.png", b"card"), "card", [1])
+    calls = []
+    gc = store.gc
+    monkeypatch.setattr(store, "gc", lambda **kwargs: calls.append(kwargs) or gc(**kwargs))
+
+    assert store.stats()["last_scan"] is None
+    assert calls == []
+    scan = store.stats(scan=True)["last_scan"]
+    assert calls == [{"dry_run": True}] and scan["files_on_disk"] == 1
+    assert store.stats()["last_scan"] == scan and len(calls) == 1
+
+
+def test_gc_applies_retention_policies(tmp_path, store, session_factory):
+    """Storie pubblicate da troppo tempo, anteprime scadute e orfani vengono eliminati."""
+    now = datetime.utcnow()
+    old_id = _add_message(session_factory, status=MessageStatus.POSTED, posted_at=now - timedelta(days=90))
+    live_id = _add_message(session_factory, status=MessageStatus.APPROVED)
+
+    old = store.put(_render(tmp_path, "old.png", b"old"), "card", [old_id])
+    live = store.put(_render(tmp_path, "live.png", b"live"), "card", [live_id])
+    preview = store.put(_render(tmp_path, "preview.jpg", b"preview"), "preview")
+    db = session_factory()
+    for message_id, asset in ((old_id, old), (live_id, live)):
+        message = db.get(SpottedMessage, message_id)
+        message.card_path, message.card_hash = asset.path, asset.sha256
+    db.commit()
+    db.close()
+
+    assert store.stats(scan=True)["last_scan"]["reclaimable_bytes"] == 0
+    report = store.gc(now=now + timedelta(days=2))
+
+    assert report["refs_dropped"]["posted"] == 1
+    assert report["deleted"]["preview"] == 1 and report["deleted"]["orphan"] == 1
+    assert not os.path.exists(old.path) and not os.path.exists(preview.path)
+    assert os.path.exists(live.path)
+
+
+def test_gc_dry_run_reports_without_deleting(tmp_path, store, session_factory):
+    """Il dry run riporta i byte recuperabili ma non tocca file né indice."""
+    orphan = store.put(_render(tmp_path, "orphan.png", b"x" * 500), "card", [])
+    legacy = _render(tmp_path / "out", "spotted_1_1700000000.png", b"y" * 300)
+    os.utime(legacy, (0, 0))
+
+    report = store.gc(dry_run=True, now=datetime.utcnow() + timedelta(days=1))
+
+    assert report["bytes_reclaimed"] == 800
+    assert os.path.exists(orphan.path) and os.path.exists(legacy)
+    db = session_factory()
+    assert db.query(ImageAsset).count() == 1
+    db.close()
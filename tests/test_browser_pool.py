@@ -0,0 +1,59 @@
+"""
+Test del pool di browser (con un Playwright finto): ripartenza dopo la morte di tutti gli slot.
+RUN: pytest tests/test_browser_pool.py -v
+"""
+
+import app.image.browser_pool as browser_pool
+from app.image.browser_pool import BrowserPool
+
+
+class FakePage:
+    def is_closed(self):
+        return False
+
+
+class FakeBrowser:
+    def new_page(self, **kwargs):
+        return FakePage()
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class FakePlaywright:
+    launches = 0
+
+    def __init__(self):
+        self.chromium = self
+
+    def start(self):
+        return self
+
+    def launch(self, **kwargs):
+        FakePlaywright.launches += 1
+        return FakeBrowser()
+
+    def stop(self):
+        pass
+
+
+def test_pool_restarts_when_every_slot_died(monkeypatch):
+    """Se tutti i thread degli slot sono morti, il job successivo ricrea il pool invece di restare in coda."""
+    monkeypatch.setattr(browser_pool, "sync_playwright", FakePlaywright, raising=False)
+    pool = BrowserPool(size=2, recycle_after=100, queue_size=4, viewport=(100, 100))
+    try:
+        assert pool.run(lambda page: "primo", timeout=5) == "primo"
+        # Simula il crash: gli slot escono dal loop
+        pool._stopping.set()
+        for slot in pool._slots:
+            slot.join(timeout=5)
+        assert not pool.running
+
+        assert pool.run(lambda page: "dopo il crash", timeout=5) == "dopo il crash"
+        assert pool.stats()["alive"] == 2
+        assert FakePlaywright.launches >= 4
+    finally:
+        pool.shutdown()
@@ -0,0 +1,101 @@
+"""
+Test del rilevamento delle storie quasi duplicate (impronte, BK-tree, pubblicazione).
+RUN: pytest tests/test_duplicates.py -v
+"""
+
+import random
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.tasks
+from app.database import Base, MessageStatus, SpottedMessage
+from app.image.dedup import BKTree, DuplicateIndex, MultiIndexHash
+from app.tasks import check_duplicate
+from app.text_fingerprint import TEXT_BITS, hamming, text_fingerprint, to_hex
+
+
+@pytest.mark.parametrize("index_class", [BKTree, lambda: MultiIndexHash(64, 3)])
+def test_indexes_match_brute_force(index_class):
+    """BK-tree e multi-index hashing trovano esattamente i vicini di un confronto con tutti."""
+    rng = random.Random(7)
+    keys = [rng.getrandbits(64) for _ in range(500)]
+    keys += [key ^ (1 << rng.randrange(64)) ^ (1 << rng.randrange(64)) for key in keys[:50]]
+    index = index_class()
+    for i, key in enumerate(keys):
+        index.add(key, i)
+
+    for probe in keys[:20] + [rng.getrandbits(64) for _ in range(20)]:
+        expected = sorted(i for i, key in enumerate(keys) if hamming(probe, key) <= 3)
+        assert sorted(i for _, i in index.search(probe, 3)) == expected
+
+
+def test_text_variants_share_fingerprint():
+    """Maiuscole, accenti, punteggiatura ed emoji non cambiano l'impronta; un testo diverso sì."""
+    base = text_fingerprint("Ci vediamo domani alla mensa, ragazza col cappotto rosso")
+    variant = text_fingerprint("ci vediamo DOMANI alla mènsa... ragazza col cappotto rosso 😍")
+    other = text_fingerprint("Chi ha perso un ombrello blu in aula magna?")
+
+    assert hamming(base, variant) == 0
+    assert hamming(base, other) > 16
+    assert text_fingerprint("😍🔥") is None
+
+
+def test_visual_match_needs_related_text():
+    """Card brevi che si somigliano solo visivamente non sono duplicati; testi vicini sì."""
+    index = DuplicateIndex(text_max_distance=3, image_max_distance=6)
+    index.add(1, text_fingerprint("ok"), 0b1011)
+
+    assert index.check(text_fingerprint("grazie"), 0b1010) is None
+    match = index.check(text_fingerprint("OK!!"), None)
+    assert (match.message_id, match.reason, match.distance) == (1, "text", 0)
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'dedup.db'}")
+    Base.metadata.create_all(bind=engine)
+    factory = sessionmaker(bind=engine)
+    db = factory()
+    db.add(SpottedMessage(id=1, text="Grazie a chi mi ha restituito il portafoglio", status=MessageStatus.POSTED,
+                          posted_at=datetime.utcnow(),
+                          text_fingerprint=to_hex(text_fingerprint("Grazie a chi mi ha restituito il portafoglio"), TEXT_BITS)))
+    db.add(SpottedMessage(id=2, text="Vecchio spotted", status=MessageStatus.POSTED,
+                          posted_at=datetime.utcnow() - timedelta(days=90),
+                          text_fingerprint=to_hex(text_fingerprint("Vecchio spotted"), TEXT_BITS)))
+    db.commit()
+    db.close()
+    duplicate_index = DuplicateIndex(session_factory=factory, window_days=30)
+    monkeypatch.setattr(app.tasks, "get_duplicate_index", lambda: duplicate_index)
+    monkeypatch.setattr(app.tasks.settings.image, "dedup_action", "flag")
+    return duplicate_index
+
+
+def _message(message_id, text):
+    return SimpleNamespace(id=message_id, text=text, status=MessageStatus.APPROVED, card_phash=None,
+                           text_fingerprint=None, duplicate_of_id=None, error_message=None)
+
+
+def test_publish_flags_recent_duplicates_only(index):
+    """Un quasi duplicato di una storia recente va in revisione; quelle fuori finestra non contano."""
+    duplicate = _message(3, "grazie a chi mi ha restituito il portafoglio!")
+    old = _message(4, "Vecchio spotted")
+
+    assert check_duplicate(duplicate)
+    assert (duplicate.status, duplicate.duplicate_of_id) == (MessageStatus.REVIEW, 1)
+    assert not check_duplicate(old)
+    assert index.stats()["entries"] == 1
+
+
+def test_reapproved_duplicate_and_batch(index):
+    """Un duplicato riapprovato dall'admin passa; nello stesso album il secondo messaggio uguale resta fuori."""
+    reviewed = _message(3, "grazie a chi mi ha restituito il portafoglio")
+    reviewed.duplicate_of_id = 1
+    assert not check_duplicate(reviewed)
+
+    batch = DuplicateIndex()
+    assert not check_duplicate(_message(5, "Chi ha perso un ombrello blu?"), batch=batch)
+    assert check_duplicate(_message(6, "chi ha perso un ombrello blu"), batch=batch)
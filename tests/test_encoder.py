@@ -0,0 +1,58 @@
+"""
+Test dello stadio di codifica con budget di byte (JPEG/WebP/PNG, parametri per profilo).
+RUN: pytest tests/test_encoder.py -v
+"""
+
+import os
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from app.image.encoder import TargetSizeEncoder, encode_image, encode_to_bytes, get_target_encoder
+
+
+@pytest.fixture(scope="module")
+def card():
+    """Card sintetica con sfumatura, testo e rumore: si comprime come una card vera."""
+    rng = random.Random(3)
+    img = Image.new("RGB", (540, 960))
+    draw = ImageDraw.Draw(img)
+    for y in range(960):
+        draw.line((0, y, 540, y), fill=(y // 4, 80, 255 - y // 4))
+    for _ in range(400):
+        x, y = rng.randrange(540), rng.randrange(960)
+        draw.text((x, y), "spotted", fill=(255, 255, 255))
+    return img
+
+
+def test_quality_search_lands_under_budget(card):
+    """La ricerca sceglie la qualità più alta che sta nel budget."""
+    target = len(encode_to_bytes(card, "jpeg", quality=75)) + 1
+    data, params, attempts = TargetSizeEncoder(min_quality=50).encode(card, "jpeg", "t", target)
+
+    assert len(data) <= target
+    assert len(encode_to_bytes(card, "jpeg", quality=params["quality"] + 1)) > target
+    assert attempts > 1
+
+
+def test_parameters_are_reused_per_profile(card):
+    """Dopo la prima ricerca, le card dello stesso profilo richiedono una sola codifica."""
+    encoder = TargetSizeEncoder(min_quality=50)
+    target = len(encode_to_bytes(card, "jpeg", quality=70)) + 1
+    encoder.encode(card, "jpeg", "card_v5.html:pil", target)
+
+    _, params, attempts = encoder.encode(card, "jpeg", "card_v5.html:pil", target)
+    assert attempts == 1
+    assert params["quality"] == 70
+
+
+def test_png_falls_back_to_palette_and_stats(card, tmp_path):
+    """Per PNG un budget stretto passa alla palette ridotta; le statistiche riportano tempo e dimensione."""
+    target = len(encode_to_bytes(card, "png", compress_level=9)) - 1
+    result = encode_image(card, str(tmp_path / "card.png"), fmt="png", profile="test-png", target_bytes=target)
+
+    assert result.params["colors"] is not None
+    assert os.path.getsize(result.path) == result.bytes_written <= target
+    stats = get_target_encoder().stats()["profiles"]["test-png:png"]
+    assert stats["encodes"] == 1 and stats["over_budget"] == 0
@@ -0,0 +1,32 @@
+"""
+Test di regressione visiva delle card rispetto alle immagini di riferimento.
+RUN: pytest tests/test_golden_images.py -v
+"""
+
+import pytest
+from PIL import Image, ImageDraw
+
+from app.image.generator import ImageGenerator
+from benchmark_cards import CORPUS, compare_with_golden, golden_path, perceptual_diff
+
+
+@pytest.mark.parametrize("case", sorted(CORPUS))
+def test_pil_card_matches_golden(case, tmp_path):
+    """La card PIL del corpus non si discosta dall'immagine di riferimento."""
+    if not golden_path("pil", "", case).exists():
+        pytest.skip("immagine di riferimento assente (python benchmark_cards.py --update-golden)")
+    path = ImageGenerator().render_with_backend("pil", CORPUS[case], str(tmp_path / f"{case}.png"), 42)
+
+    result = compare_with_golden(path, "pil", "", case)
+    assert result["status"] == "passed", result
+
+
+def test_visible_change_is_detected():
+    """Un blocco di testo spostato o ridisegnato supera la soglia percettiva."""
+    golden = Image.new("RGB", (1080, 1920), "white")
+    ImageDraw.Draw(golden).rectangle((200, 700, 880, 1100), fill="black")
+    changed = Image.new("RGB", (1080, 1920), "white")
+    ImageDraw.Draw(changed).rectangle((200, 900, 880, 1300), fill="black")
+
+    assert perceptual_diff(golden.copy(), golden)["passed"]
+    assert not perceptual_diff(changed, golden)["passed"]
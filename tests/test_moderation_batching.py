@@ -0,0 +1,128 @@
+"""
+Test del micro-batching della moderazione (una richiesta per più messaggi, fallback per elemento).
+RUN: pytest tests/test_moderation_batching.py -v
+"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import app.ai.gemini_moderator as gemini_moderator
+import app.tasks as tasks
+from app.ai.batching import ModerationBatcher
+from app.ai.gemini_moderator import GeminiModerator, ModerationResult
+from app.database import Base, MessageStatus, SpottedMessage
+from config import settings
+
+
+class FakeModerator:
+    """Approva tutto; `drop` sono gli id che il batch "dimentica"."""
+
+    def __init__(self, drop=(), error=None):
+        self.drop = set(drop)
+        self.error = error
+        self.batch_sizes = []
+        self.single = []
+
+    def moderate_batch(self, items):
+        self.batch_sizes.append(len(items))
+        if self.error:
+            raise self.error
+        return {message_id: ModerationResult("APPROVE", f"ok {message_id}", "Safe")
+                for message_id, _ in items if message_id not in self.drop}
+
+    def moderate_message(self, text):
+        self.single.append(text)
+        return ModerationResult("PENDING", "singolo", "Uncertain")
+
+
+def _moderate_concurrently(batcher, count):
+    results, errors = {}, []
+
+    def run(message_id):
+        try:
+            results[message_id] = batcher.moderate(message_id, f"messaggio {message_id}")
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_burst_is_sent_as_one_request():
+    """Dieci messaggi arrivati insieme costano una sola richiesta, con l'esito giusto per ciascuno."""
+    moderator = FakeModerator()
+    batcher = ModerationBatcher(lambda: moderator, max_items=20, max_wait_ms=200)
+    results, errors = _moderate_concurrently(batcher, 10)
+
+    assert not errors and moderator.batch_sizes == [10]
+    assert all(results[i].reason == f"ok {i}" for i in range(10))
+    assert batcher.stats()["requests"] == 1
+
+
+def test_missing_items_fall_back_and_errors_reach_everyone():
+    """Gli elementi assenti dalla risposta vengono analizzati da soli; un errore di quota arriva a tutti."""
+    moderator = FakeModerator(drop={3})
+    batcher = ModerationBatcher(lambda: moderator, max_items=5, max_wait_ms=200)
+    results, _ = _moderate_concurrently(batcher, 5)
+    assert results[3].reason == "singolo" and moderator.single == ["messaggio 3"]
+    assert batcher.stats()["fallbacks"] == 1
+
+    failing = ModerationBatcher(lambda: FakeModerator(error=ValueError("Quota API Gemini esaurita")), max_wait_ms=200)
+    _, errors = _moderate_concurrently(failing, 4)
+    assert len(errors) == 4 and all("Quota" in str(e) for e in errors)
+
+
+@pytest.mark.parametrize("response, expected", [
+    ('[{"id": 1, "decision": "approve", "reason": "ok", "category": "Safe"},'
+     ' {"id": "2", "decision": "REJECT", "reason": "link", "category": "Link"},'
+     ' {"id": 9, "decision": "APPROVE"}, {"id": 3, "decision": "forse"}, "rumore"]', {1: "APPROVE", 2: "REJECT"}),
+    ('{"results": [{"id": 3, "decision": "PENDING", "reason": "?", "category": "Uncertain"}]}', {3: "PENDING"}),
+    ('Ecco i risultati: [{"id": 1', {}),
+])
+def test_batch_response_parsing(monkeypatch, response, expected):
+    """Elementi malformati, id sconosciuti e risposte non JSON restano fuori: verranno analizzati singolarmente."""
+    model = SimpleNamespace(generate_content=lambda prompt: SimpleNamespace(text=response))
+    fake_genai = SimpleNamespace(configure=lambda api_key: None, GenerationConfig=dict,
+                                 GenerativeModel=lambda *args, **kwargs: model)
+    monkeypatch.setattr(gemini_moderator, "genai", fake_genai)
+    monkeypatch.setattr(gemini_moderator.settings, "gemini_api_key", "test-key")
+
+    results = GeminiModerator().moderate_batch([(1, "a"), (2, "b"), (3, "c")])
+    assert {message_id: result.decision for message_id, result in results.items()} == expected
+
+
+class SlowBatcher:
+    def moderate(self, message_id, text):
+        raise TimeoutError(f"Moderazione del messaggio ID {message_id} non completata in tempo")
+
+
+def test_batcher_timeout_leaves_message_pending(tmp_path, monkeypatch):
+    """Se il batcher non risponde in tempo il messaggio resta in PENDING: nessuna approvazione alla cieca."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'messages.db'}")
+    Base.metadata.create_all(bind=engine)
+    session_factory = sessionmaker(bind=engine)
+    monkeypatch.setattr(tasks, "SessionLocal", session_factory)
+    monkeypatch.setattr(settings.moderation, "service_enabled", False)
+    monkeypatch.setattr(settings.moderation, "cache_enabled", False)
+    monkeypatch.setattr(tasks, "get_moderation_batcher", SlowBatcher)
+    db = session_factory()
+    message = SpottedMessage(text="Spotto il ragazzo con la felpa verde in aula studio")
+    db.add(message)
+    db.commit()
+    message_id = message.id
+    db.close()
+
+    assert tasks._moderate_message(message_id) == MessageStatus.PENDING
+    db = session_factory()
+    message = db.get(SpottedMessage, message_id)
+    assert message.status == MessageStatus.PENDING and "approvazione manuale" in message.gemini_analysis
+    db.close()
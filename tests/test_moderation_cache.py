@@ -0,0 +1,70 @@
+"""
+Test della cache degli esiti di moderazione nel database (testo normalizzato, SimHash, TTL, LRU).
+RUN: pytest tests/test_moderation_cache.py -v
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.ai.cache import ModerationCache
+from app.ai.gemini_moderator import ModerationResult
+from app.database import Base, ModerationCacheEntry
+
+APPROVE = ModerationResult("APPROVE", "Messaggio spotted standard e sicuro.", "Safe")
+REJECT = ModerationResult("REJECT", "Pubblicità di un altro canale.", "Advertisement")
+TEXT = "Spotto la ragazza con il cappotto rosso che ho visto oggi in biblioteca, mi hai sorriso!"
+SPAM = ("Ragazzi venite tutti nel nostro gruppo Telegram delle feste universitarie, "
+        "ogni sera eventi, drink scontati e tanta musica: cercate Feste Campus e unitevi!")
+
+
+@pytest.fixture
+def factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def test_variants_and_near_duplicates_hit(factory):
+    """Maiuscole, emoji e spazi danno lo stesso esito; i ritocchi riusano solo un rifiuto."""
+    cache = ModerationCache(factory)
+    cache.put(TEXT, APPROVE)
+    cache.put(SPAM, REJECT)
+
+    exact = cache.get("  spotto la RAGAZZA con il cappotto rosso che ho visto oggi in biblioteca mi hai sorriso 😍")
+    near = cache.get(SPAM.replace("Feste Campus", "Feste Campus Bz"))
+    assert (exact.match, exact.result) == ("exact", APPROVE)
+    assert (near.match, near.result) == ("near", REJECT) and 0 < near.distance <= 6
+    # Un'approvazione non si estende a un testo diverso anche di una sola parola
+    assert cache.get(TEXT.replace("sorriso", "sorrisoo")) is None
+    assert cache.get("Chi ha perso un ombrello blu in aula magna stamattina?") is None
+    assert cache.stats()["hits"] == {"exact": 1, "near": 1}
+
+
+def test_cache_is_shared_through_the_database(factory):
+    """Un altro processo (un'altra istanza) trova gli esiti salvati; quelli scaduti non valgono."""
+    ModerationCache(factory).put(TEXT, APPROVE)
+    ModerationCache(factory, ttl_hours=0).put("Testo già scaduto da tempo ormai", APPROVE)
+
+    other = ModerationCache(factory)
+    assert other.get(TEXT).result == APPROVE
+    assert other.get("Testo già scaduto da tempo ormai") is None
+
+
+def test_prune_keeps_most_recently_used(factory):
+    """Oltre il limite vengono eliminate le voci usate meno di recente."""
+    cache = ModerationCache(factory, max_entries=2)
+    for text in ("primo messaggio", "secondo messaggio", "terzo messaggio"):
+        cache.put(text, APPROVE)
+    db = factory()
+    for offset, text_hash in enumerate(row.text_hash for row in db.query(ModerationCacheEntry).order_by(ModerationCacheEntry.created_at)):
+        db.get(ModerationCacheEntry, text_hash).last_used_at = datetime.utcnow() - timedelta(hours=3 - offset)
+    db.commit()
+    db.close()
+    cache.get("primo messaggio")
+
+    assert cache.prune() == 1
+    assert cache.get("secondo messaggio") is None
+    assert cache.get("primo messaggio") and cache.get("terzo messaggio")
@@ -0,0 +1,270 @@
+"""
+Test del servizio asincrono di moderazione (token bucket, coda con priorità, backoff sui 429, tempo di smaltimento).
+RUN: pytest tests/test_moderation_service.py -v
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.ai.gemini_moderator import ModerationResult
+from app.ai.service import (
+    PRIORITY_ADMIN, QUEUED, ModerationQueue, ModerationService, QuotaGovernor, TokenBucket,
+    backoff_seconds, retry_after_seconds,
+)
+from app.database import Base, MessageStatus, ModerationJob, SpottedMessage
+from config import settings
+
+QUOTA_ERROR = ValueError("Quota API Gemini esaurita: 429 Resource has been exhausted (e.g. check quota). "
+                         "retry_delay {\n  seconds: 40\n}")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeModerator:
+    """Rifiuta tutto, oppure solleva `error`; registra i gruppi ricevuti."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.batches = []
+
+    def moderate_batch(self, items):
+        self.batches.append([message_id for message_id, _ in items])
+        if self.error:
+            raise self.error
+        return {message_id: ModerationResult("REJECT", "Insulto", "Hate Speech") for message_id, _ in items}
+
+    def moderate_message(self, text):
+        self.batches.append([text])
+        if self.error:
+            raise self.error
+        return ModerationResult("REJECT", "Insulto", "Hate Speech")
+
+
+@pytest.fixture
+def factory(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings.moderation, "cache_enabled", False)
+    engine = create_engine(f"sqlite:///{tmp_path / 'moderation.db'}")
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)
+
+
+def _messages(factory, count):
+    db = factory()
+    messages = [SpottedMessage(text=f"Messaggio numero {i}") for i in range(count)]
+    db.add_all(messages)
+    db.commit()
+    ids = [message.id for message in messages]
+    db.close()
+    return ids
+
+
+def test_token_buckets_delay_requests_and_tokens():
+    """Il governor fa attendere quando finiscono le richieste o i token al minuto."""
+    clock = FakeClock()
+    bucket = TokenBucket(60, clock=clock)
+    bucket.consume(60)
+    assert bucket.delay(1) == pytest.approx(1.0)
+    clock.now += 0.5
+    assert bucket.delay(1) == pytest.approx(0.5)
+
+    governor = QuotaGovernor(rpm=2, tpm=1000, clock=clock, sleep=clock.sleep)
+    started = clock.now
+    for _ in range(3):
+        asyncio.run(governor.acquire(100))
+    # La terza richiesta attende che si ricarichi una richiesta: 30 secondi con 2 al minuto
+    assert clock.now - started == pytest.approx(30.0)
+
+    governor = QuotaGovernor(rpm=100, tpm=600, clock=clock, sleep=clock.sleep)
+    started = clock.now
+    asyncio.run(governor.acquire(600))
+    asyncio.run(governor.acquire(300))
+    # 600 token al minuto: 300 token si ricaricano in 30 secondi
+    assert clock.now - started == pytest.approx(30.0)
+
+
+def test_admin_jobs_are_claimed_first(factory):
+    """Le rimoderazioni dell'admin passano davanti ai nuovi invii; i doppioni vengono accorpati."""
+    queue = ModerationQueue(factory)
+    first, second, third = _messages(factory, 3)
+    queue.submit(first)
+    queue.submit(second)
+    job_id = queue.submit(third)
+    assert queue.submit(third, priority=PRIORITY_ADMIN) == job_id
+
+    claimed = queue.claim(2)
+    assert [job.message_id for job in claimed] == [third, first]
+    assert queue.claim(5)[0].message_id == second
+    assert queue.claim(5) == []
+
+
+def test_quota_error_requeues_instead_of_approving(factory):
+    """Un 429 mette in pausa il servizio e rimette i messaggi in coda: nessuno viene approvato."""
+    clock = FakeClock()
+    moderator = FakeModerator(error=QUOTA_ERROR)
+    queue = ModerationQueue(factory)
+    service = ModerationService(queue, moderator_factory=lambda: moderator,
+                                governor=QuotaGovernor(rpm=15, tpm=100000, clock=clock, sleep=clock.sleep),
+                                batch_size=10, max_attempts=2)
+    ids = _messages(factory, 3)
+    for message_id in ids:
+        queue.submit(message_id)
+
+    asyncio.run(service.process(queue.claim(10)))
+    assert moderator.batches == [ids]
+    assert service.governor.paused_for() >= 40
+    db = factory()
+    jobs = db.query(ModerationJob).all()
+    assert {job.status for job in jobs} == {QUEUED}
+    assert all(job.not_before is not None for job in jobs)
+    assert {m.status for m in db.query(SpottedMessage)} == {MessageStatus.PENDING}
+    db.close()
+    # In backoff: nessun job è pronto
+    assert queue.claim(10) == []
+
+    # Raggiunto max_attempts il messaggio resta in PENDING per l'approvazione manuale
+    db = factory()
+    db.query(ModerationJob).update({ModerationJob.not_before: None})
+    db.commit()
+    db.close()
+    asyncio.run(service.process(queue.claim(10)))
+    db = factory()
+    messages = db.query(SpottedMessage).all()
+    assert {m.status for m in messages} == {MessageStatus.PENDING}
+    assert all("approvazione manuale" in m.gemini_analysis for m in messages)
+    assert service.stats()["queue_depth"] == 0
+    db.close()
+
+
+def test_results_applied_and_drain_time_reported(factory):
+    """Gli esiti aggiornano i messaggi; le statistiche stimano il tempo per svuotare la coda."""
+    moderator = FakeModerator()
+    queue = ModerationQueue(factory)
+    service = ModerationService(queue, moderator_factory=lambda: moderator,
+                                governor=QuotaGovernor(rpm=2, tpm=1000000), batch_size=5)
+    ids = _messages(factory, 12)
+    for message_id in ids:
+        queue.submit(message_id)
+
+    stats = service.stats()
+    assert stats["queue_depth"] == 12
+    # 12 messaggi in gruppi da 5 = 3 richieste, 2 al minuto = 90 secondi
+    assert stats["expected_drain_seconds"] == pytest.approx(90.0)
+
+    asyncio.run(service.process(queue.claim(5)))
+    db = factory()
+    statuses = {m.id: m.status for m in db.query(SpottedMessage)}
+    db.close()
+    assert [statuses[i] for i in ids[:5]] == [MessageStatus.REJECTED] * 5
+    assert service.stats()["queue_depth"] == 7
+
+
+def test_retry_after_and_backoff():
+    """Il Retry-After di Gemini viene rispettato; senza, backoff esponenziale con jitter."""
+    assert retry_after_seconds(QUOTA_ERROR) == 40
+    assert retry_after_seconds("429 quota exceeded. Please retry in 12.5s.") == 12.5
+    assert retry_after_seconds("429 quota exceeded") is None
+    assert 40 <= backoff_seconds(1, retry_after=40, maximum=300) <= 48
+    for attempt, ceiling in [(1, 5), (2, 10), (3, 20), (10, 300)]:
+        assert ceiling / 2 <= backoff_seconds(attempt, base=5, maximum=300) <= ceiling
+
+
+@pytest.fixture
+def admin_client(factory, monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    import app.admin.routes as admin_routes
+    import app.ai.service as service_module
+
+    def get_db():
+        db = factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    api = FastAPI()
+    api.include_router(admin_routes.router)
+    api.dependency_overrides[admin_routes.get_db] = get_db
+    api.dependency_overrides[admin_routes.get_authenticated_user] = lambda: "admin"
+    monkeypatch.setattr(service_module, "_service", ModerationService(ModerationQueue(factory)))
+    return TestClient(api)
+
+
+@pytest.mark.parametrize("status", [MessageStatus.POSTED, MessageStatus.APPROVED, MessageStatus.REJECTED])
+def test_remoderation_refuses_decided_messages(factory, admin_client, status):
+    """Un messaggio pubblicato, approvato o rifiutato non può tornare in moderazione (e quindi essere riapprovato)."""
+    message_id, = _messages(factory, 1)
+    db = factory()
+    db.get(SpottedMessage, message_id).status = status
+    db.commit()
+    db.close()
+
+    assert admin_client.post(f"/admin/messages/{message_id}/remoderate").status_code == 409
+    assert ModerationQueue(factory).backlog()["depth"] == 0
+
+
+def test_remoderation_requeues_review_message_at_admin_priority(factory, admin_client):
+    """Un messaggio in revisione torna PENDING e va in coda davanti ai nuovi invii; un duplicato segnalato no."""
+    fresh, review, duplicate = _messages(factory, 3)
+    queue = ModerationQueue(factory)
+    queue.submit(fresh)
+    db = factory()
+    db.get(SpottedMessage, review).status = MessageStatus.REVIEW
+    db.get(SpottedMessage, duplicate).status = MessageStatus.REVIEW
+    db.get(SpottedMessage, duplicate).duplicate_of_id = fresh
+    db.commit()
+    db.close()
+
+    response = admin_client.post(f"/admin/messages/{review}/remoderate")
+    assert response.status_code == 200 and response.json()["job_id"]
+    assert admin_client.post(f"/admin/messages/{duplicate}/remoderate").status_code == 409
+    db = factory()
+    assert db.get(SpottedMessage, review).status == MessageStatus.PENDING
+    db.close()
+    assert [job.message_id for job in queue.claim(5)] == [review, fresh]
+
+
+def test_remoderation_without_service_moderates_directly(factory, admin_client, monkeypatch):
+    """Con il servizio disattivato nessun job resta in coda: la moderazione parte in background."""
+    import app.admin.routes as admin_routes
+    calls = []
+    monkeypatch.setattr(settings.moderation, "service_enabled", False)
+    monkeypatch.setattr(admin_routes, "moderate_message_task", calls.append)
+    message_id, = _messages(factory, 1)
+
+    response = admin_client.post(f"/admin/messages/{message_id}/remoderate")
+    assert response.status_code == 200 and "job_id" not in response.json()
+    assert calls == [message_id]
+    assert ModerationQueue(factory).backlog()["depth"] == 0
+
+
+def test_service_never_touches_posted_message(factory):
+    """Anche con un job dell'admin già in coda, un messaggio pubblicato nel frattempo non viene rimoderato."""
+    moderator = FakeModerator()
+    queue = ModerationQueue(factory)
+    service = ModerationService(queue, moderator_factory=lambda: moderator, governor=QuotaGovernor(rpm=60, tpm=100000))
+    message_id, = _messages(factory, 1)
+    queue.submit(message_id, priority=PRIORITY_ADMIN)
+    db = factory()
+    db.get(SpottedMessage, message_id).status = MessageStatus.POSTED
+    db.commit()
+    db.close()
+
+    asyncio.run(service.process(queue.claim(5)))
+    assert moderator.batches == []
+    db = factory()
+    assert db.get(SpottedMessage, message_id).status == MessageStatus.POSTED
+    db.close()
@@ -0,0 +1,84 @@
+"""
+Test del moderatore Gemini condiviso dal processo (modello in memoria, nuovo tentativo solo su 404).
+RUN: pytest tests/test_moderator.py -v
+"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import app.ai.gemini_moderator as gemini_moderator
+from app.ai.gemini_moderator import GeminiModerator, get_moderator
+
+
+class FakeGenAI:
+    """Sostituto di google.generativeai: conta configure e modelli creati."""
+
+    def __init__(self, missing=()):
+        self.missing = set(missing)
+        self.configured = 0
+        self.models = []
+        self.calls = []
+
+    def configure(self, api_key):
+        self.configured += 1
+
+    def GenerationConfig(self, **kwargs):
+        return kwargs
+
+    def GenerativeModel(self, name, generation_config=None, system_instruction=None):
+        self.models.append(name)
+        fake = self
+
+        class Model:
+            def generate_content(self, prompt):
+                fake.calls.append(name)
+                if name in fake.missing:
+                    raise Exception(f"404 models/{name} is not found for API version v1beta")
+                return SimpleNamespace(text='{"decision": "approve", "reason": "ok", "category": "Safe"}')
+
+        return Model()
+
+
+@pytest.fixture
+def genai(monkeypatch):
+    fake = FakeGenAI(missing={"gemini-2.0-flash-exp"})
+    monkeypatch.setattr(gemini_moderator, "genai", fake)
+    monkeypatch.setattr(gemini_moderator.settings, "gemini_api_key", "test-key")
+    monkeypatch.setattr(gemini_moderator, "_moderator", None)
+    return fake
+
+
+def test_singleton_is_shared_between_threads(genai):
+    """Tutti i thread ricevono la stessa istanza e la configurazione avviene una volta."""
+    instances = []
+    threads = [threading.Thread(target=lambda: instances.append(get_moderator())) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len({id(instance) for instance in instances}) == 1
+    assert genai.configured == 1
+
+
+def test_model_is_reprobed_only_on_404(genai):
+    """Dopo un 404 si passa al modello successivo, che viene poi riusato senza ricrearlo."""
+    moderator = get_moderator()
+    for _ in range(3):
+        assert moderator.moderate_message("Spotto una ragazza in biblioteca").decision == "APPROVE"
+
+    assert genai.models == ["gemini-2.0-flash-exp", "gemini-1.5-flash-latest"]
+    assert genai.calls == ["gemini-2.0-flash-exp"] + ["gemini-1.5-flash-latest"] * 3
+    assert moderator.model_name == "gemini-1.5-flash-latest"
+
+
+def test_all_models_missing_raises(genai):
+    """Se nessun modello esiste l'errore arriva al task, che lascia il messaggio in attesa."""
+    genai.missing = {"a", "b"}
+    moderator = GeminiModerator(models=["a", "b"])
+
+    with pytest.raises(ValueError, match="non disponibili"):
+        moderator.moderate_message("ciao")
+    assert genai.models == ["a", "b"]
@@ -0,0 +1,49 @@
+"""
+Test del filtro locale che precede la moderazione AI (link, pubblicità, spam).
+RUN: pytest tests/test_prefilter.py -v
+"""
+
+import pytest
+
+from app.ai.prefilter import AhoCorasick, Prefilter
+
+
+def test_automaton_finds_overlapping_keywords():
+    """L'automa trova tutte le occorrenze, anche sovrapposte o contenute in altre parole chiave."""
+    automaton = AhoCorasick({"he": 1, "she": 2, "hers": 3, "his": 4})
+    found = sorted((end, keyword) for end, keyword, _ in automaton.search("ushers"))
+    assert found == [(3, "he"), (3, "she"), (5, "hers")]
+
+
+@pytest.mark.parametrize("text, category, rule", [
+    ("Comprate gli integratori su www.superfit.com!", "Link", "www"),
+    ("andate su https://esempio.org/promo", "Link", "url"),
+    ("visitate superfit.it per vincere", "Link", "domain"),
+    ("scrivetemi, trovate tutto al link in bio", "Link", "keyword:link in bio"),
+    ("Usate il mio CODICE SCONTO mario10!", "Advertisement", "keyword:codice sconto"),
+    ("asdfghjkl asdfghjkl qwertyuiop", "Spam", "keyboard_mash"),
+    ("ahahahahahahahahahahah", "Spam", "low_entropy"),
+    ("ciao ciao ciao ciao ciao ciao ciao", "Spam", "repeated_word"),
+])
+def test_clear_violations_are_rejected(text, category, rule):
+    """I casi certi vengono rifiutati con la categoria di ModerationResult e contati per regola."""
+    prefilter = Prefilter()
+    result = prefilter.check(text)
+
+    assert (result.decision, result.category) == ("REJECT", category)
+    assert prefilter.stats()["hits"] == {rule: 1}
+
+
+@pytest.mark.parametrize("text", [
+    "Spotto un ragazzo altissimo con gli occhiali alla fermata del bus stamattina.",
+    "Marco sei un cretino, quello che hai fatto non si fa.",
+    "era bello.Io ti amo",
+    "ti amoooooooo tantissimo, noooo",
+    "ci vediamo alle 10.30 in aula 2B",
+    "la ragazza del supromo codex",
+])
+def test_ambiguous_messages_go_to_gemini(text):
+    """Messaggi normali, insulti e casi dubbi non vengono decisi in locale."""
+    prefilter = Prefilter()
+    assert prefilter.check(text) is None
+    assert prefilter.stats()["forwarded"] == 1
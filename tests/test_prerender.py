@@ -0,0 +1,93 @@
+"""
+Test del pre-render delle card all'approvazione.
+RUN: pytest tests/test_prerender.py -v
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+import app.tasks
+from app.database import MessageType
+from app.tasks import card_for_message, get_prerendered_card, invalidate_card
+
+
+class FakeStore:
+    """Archivio che lascia il file dov'è: qui interessa solo la logica di riuso."""
+
+    def put(self, path, kind, message_ids=(), role=None):
+        from app.image.store import StoredAsset, file_sha256
+        return StoredAsset(path, file_sha256(path), 0)
+
+
+@pytest.fixture(autouse=True)
+def fake_store(monkeypatch):
+    monkeypatch.setattr(app.tasks, "get_asset_store", FakeStore)
+
+
+class FakeGenerator:
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+        self.calls = 0
+
+    def from_text(self, text, filename, message_id, message_type="spotted", title=None):
+        self.calls += 1
+        path = self.tmp_path / filename
+        path.write_bytes(text.encode())
+        return str(path)
+
+    def render_frames(self, text, base_filename, message_id, message_type="spotted", title=None):
+        return [self.from_text(text, f"{base_filename}.png", message_id, message_type, title)]
+
+
+def _message():
+    return SimpleNamespace(id=7, text="Ciao", title=None, message_type=MessageType.SPOTTED,
+                           card_path=None, card_hash=None, card_frames=None, card_template_version=None,
+                           card_rendered_at=None)
+
+
+def test_card_is_rendered_once_and_reused(tmp_path):
+    """La prima richiesta genera e registra la card, le successive la riusano."""
+    generator = FakeGenerator(tmp_path)
+    message = _message()
+
+    path = card_for_message(message, generator)
+    assert message.card_path == path and message.card_hash
+    assert card_for_message(message, generator) == path
+    assert generator.calls == 1
+
+
+def test_altered_or_missing_file_is_not_reused(tmp_path):
+    """Se il file non corrisponde più all'hash registrato la card va rigenerata."""
+    message = _message()
+    path = card_for_message(message, FakeGenerator(tmp_path))
+
+    with open(path, "wb") as f:
+        f.write(b"altro")
+    assert get_prerendered_card(message) is None
+
+
+def test_invalidate_clears_card(tmp_path):
+    """Dopo una modifica del testo la card registrata viene dimenticata."""
+    message = _message()
+    card_for_message(message, FakeGenerator(tmp_path))
+
+    invalidate_card(message)
+    assert message.card_path is None and message.card_hash is None
+    assert get_prerendered_card(message) is None
+
+
+@pytest.mark.parametrize("status, prerendered", [
+    (app.tasks.MessageStatus.APPROVED, [7]),
+    (app.tasks.MessageStatus.REJECTED, []),
+    (app.tasks.MessageStatus.PENDING, []),
+    (None, []),
+])
+def test_prerender_only_after_approval(monkeypatch, status, prerendered):
+    """Dopo la moderazione la card viene pre-renderizzata solo se il messaggio è approvato."""
+    calls = []
+    monkeypatch.setattr(app.tasks, "_moderate_message", lambda message_id: status)
+    monkeypatch.setattr(app.tasks, "prerender_card_task", calls.append)
+
+    app.tasks.moderate_message_task(7)
+    assert calls == prerendered
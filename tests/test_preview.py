@@ -0,0 +1,65 @@
+"""
+Test delle anteprime veloci delle info card (scala ridotta, debounce per sessione).
+RUN: pytest tests/test_preview.py -v
+"""
+
+import threading
+import time
+
+from app.image.generator import ImageGenerator, PreviewImage
+from app.image.preview import PreviewService
+
+
+def _fake_render(calls):
+    def render(message_type, title, text):
+        calls.append(text)
+        time.sleep(0.05)
+        return PreviewImage(text.encode(), "fake", 10, 10, 50.0)
+    return render
+
+
+def test_burst_from_one_session_renders_latest_text_once():
+    """Le digitazioni ravvicinate di una sessione producono un solo render, dell'ultimo testo."""
+    calls = []
+    service = PreviewService(render_fn=_fake_render(calls), debounce_ms=100)
+    results = []
+
+    def ask(text):
+        results.append(service.request("admin", "Titolo", text).data)
+
+    threads = []
+    for text in ("C", "Ci", "Cia", "Ciao"):
+        thread = threading.Thread(target=ask, args=(text,))
+        thread.start()
+        threads.append(thread)
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+
+    assert calls == ["Ciao"]
+    assert results == [b"Ciao"] * 4
+    assert service.stats()["coalesced"] == 3
+
+
+def test_sessions_are_independent_and_cached():
+    """Sessioni diverse non si raggruppano; lo stesso testo viene servito dalla memoria."""
+    calls = []
+    service = PreviewService(render_fn=_fake_render(calls), debounce_ms=0)
+
+    service.request("a", "Titolo", "uno")
+    service.request("b", "Titolo", "due")
+    service.request("b", "Titolo", "uno")
+
+    assert calls == ["uno", "due"]
+    assert service.stats()["cache_hits"] == 1
+
+
+def test_render_preview_is_small_jpeg_in_memory(monkeypatch):
+    """L'anteprima è un JPEG a un terzo della risoluzione, senza file su disco."""
+    generator = ImageGenerator()
+    monkeypatch.setattr(generator.backends, "route", lambda template: ["pil"])
+
+    preview = generator.render_preview("Anteprima veloce", title="Titolo", scale=0.33)
+
+    assert preview.data[:3] == b"\xff\xd8\xff"
+    assert (preview.width, preview.height) == (356, 633)
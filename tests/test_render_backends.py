@@ -0,0 +1,61 @@
+"""
+Test del registro dei backend di rendering (routing e circuit breaker).
+RUN: pytest tests/test_render_backends.py -v
+"""
+
+import pytest
+
+from app.image.backends import BackendRegistry
+
+
+@pytest.fixture
+def registry():
+    registry = BackendRegistry(failure_threshold=2, cooldown_seconds=60)
+    for state in registry.states.values():
+        state.available = True
+    return registry
+
+
+def test_route_prefers_fastest_supported_backend(registry):
+    """Il backend HTML più veloce viene provato per primo, PIL sempre per ultimo."""
+    registry.record_success("wkhtmltoimage", 0.9)
+    registry.record_success("playwright", 0.3)
+
+    assert registry.route("card_v5_fixed.html") == ["playwright", "wkhtmltoimage", "pil"]
+
+
+def test_browser_only_template_skips_wkhtmltoimage_first(registry):
+    """Un template che richiede Chromium non viene instradato prima su wkhtmltoimage."""
+    registry.record_success("wkhtmltoimage", 0.1)
+    registry.record_success("playwright", 2.0)
+
+    route = registry.route("card_v11_celestial.html")
+    assert route[0] == "playwright"
+    assert route[-1] == "pil"
+
+
+def test_breaker_opens_after_repeated_failures(registry):
+    """Dopo N errori consecutivi il backend resta escluso per il cooldown."""
+    registry.record_failure("wkhtmltoimage", RuntimeError("boom"))
+    assert registry.allow("wkhtmltoimage")
+
+    registry.record_failure("wkhtmltoimage", RuntimeError("boom"))
+    assert not registry.allow("wkhtmltoimage")
+    assert registry.allow("pil")
+    assert registry.stats()["backends"]["wkhtmltoimage"]["breaker"] == "open"
+
+
+class FailingGenerator:
+    def render_with_backend(self, name, text, output_path, message_id):
+        raise TimeoutError("Chromium lento all'avvio")
+
+
+def test_failed_canary_opens_breaker_instead_of_disabling(registry):
+    """Un canary fallito apre il breaker: il backend resta disponibile e torna dopo il cooldown."""
+    registry.probe(FailingGenerator(), ["playwright"])
+
+    state = registry.states["playwright"]
+    assert state.available
+    assert not registry.allow("playwright")
+    state.open_until = 1.0  # Cooldown trascorso
+    assert registry.allow("playwright")
@@ -0,0 +1,81 @@
+"""
+Test della cache content-addressed delle card generate.
+RUN: pytest tests/test_render_cache.py -v
+"""
+
+import os
+import time
+
+import pytest
+
+from app.image.cache import RenderCache
+
+
+@pytest.fixture
+def template(tmp_path):
+    path = tmp_path / "card.html"
+    path.write_text("<html>{{ message }}</html>")
+    return str(path)
+
+
+def _fake_render(tmp_path, name, size=100):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+def test_hit_after_put(tmp_path, template):
+    """Una card messa in cache viene restituita allo stesso percorso."""
+    cache = RenderCache(cache_dir=str(tmp_path / "cache"), max_bytes=10_000)
+    key = cache.make_key(template, "spotted", "Ciao", 1, None)
+
+    assert cache.get(key) is None
+    cached = cache.put(key, _fake_render(tmp_path, "out.png"))
+
+    assert cache.get(key) == cached
+    assert os.path.exists(cached)
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_key_depends_on_inputs_and_template(tmp_path, template):
+    """Testo, id e contenuto del template cambiano la chiave."""
+    cache = RenderCache(cache_dir=str(tmp_path / "cache"), max_bytes=10_000)
+    base = cache.make_key(template, "spotted", "Ciao", 1, None)
+
+    assert base == cache.make_key(template, "spotted", "Ciao", 1, None)
+    assert base != cache.make_key(template, "spotted", "Ciao!", 1, None)
+    assert base != cache.make_key(template, "spotted", "Ciao", 2, None)
+
+    time.sleep(0.01)
+    with open(template, "w") as f:
+        f.write("<html><b>{{ message }}</b></html>")
+    os.utime(template, (time.time() + 5, time.time() + 5))
+    assert base != cache.make_key(template, "spotted", "Ciao", 1, None)
+
+
+def test_lru_eviction_respects_byte_budget(tmp_path, template):
+    """Oltre il limite di byte viene eliminata la card usata meno di recente."""
+    cache = RenderCache(cache_dir=str(tmp_path / "cache"), max_bytes=250)
+    keys = [cache.make_key(template, "spotted", f"msg {i}", i, None) for i in range(3)]
+
+    first = cache.put(keys[0], _fake_render(tmp_path, "0.png"))
+    cache.put(keys[1], _fake_render(tmp_path, "1.png"))
+    cache.get(keys[0])  # keys[0] diventa il più recente
+    cache.put(keys[2], _fake_render(tmp_path, "2.png"))
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == first
+    assert cache.stats()["evictions"] == 1
+    assert cache.stats()["bytes"] <= 250
+
+
+def test_index_rebuilt_from_disk(tmp_path, template):
+    """Una nuova istanza ritrova le card già presenti su disco."""
+    cache_dir = str(tmp_path / "cache")
+    cache = RenderCache(cache_dir=cache_dir, max_bytes=10_000)
+    key = cache.make_key(template, "spotted", "Ciao", 1, None)
+    cached = cache.put(key, _fake_render(tmp_path, "out.png"))
+
+    reloaded = RenderCache(cache_dir=cache_dir, max_bytes=10_000)
+    assert reloaded.get(key) == cached
@@ -0,0 +1,139 @@
+"""
+Test della coda durevole dei job di rendering e del servizio che li esegue.
+RUN: pytest tests/test_render_queue.py -v
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import app.image.jobs as jobs
+from app.database import Base, RenderJob, RenderWorker
+from app.image.jobs import (
+    PRIORITY_INTERACTIVE, PRIORITY_PREVIEW, QUEUED,
+    RenderJobError, RenderQueue, RenderQueueFull, RenderService, renders_inline,
+)
+from config import settings
+
+
+@pytest.fixture
+def queue(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'jobs.db'}", connect_args={"check_same_thread": False})
+    Base.metadata.create_all(bind=engine)
+    return RenderQueue(session_factory=sessionmaker(bind=engine), max_depth=3, block_seconds=0)
+
+
+def test_claim_follows_priority_and_dedup(queue):
+    """I job vengono presi per priorità; un duplicato ancora in coda riusa il job esistente."""
+    card = queue.submit("card", {"message_id": 1}, dedup_key="prerender:1")
+    assert queue.submit("card", {"message_id": 1}, dedup_key="prerender:1") == card
+    preview = queue.submit("preview", {"text": "ciao"}, priority=PRIORITY_PREVIEW)
+    post = queue.submit("card", {"message_id": 2}, priority=PRIORITY_INTERACTIVE)
+
+    assert [queue.claim("w").id for _ in range(3)] == [preview, post, card]
+    assert queue.claim("w") is None
+
+
+def test_full_queue_applies_backpressure(queue):
+    """Oltre la profondità massima chi accoda riceve RenderQueueFull dopo l'attesa concessa."""
+    for message_id in range(3):
+        queue.submit("card", {"message_id": message_id})
+
+    started = time.monotonic()
+    with pytest.raises(RenderQueueFull):
+        queue.submit("card", {"message_id": 9}, block_seconds=0.3)
+    assert time.monotonic() - started >= 0.3
+    assert queue.stats()["rejected"] == 1
+
+
+def test_expired_job_is_never_run(queue):
+    """Un job scaduto in coda viene chiuso senza eseguirlo e chi lo attende riceve l'errore."""
+    job_id = queue.submit("card", {"message_id": 1}, deadline_seconds=0.05)
+    time.sleep(0.1)
+
+    assert queue.claim("w") is None
+    with pytest.raises(RenderJobError):
+        queue.wait(job_id, timeout=1)
+
+
+def test_service_runs_jobs_and_enforces_deadline(queue):
+    """Il servizio restituisce risultati e immagini; un render troppo lungo viene chiuso alla scadenza."""
+    def slow(payload):
+        time.sleep(0.5)
+        return {"path": "lenta.png"}
+
+    handlers = {"preview": lambda payload: ({"text": payload["text"]}, b"jpeg"), "slow": slow}
+    service = RenderService(handlers, queue=queue, concurrency=2, worker_id="w")
+    fast = queue.submit("preview", {"text": "ciao"})
+    stuck = queue.submit("slow", deadline_seconds=0.2)
+
+    give_up = time.monotonic() + 2
+    while time.monotonic() < give_up and (service.done < 1 or service.expired < 1):
+        service.run_once()
+        time.sleep(0.02)
+
+    result = queue.wait(fast, timeout=1)
+    assert (result.result, result.blob) == ({"text": "ciao"}, b"jpeg")
+    with pytest.raises(RenderJobError, match="Scadenza"):
+        queue.wait(stuck, timeout=1)
+    service.stop()
+
+
+def test_jobs_of_dead_service_are_requeued(queue):
+    """I job in esecuzione su un servizio senza heartbeat tornano in coda."""
+    job_id = queue.submit("card", {"message_id": 1})
+    queue.claim("morto")
+    db = queue.session_factory()
+    db.add(RenderWorker(id="morto", last_seen_at=datetime.utcnow() - timedelta(minutes=5)))
+    db.commit()
+    db.close()
+
+    assert queue.recover_orphans() == 1
+    db = queue.session_factory()
+    assert db.get(RenderJob, job_id).status == QUEUED
+    db.close()
+
+
+def test_renders_inline_unless_a_render_service_is_expected(queue, monkeypatch):
+    """Senza RENDER_SERVICE il web accoda i render solo se un servizio di rendering è attivo."""
+    monkeypatch.setattr(jobs, "_inline", False)
+    monkeypatch.setattr(jobs, "get_render_queue", lambda: queue)
+
+    monkeypatch.setattr(settings.image, "render_service_enabled", None)
+    monkeypatch.setattr(jobs, "_live_check", (0.0, False))
+    assert renders_inline()
+
+    db = queue.session_factory()
+    db.add(RenderWorker(id="host:1", last_seen_at=datetime.utcnow()))
+    db.commit()
+    db.close()
+    monkeypatch.setattr(jobs, "_live_check", (0.0, False))
+    assert not renders_inline()
+
+    monkeypatch.setattr(settings.image, "render_service_enabled", False)
+    assert renders_inline()
+    monkeypatch.setattr(settings.image, "render_service_enabled", True)
+    monkeypatch.setattr(jobs, "_live_check", (0.0, False))
+    assert not renders_inline()
+
+
+def test_album_larger_than_queue_is_submitted_in_chunks(queue, monkeypatch):
+    """Un album con più card mancanti della profondità della coda non fallisce: le card si accodano a gruppi."""
+    import app.tasks as tasks
+    from types import SimpleNamespace
+
+    def wait(job_id, timeout=None):
+        db = queue.session_factory()
+        db.get(RenderJob, job_id).status = "done"
+        db.commit()
+        db.close()
+    monkeypatch.setattr(queue, "wait", wait)
+    monkeypatch.setattr(tasks, "get_render_queue", lambda: queue)
+    monkeypatch.setattr(tasks, "get_prerendered_card", lambda msg: f"card_{msg.id}.png")
+    messages = [SimpleNamespace(id=i) for i in range(8)]
+
+    outcomes = tasks._request_cards(SimpleNamespace(refresh=lambda msg: None), messages)
+    assert [(msg.id, path, error) for msg, path, error in outcomes] == [(i, f"card_{i}.png", None) for i in range(8)]
@@ -0,0 +1,142 @@
+"""
+Test dei messaggi lunghi divisi in fotogrammi (paginazione, render PIL, pubblicazione in sequenza).
+RUN: pytest tests/test_story_frames.py -v
+"""
+
+from types import SimpleNamespace
+
+import pytest
+from PIL import Image
+
+import app.tasks
+from app.bot.poster import InstagramBot
+from app.database import MessageType
+from app.image.generator import ImageGenerator
+from app.image.layout import get_font, needs_pagination, paginate_text, wrap_text
+from app.tasks import card_for_message, get_prerendered_card, story_frames
+
+LONG_TEXT = (
+    "Ieri sera alla festa di facoltà ho conosciuto una ragazza con la giacca verde. "
+    "Abbiamo parlato per ore di libri, di viaggi e di quanto sia difficile l'esame di analisi. "
+    "Poi è arrivato il suo autobus e non le ho chiesto il numero!\n\n"
+) * 6
+
+
+def test_pages_fit_and_keep_every_word():
+    """Ogni pagina sta nel riquadro; riunite, le pagine contengono tutte le parole in ordine."""
+    pages = paginate_text(LONG_TEXT, max_width=720, max_height=1000, size=52)
+    font = get_font(size=52)
+
+    assert len(pages) > 1
+    assert all(len(wrap_text(page, font, 720)) * 78 <= 1000 for page in pages)
+    assert " ".join(pages).split() == LONG_TEXT.split()
+    # Le pagine si chiudono a fine frase quando possibile
+    assert all(page.rstrip().endswith((".", "!", "?")) for page in pages)
+
+
+def test_short_text_is_not_paginated_and_long_one_is_capped():
+    """Un testo che sta in una card resta intero; oltre il massimo l'ultima pagina finisce con "…"."""
+    assert not needs_pagination("Ciao a tutti!", 720, 1371, 44)
+    assert ImageGenerator().paginate("Ciao a tutti!") == ["Ciao a tutti!"]
+
+    pages = paginate_text(LONG_TEXT, max_width=720, max_height=400, size=52, max_pages=3)
+    assert len(pages) == 3 and pages[-1].endswith("…")
+
+
+def test_pil_frames_share_layout(tmp_path):
+    """Il fallback PIL produce un fotogramma a piena risoluzione per pagina, nell'ordine."""
+    generator = ImageGenerator()
+    pages = generator.paginate(LONG_TEXT)[:2]
+    paths = generator._frames_with_pil(pages, [str(tmp_path / f"f{i}.png") for i in (1, 2)], 7, "spotted", None)
+
+    assert [p.rsplit("/", 1)[-1].split(".")[0] for p in paths] == ["f1", "f2"]
+    with Image.open(paths[0]) as first, Image.open(paths[1]) as second:
+        assert first.size == second.size == (1080, 1920)
+        assert first.tobytes() != second.tobytes()
+
+
+class FakeStore:
+    def put(self, path, kind, message_ids=(), role=None):
+        from app.image.store import StoredAsset, file_sha256
+        return StoredAsset(path, file_sha256(path), 0)
+
+
+class FrameGenerator:
+    def __init__(self, tmp_path):
+        self.tmp_path = tmp_path
+
+    def render_frames(self, text, base_filename, message_id, message_type="spotted", title=None):
+        paths = []
+        for i in (1, 2, 3):
+            path = self.tmp_path / f"{base_filename}_f{i}.png"
+            path.write_bytes(f"{text}:{i}".encode())
+            paths.append(str(path))
+        return paths
+
+
+def test_frames_are_recorded_and_validated(tmp_path, monkeypatch):
+    """I fotogrammi vengono registrati sul messaggio; se uno manca la card va rigenerata."""
+    monkeypatch.setattr(app.tasks, "get_asset_store", FakeStore)
+    monkeypatch.setattr(app.tasks, "_card_phash", lambda path: None)
+    message = SimpleNamespace(id=7, text="lungo", title=None, message_type=MessageType.SPOTTED,
+                              card_path=None, card_hash=None, card_frames=None, card_template_version=None,
+                              card_rendered_at=None)
+
+    first = card_for_message(message, FrameGenerator(tmp_path))
+    frames = story_frames(message)
+    assert frames[0] == first and [f.rsplit("_", 1)[-1] for f in frames] == ["f1.png", "f2.png", "f3.png"]
+    assert get_prerendered_card(message) == first
+
+    (tmp_path / "spotted_7_f3.png").unlink()
+    assert get_prerendered_card(message) is None
+
+
+def _bot(results):
+    bot = InstagramBot.__new__(InstagramBot)
+    bot.post_story = lambda path: results.pop(0)
+    return bot
+
+
+def test_story_sequence_is_posted_in_order():
+    """La sequenza restituisce il pk del primo fotogramma; un'interruzione a metà viene segnalata."""
+    assert _bot(["1", "2", "3"]).post_story_sequence(["a", "b", "c"]) == "1"
+    assert _bot([None]).post_story_sequence(["a", "b"]) is None
+    with pytest.raises(RuntimeError, match="fotogramma 2/2"):
+        _bot(["1", None]).post_story_sequence(["a", "b"])
+
+
+class FailingBot:
+    def post_album(self, image_paths, caption):
+        return None
+
+
+def test_album_render_records_every_frame(tmp_path, monkeypatch):
+    """Un messaggio lungo renderizzato per l'album registra tutti i fotogrammi: se l'album fallisce la storia resta completa."""
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+
+    from app.database import Base, MessageStatus, SpottedMessage
+
+    engine = create_engine(f"sqlite:///{tmp_path / 'album.db'}")
+    Base.metadata.create_all(bind=engine)
+    db = sessionmaker(bind=engine)()
+    message = SpottedMessage(text=LONG_TEXT, status=MessageStatus.APPROVED)
+    db.add(message)
+    db.commit()
+
+    monkeypatch.setattr(app.tasks, "renders_inline", lambda: True)
+    monkeypatch.setattr(app.tasks, "get_asset_store", FakeStore)
+    monkeypatch.setattr(app.tasks, "_card_phash", lambda path: None)
+    monkeypatch.setattr(app.tasks, "check_duplicate", lambda *args: False)
+    monkeypatch.setattr(ImageGenerator, "render_frames",
+                        lambda self, *args, **kwargs: FrameGenerator(tmp_path).render_frames(*args, **kwargs))
+    monkeypatch.setattr(app.tasks, "INSTAGRAM_BOT_AVAILABLE", True)
+    monkeypatch.setattr(app.tasks, "InstagramBot", FailingBot, raising=False)
+
+    assert app.tasks.post_daily_compilation(db)["status"] == "error"
+    db.refresh(message)
+    assert message.status == MessageStatus.APPROVED
+    frames = story_frames(message)
+    assert [f.rsplit("_", 1)[-1] for f in frames] == ["f1.png", "f2.png", "f3.png"]
+    assert get_prerendered_card(message) == frames[0]
+    db.close()
@@ -0,0 +1,91 @@
+"""
+Test del renderer HTML condiviso delle card.
+RUN: pytest tests/test_template_renderer.py -v
+"""
+
+import pytest
+
+from config import settings
+from app.image.renderer import TemplateRenderer
+
+
+def test_all_templates_precompile(tmp_path):
+    """Tutti i template della cartella vengono compilati senza errori."""
+    renderer = TemplateRenderer(bytecode_dir=str(tmp_path))
+    compiled = renderer.precompile()
+
+    assert compiled == len(renderer.env.list_templates(extensions=["html"]))
+    assert any(tmp_path.iterdir())  # bytecode cache scritta su disco
+
+
+def test_font_is_inlined(tmp_path):
+    """Il font arriva nel template come data URI, senza percorsi file://."""
+    renderer = TemplateRenderer(bytecode_dir=str(tmp_path))
+    html = renderer.render("Ciao", 42)
+
+    assert "data:font/ttf;base64," in html
+    assert "file://" not in html
+    assert "Ciao" in html
+
+
+def test_info_card_renders(tmp_path):
+    """La card info usa il proprio template e il filtro strftime."""
+    renderer = TemplateRenderer(bytecode_dir=str(tmp_path))
+    html = renderer.render("Manutenzione", 0, message_type="info", title="Avviso")
+
+    assert "Avviso" in html
+    assert "data:font/ttf;base64," in html
+
+
+@pytest.fixture
+def templates_dir(tmp_path):
+    directory = tmp_path / "templates"
+    (directory / "fonts").mkdir(parents=True)
+    (directory / "fonts" / "Komika_Axis.ttf").write_bytes(b"font")
+    (directory / "base.html").write_text("<p>{{ message }}</p>")
+    (directory / "card_a.html").write_text("A {% include 'base.html' %}")
+    (directory / "card_b.html").write_text("B {{ message }}")
+    return directory
+
+
+@pytest.fixture
+def restore_template_path(monkeypatch):
+    monkeypatch.setattr(settings.image, "template_path", settings.image.template_path)
+
+
+def _renderer(tmp_path, templates_dir):
+    return TemplateRenderer(templates_dir=str(templates_dir), bytecode_dir=str(tmp_path / "bytecode"),
+                            active_file=str(tmp_path / "active"))
+
+
+def test_change_to_included_template_bumps_dependents(tmp_path, templates_dir):
+    """Modificare un template incluso (o un font) cambia la versione di chi lo usa e lo ricompila."""
+    renderer = _renderer(tmp_path, templates_dir)
+    before = {name: renderer.template_version(name) for name in ("card_a.html", "card_b.html")}
+
+    (templates_dir / "base.html").write_text("<div>{{ message }}</div>")
+    assert renderer.check_for_changes() == ["base.html"]
+
+    assert renderer.template_version("card_a.html") != before["card_a.html"]
+    assert renderer.template_version("card_b.html") == before["card_b.html"]
+    assert "<div>ciao</div>" in renderer.env.get_template("card_a.html").render(message="ciao")
+
+    (templates_dir / "fonts" / "Komika_Axis.ttf").write_bytes(b"nuovo font")
+    renderer.check_for_changes()
+    assert renderer.template_version("card_b.html") != before["card_b.html"]
+
+
+def test_active_template_switch_is_shared(tmp_path, templates_dir, restore_template_path):
+    """Il cambio di template arriva agli altri processi tramite il file condiviso."""
+    renderer = _renderer(tmp_path, templates_dir)
+    other = _renderer(tmp_path, templates_dir)
+
+    renderer.set_active_template("card_b.html")
+    assert renderer.render("ciao", 1) == "B ciao"
+
+    settings.image.template_path = str(templates_dir / "card_a.html")
+    other.check_for_changes()
+    assert other.active_template == "card_b.html"
+
+    with pytest.raises(ValueError):
+        renderer.set_active_template("inesistente.html")
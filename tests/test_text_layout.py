@@ -0,0 +1,52 @@
+"""
+Test del motore di layout del testo delle card PIL.
+RUN: pytest tests/test_text_layout.py -v
+"""
+
+from app.image.layout import fit_text, get_font, wrap_text, word_width
+
+
+def test_fonts_are_shared():
+    """Lo stesso (percorso, dimensione) restituisce la stessa istanza."""
+    assert get_font(size=40) is get_font(size=40)
+
+
+def test_wrap_respects_width_and_newlines():
+    """Nessuna riga supera la larghezza e gli a capo espliciti restano."""
+    font = get_font(size=40)
+    lines = wrap_text("Titolo\n\nSpotto una ragazza con un libro di poesie alla fermata", font, 300)
+
+    assert lines[0] == "Titolo"
+    assert lines[1] == ""
+    assert all(word_width(font, line) <= 300 for line in lines)
+
+
+def test_long_word_is_split():
+    """Una parola più larga della riga viene spezzata."""
+    font = get_font(size=40)
+    lines = wrap_text("a" * 80, font, 200)
+
+    assert len(lines) > 1
+    assert "".join(lines) == "a" * 80
+
+
+def test_fit_text_shrinks_to_fit_whole_message():
+    """Un messaggio lungo riduce il font invece di essere troncato."""
+    text = "Spotto una ragazza molto simpatica " * 8
+    short = fit_text("Ciao!", max_width=720, max_height=1000)
+    long = fit_text(text, max_width=720, max_height=1000)
+
+    assert short.size == 62
+    assert long.size < 62
+    assert not long.truncated
+    assert " ".join(long.lines).split() == text.split()
+    assert len(long.lines) * long.line_height <= 1000
+
+
+def test_fit_text_truncates_below_min_size():
+    """Oltre la dimensione minima l'ultima riga termina con i puntini."""
+    layout = fit_text("parola " * 500, max_width=400, max_height=300, min_size=30)
+
+    assert layout.truncated
+    assert layout.lines[-1].endswith("…")
+    assert len(layout.lines) * layout.line_height <= 300
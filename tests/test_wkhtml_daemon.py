@@ -0,0 +1,59 @@
+"""
+Test del demone wkhtmltoimage con un renderer finto.
+RUN: pytest tests/test_wkhtml_daemon.py -v
+"""
+
+import os
+import sys
+
+import pytest
+
+from app.image.wkhtml_daemon import PNG_SIGNATURE, WkhtmlDaemon, WkhtmlTimeout, WkhtmlUnavailable
+
+pytestmark = pytest.mark.skipif(os.name == 'nt', reason="renderer finto solo POSIX")
+
+FAKE_RENDERER = f"""#!{sys.executable}
+import sys, time
+if '--version' in sys.argv:
+    sys.exit(0)
+html = sys.stdin.read()
+if 'HANG' in html:
+    time.sleep(30)
+sys.stdout.buffer.write({PNG_SIGNATURE!r} + b'fake')
+"""
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    binary = tmp_path / "wkhtmltoimage"
+    binary.write_text(FAKE_RENDERER)
+    binary.chmod(0o755)
+    daemon = WkhtmlDaemon(binary=str(binary), workers=1, job_timeout=1)
+    yield daemon
+    daemon.shutdown()
+
+
+def test_render_returns_png_bytes(daemon):
+    """I worker restituiscono lo stdout del renderer come PNG."""
+    data = daemon.render("<html>Ciao</html>", {'width': 1080, 'quiet': ''})
+
+    assert data.startswith(PNG_SIGNATURE)
+    assert daemon.stats()["renders"] == 1
+
+
+def test_hung_renderer_is_killed(daemon):
+    """Un renderer bloccato viene terminato e il worker serve il job successivo."""
+    with pytest.raises(WkhtmlTimeout):
+        daemon.render("HANG")
+
+    assert daemon.render("ok").startswith(PNG_SIGNATURE)
+    assert daemon.stats()["timeouts"] == 1
+
+
+def test_missing_binary_is_unavailable(tmp_path):
+    """Un binario che non parte viene segnalato senza interpretare i messaggi d'errore."""
+    daemon = WkhtmlDaemon(binary=str(tmp_path / "missing"), workers=1)
+
+    with pytest.raises(WkhtmlUnavailable):
+        daemon.render("<html></html>")
+    assert daemon.stats()["available"] is False
@@ -4,11 +4,12 @@ import random
 from datetime import datetime, time as time_obj
 from sqlalchemy.orm import Session
 from app.database import SessionLocal, SpottedMessage, MessageStatus
-from app.image.generator import ImageGenerator
+from app.image.jobs import set_inline_rendering
+from app.image.renderer import get_template_renderer
 from app.bot.poster import InstagramBot
 from config import settings
 
-from app.tasks import post_daily_compilation
+from app.tasks import card_for_message, check_duplicate, post_daily_compilation, record_posted, story_frames
 
 def get_db():
     return SessionLocal()
@@ -29,19 +30,14 @@ def process_single_story():
 
         print(f"--- DEBUG [WORKER]: Trovato messaggio ID {message_to_post.id}. Inizio processamento. ---", flush=True)
         try:
-            image_generator = ImageGenerator()
-            output_filename = f"spotted_{message_to_post.id}_{int(datetime.now().timestamp())}.png"
-            print(f"--- DEBUG [WORKER]: Generazione immagine {output_filename}... ---", flush=True)
-            image_path = image_generator.from_text(
-                message_to_post.text, 
-                output_filename,
-                message_to_post.id
-            )
-            if not image_path: raise Exception("Generazione immagine ha restituito None.")
-            print(f"--- DEBUG [WORKER]: Immagine generata: {image_path}. Inizio pubblicazione... ---", flush=True)
+            # Card pre-renderizzata all'approvazione: qui si carica solo il file
+            image_path = card_for_message(message_to_post)
+            if check_duplicate(message_to_post, image_path):
+                return
+            print(f"--- DEBUG [WORKER]: Card pronta: {image_path}. Inizio pubblicazione... ---", flush=True)
 
             insta_bot = InstagramBot()
-            result = insta_bot.post_story(image_path)
+            result = insta_bot.post_story_sequence(story_frames(message_to_post))
             
             if not result:
                 raise Exception("InstagramBot.post_story ha restituito False o None.")
@@ -60,6 +56,7 @@ def process_single_story():
             message_to_post.posted_at = datetime.utcnow()
             message_to_post.error_message = None
             message_to_post.media_pk = str(media_pk)
+            record_posted(message_to_post)
         except Exception as e:
             print(f"--- DEBUG [WORKER]: ERRORE durante processamento ID {message_to_post.id}: {e} ---", flush=True)
             message_to_post.status = MessageStatus.FAILED
@@ -91,19 +88,12 @@ def scheduled_daily_compilation():
             try:
                 time.sleep(random.randint(10, 30))
                 print(f"--- DEBUG [WORKER]: Pubblicazione messaggio ID {message.id} ---", flush=True)
-                image_generator = ImageGenerator()
-                output_filename = f"spotted_{message.id}_{int(datetime.now().timestamp())}.png"
-                image_path = image_generator.from_text(
-                    message.text, 
-                    output_filename,
-                    message.id
-                )
-                
-                if not image_path:
-                    raise Exception("Generazione immagine fallita")
+                image_path = card_for_message(message)
+                if check_duplicate(message, image_path):
+                    continue
                 
                 insta_bot = InstagramBot()
-                result = insta_bot.post_story(image_path)
+                result = insta_bot.post_story_sequence(story_frames(message))
                 
                 if not result:
                     raise Exception("Posting Instagram fallito")
@@ -120,6 +110,7 @@ def scheduled_daily_compilation():
                 message.posted_at = datetime.utcnow()
                 message.error_message = None
                 message.media_pk = str(media_pk)
+                record_posted(message)
                 
                 print(f"--- DEBUG [WORKER]: Messaggio ID {message.id} pubblicato con successo ---", flush=True)
                 
@@ -139,6 +130,13 @@ def scheduled_daily_compilation():
 def main():
     """Avvia lo scheduler del worker."""
     print("--- Avvio del Worker di InstaSpotter ---", flush=True)
+
+    # Il worker è un processo separato dall'app web: le card le genera da sé
+    set_inline_rendering(True)
+
+    # Precompila i template delle card prima del primo job; il watcher applica
+    # modifiche ai template e cambi di template fatti dall'admin
+    get_template_renderer().start_watching()
     
     # Job per le storie singole (ogni tot secondi)
     story_interval = settings.automation.check_interval_seconds